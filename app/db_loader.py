@@ -3,6 +3,7 @@ import sqlite3
 import os
 import  tkinter
 from tkinter  import Tk, filedialog
+from db_loaderwithimg import write_typed_table
 
 
 def load_data_to_sqlite(file_path, db_name=None, table_name="filled_asset_data"):
@@ -26,7 +27,7 @@ def load_data_to_sqlite(file_path, db_name=None, table_name="filled_asset_data")
         os.makedirs(dir_path, exist_ok=True)
 
     conn = sqlite3.connect(db_name)
-    df.to_sql(table_name, conn, if_exists='replace', index=False)
+    write_typed_table(df, conn, table_name)
     conn.close()
 
     print(f"📦 Data written to {db_name} (table: {table_name})")
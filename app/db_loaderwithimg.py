@@ -1,27 +1,296 @@
 import pandas as pd
 import sqlite3
 import os
+import re
+import argparse
+import time
+from datetime import date, datetime
 
-def add_upload_columns_if_missing(db_name):
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
+# ---------------------------
+# Column typing
+# ---------------------------
+# Declared types written to the table. DATE and YEARS have NUMERIC affinity, so ISO date
+# strings stay text and year counts are stored as integers; the schema cache explains
+# both types to the SQL-generation prompt.
+DATE_PATTERN = re.compile(r"^\d{2}/\d{2}/\d{4}$")
+YEARS_PATTERN = re.compile(r"^\d+\s+Years?$", re.IGNORECASE)
+# What a value must look like to convert to a declared type without loss (see normalize_columns)
+CONVERTIBLE_PATTERNS = {
+    "DATE": r"^\d{2}/\d{2}/\d{4}$",
+    "YEARS": r"^\d+(\s+Years?)?$",
+    "INTEGER": r"^-?\d+(\.0+)?$",
+}
 
-    columns = [
-        ("uploaded_file_name", "TEXT"),
-        ("uploaded_file_type", "TEXT"),
-        ("uploaded_file_data", "BLOB"),
-        ("upload_date", "TEXT")
-    ]
+# Upsert bookkeeping: one content hash per Equipment ID
+KEY_COLUMN = "Equipment ID"
+ROW_HASH_TABLE = "asset_row_hashes"
+DEFAULT_CHUNKSIZE = 20000
+ROWS_PER_TRANSACTION = 100000
+
+# Identifier and commonly filtered columns that get a secondary index (when present)
+INDEXED_COLUMNS = [
+    "Equipment ID",
+    "Part ID",
+    "Serial No",
+    "Property Line",
+    "Location",
+    "Asset Owner",
+    "Asset Use Indicator",
+    "Install Date",
+    "Warranty Start",
+    "Decommissioning Date",
+    "Card Life Will Reach",
+]
+
+# Free-text columns indexed for keyword search (MATCH + bm25 instead of LIKE '%...%')
+FTS_TABLE = "asset_fts"
+FTS_COLUMNS = [
+    "Part Description",
+    "Eng Comment",
+    "Modifications",
+    "Asset Use Description",
+]
+
+# Lifecycle rollups: per-asset end dates (warranty expiry computed once instead of per
+# question) and asset counts per year of each end date, grouped by these columns. Both
+# are kept in sync by triggers, so every writer (loader, upsert, uploads) refreshes them.
+LIFECYCLE_TABLE = "asset_lifecycle"
+LIFECYCLE_COUNTS_TABLE = "asset_lifecycle_counts"
+LIFECYCLE_DIMENSIONS = ["Property Line", "Location", "Asset Owner"]
+LIFECYCLE_ALL = "All"  # dimension (and value) of the counts over every asset
+
+
+def _all_match(series, pattern):
+    values = series.dropna().astype(str).str.strip()
+    values = values[values != ""]
+    return not values.empty and values.str.match(pattern).all()
 
-    for column_name, column_type in columns:
-        try:
-            cursor.execute(f"ALTER TABLE filled_asset_data ADD COLUMN {column_name} {column_type}")
-            print(f"✅ Column added: {column_name}")
-        except sqlite3.OperationalError:
-            print(f"ℹ️ Column already exists: {column_name}")
 
+def infer_column_types(df):
+    """Maps every column to DATE, YEARS, INTEGER, REAL or TEXT based on its values."""
+    column_types = {}
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            column_types[col] = "DATE"  # read_excel already parsed it
+        elif pd.api.types.is_integer_dtype(series) or pd.api.types.is_bool_dtype(series):
+            column_types[col] = "INTEGER"
+        elif pd.api.types.is_float_dtype(series):
+            non_null = series.dropna()
+            column_types[col] = "INTEGER" if not non_null.empty and (non_null % 1 == 0).all() else "REAL"
+        elif _all_match(series, DATE_PATTERN):
+            column_types[col] = "DATE"
+        elif _all_match(series, YEARS_PATTERN):
+            column_types[col] = "YEARS"
+        else:
+            column_types[col] = "TEXT"
+    return column_types
+
+
+def normalize_columns(df, column_types, unconverted=None):
+    """
+    Rewrites DD/MM/YYYY dates as ISO-8601 (YYYY-MM-DD) and "6 Years" as the integer 6.
+    With unconverted (a dict), values that don't fit their column's type keep their
+    original text instead of becoming NULL, and unconverted[col] counts them; streamed
+    chunks are normalized with the types inferred from the first one.
+    """
+    df = df.copy()
+    for col, col_type in column_types.items():
+        if unconverted is not None and col_type in CONVERTIBLE_PATTERNS and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            text = df[col].astype(str).str.strip()
+            misfits = df[col].notna() & (text != "") & ~text.str.match(CONVERTIBLE_PATTERNS[col_type], case=False)
+            if misfits.any():
+                unconverted[col] = unconverted.get(col, 0) + int(misfits.sum())
+                original = df[col].astype(object)
+                df[col] = normalize_columns(df[[col]], {col: col_type})[col].astype(object).where(~misfits, original)
+                continue
+        if col_type == "DATE":
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                parsed = df[col]
+            else:
+                parsed = pd.to_datetime(df[col], format="%d/%m/%Y", errors="coerce")
+            df[col] = parsed.dt.strftime("%Y-%m-%d").where(parsed.notna(), None)
+        elif col_type in ("YEARS", "INTEGER") and not pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col].astype(str).str.extract(r"(-?\d+)", expand=False), errors="coerce").astype("Int64")
+    return df
+
+
+def create_asset_indexes(conn, table_name="filled_asset_data", analyze=True):
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    for col in INDEXED_COLUMNS:
+        if col in existing:
+            index_name = "idx_" + table_name + "_" + re.sub(r"\W+", "_", col.lower()).strip("_")
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ("{col}")')
+    # A full ANALYZE after a fresh load; PRAGMA optimize only re-analyzes what changed
+    conn.execute("ANALYZE" if analyze else "PRAGMA optimize")
     conn.commit()
-    conn.close()
+
+
+def ensure_fts_index(conn, table_name="filled_asset_data"):
+    """
+    Creates the FTS5 index over the free-text columns (external content, so the text is
+    not stored twice) plus the triggers that keep it in sync, and fills it when it is new.
+    """
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    columns = [col for col in FTS_COLUMNS if col in existing]
+    if not columns:
+        return
+    quoted = ", ".join(f'"{col}"' for col in columns)
+    new_values = ", ".join(f'new."{col}"' for col in columns)
+    old_values = ", ".join(f'old."{col}"' for col in columns)
+    is_new = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).fetchone() is None
+
+    conn.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        {quoted}, content='{table_name}', content_rowid='rowid', tokenize='porter unicode61')""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON "{table_name}" BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {quoted}) VALUES (new.rowid, {new_values});
+    END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON "{table_name}" BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {quoted}) VALUES ('delete', old.rowid, {old_values});
+    END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {quoted} ON "{table_name}" BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {quoted}) VALUES ('delete', old.rowid, {old_values});
+        INSERT INTO {FTS_TABLE}(rowid, {quoted}) VALUES (new.rowid, {new_values});
+    END""")
+    if is_new:
+        conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        print(f"🔎 Full-text index {FTS_TABLE} built over: {', '.join(columns)}")
+    conn.commit()
+
+
+def _iso_date_sql(expr):
+    # ISO text stays as is; DD/MM/YYYY text (a table loaded before columns were typed) is converted
+    return (f"CASE WHEN {expr} LIKE '__/__/____' THEN substr({expr}, 7, 4) || '-' || substr({expr}, 4, 2) || '-' "
+            f"|| substr({expr}, 1, 2) ELSE date({expr}) END")
+
+
+def _lifecycle_columns(existing):
+    """
+    Rollup columns present for this table: {rollup column: SQL over the base row with
+    prefix "{row}"}, {event name: rollup column} for the counts table, and the base
+    columns they are computed from.
+    """
+    sources = [col for col in [KEY_COLUMN] + LIFECYCLE_DIMENSIONS if col in existing]
+    columns = {col: '{row}."' + col + '"' for col in sources}
+    events = {}
+    if "Warranty Start" in existing and "Warranty Period" in existing:
+        start = _iso_date_sql('{row}."Warranty Start"')
+        columns["Warranty Expiry Date"] = f"date({start}, '+' || CAST({{row}}.\"Warranty Period\" AS INTEGER) || ' years')"
+        events["warranty_expiry"] = "Warranty Expiry Date"
+        sources += ["Warranty Start", "Warranty Period"]
+    for event, col in (("decommissioning", "Decommissioning Date"), ("card_end_of_life", "Card Life Will Reach")):
+        if col in existing:
+            columns[col] = _iso_date_sql('{row}."' + col + '"')
+            events[event] = col
+            sources.append(col)
+    return columns, events, sources
+
+
+def _lifecycle_count_keys(prefix, dimensions, events):
+    """SELECT yielding one (dimension, dimension_value, event, year) per count a lifecycle row contributes to."""
+    dimension_rows = " UNION ALL ".join(
+        [f"SELECT '{LIFECYCLE_ALL}' AS dimension, '{LIFECYCLE_ALL}' AS dimension_value"]
+        + [f"SELECT '{dim}', {prefix}.\"{dim}\"" for dim in dimensions])
+    event_rows = " UNION ALL ".join(
+        f"SELECT '{event}'{' AS event' if n == 0 else ''}, CAST(strftime('%Y', {prefix}.\"{col}\") AS INTEGER){' AS year' if n == 0 else ''}"
+        for n, (event, col) in enumerate(events.items()))
+    return (f"SELECT d.dimension, d.dimension_value, e.event, e.year FROM ({dimension_rows}) AS d, ({event_rows}) AS e "
+            f"WHERE d.dimension_value IS NOT NULL AND e.year IS NOT NULL")
+
+
+def ensure_lifecycle_rollups(conn, table_name="filled_asset_data", rebuild=False):
+    """
+    Creates the lifecycle rollup tables, fills them in bulk when they are new (or the base
+    table was replaced, which drops its triggers) and installs the triggers that keep them
+    in sync with every later insert, update and delete.
+    """
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    columns, events, sources = _lifecycle_columns(existing)
+    if not events:
+        return
+    dimensions = [col for col in LIFECYCLE_DIMENSIONS if col in columns]
+    trigger_prefix = LIFECYCLE_TABLE + "_" + re.sub(r"\W+", "_", table_name)
+    installed = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                             (trigger_prefix + "_ai",)).fetchone() is not None
+    if installed and not rebuild:
+        return
+
+    started = time.perf_counter()
+    conn.execute(f"DROP TABLE IF EXISTS {LIFECYCLE_TABLE}")
+    conn.execute(f"DROP TABLE IF EXISTS {LIFECYCLE_COUNTS_TABLE}")
+    for suffix in ("ai", "ad", "au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger_prefix}_{suffix}")
+
+    quoted = ", ".join(f'"{col}"' for col in columns)
+    conn.execute(f"CREATE TABLE {LIFECYCLE_TABLE} ("
+                 + ", ".join(f'"{col}" {"DATE" if col in events.values() else "TEXT"}' for col in columns) + ")")
+    conn.execute(f"""CREATE TABLE {LIFECYCLE_COUNTS_TABLE} (
+        dimension TEXT NOT NULL, dimension_value TEXT NOT NULL, event TEXT NOT NULL, year INTEGER NOT NULL,
+        asset_count INTEGER NOT NULL, PRIMARY KEY (dimension, dimension_value, event, year)) WITHOUT ROWID""")
+
+    # Bulk fill (then index) first; the per-row triggers only handle changes from here on
+    select_base = ", ".join(expr.format(row="t") for expr in columns.values())
+    conn.execute(f'INSERT INTO {LIFECYCLE_TABLE} ({quoted}) SELECT {select_base} FROM "{table_name}" AS t')
+    grouped = " UNION ALL ".join(
+        f"SELECT '{dim}', {value}, '{event}', CAST(strftime('%Y', \"{col}\") AS INTEGER), COUNT(*) FROM {LIFECYCLE_TABLE} "
+        f"WHERE {value} IS NOT NULL AND \"{col}\" IS NOT NULL GROUP BY 2, 4"
+        for dim, value in [(LIFECYCLE_ALL, f"'{LIFECYCLE_ALL}'")] + [(dim, f'"{dim}"') for dim in dimensions]
+        for event, col in events.items())
+    conn.execute(f"INSERT INTO {LIFECYCLE_COUNTS_TABLE} (dimension, dimension_value, event, year, asset_count) {grouped}")
+    for col in [KEY_COLUMN] + list(events.values()):
+        if col in columns:
+            index_name = "idx_" + LIFECYCLE_TABLE + "_" + re.sub(r"\W+", "_", col.lower()).strip("_")
+            conn.execute(f'CREATE INDEX "{index_name}" ON {LIFECYCLE_TABLE} ("{col}")')
+
+    # Base table → per-asset rows. Rows are matched on their values, not the base rowid
+    # (VACUUM may renumber it); rows with identical values are interchangeable anyway.
+    new_values = ", ".join(expr.format(row="new") for expr in columns.values())
+    # Unary + keeps the lookup on the Equipment ID index rather than a low-selectivity date index
+    old_match = " AND ".join(f'{"" if col == KEY_COLUMN else "+"}"{col}" IS {expr.format(row="old")}'
+                             for col, expr in columns.items())
+    delete_old = f"DELETE FROM {LIFECYCLE_TABLE} WHERE rowid = (SELECT rowid FROM {LIFECYCLE_TABLE} WHERE {old_match} LIMIT 1);"
+    insert_new = f"INSERT INTO {LIFECYCLE_TABLE} ({quoted}) VALUES ({new_values});"
+    conn.execute(f'CREATE TRIGGER {trigger_prefix}_ai AFTER INSERT ON "{table_name}" BEGIN {insert_new} END')
+    conn.execute(f'CREATE TRIGGER {trigger_prefix}_ad AFTER DELETE ON "{table_name}" BEGIN {delete_old} END')
+    conn.execute(f"""CREATE TRIGGER {trigger_prefix}_au AFTER UPDATE OF {", ".join(f'"{col}"' for col in sources)}
+        ON "{table_name}" BEGIN {delete_old} {insert_new} END""")
+
+    # Per-asset rows → counts (a count that drops to zero is removed)
+    key = "dimension, dimension_value, event, year"
+    conn.execute(f"""CREATE TRIGGER {LIFECYCLE_COUNTS_TABLE}_ai AFTER INSERT ON {LIFECYCLE_TABLE} BEGIN
+        INSERT INTO {LIFECYCLE_COUNTS_TABLE} ({key}, asset_count) SELECT *, 1 FROM ({_lifecycle_count_keys("new", dimensions, events)}) WHERE true
+        ON CONFLICT DO UPDATE SET asset_count = asset_count + 1;
+    END""")
+    conn.execute(f"""CREATE TRIGGER {LIFECYCLE_COUNTS_TABLE}_ad AFTER DELETE ON {LIFECYCLE_TABLE} BEGIN
+        INSERT INTO {LIFECYCLE_COUNTS_TABLE} ({key}, asset_count) SELECT *, 0 FROM ({_lifecycle_count_keys("old", dimensions, events)}) WHERE true
+        ON CONFLICT DO UPDATE SET asset_count = asset_count - 1;
+    END""")
+    conn.execute(f"""CREATE TRIGGER {LIFECYCLE_COUNTS_TABLE}_zero AFTER UPDATE OF asset_count ON {LIFECYCLE_COUNTS_TABLE}
+        WHEN new.asset_count <= 0 BEGIN
+        DELETE FROM {LIFECYCLE_COUNTS_TABLE} WHERE dimension = new.dimension AND dimension_value = new.dimension_value
+            AND event = new.event AND year = new.year;
+    END""")
+    conn.commit()
+    print(f"📅 Lifecycle rollups {LIFECYCLE_TABLE}/{LIFECYCLE_COUNTS_TABLE} built in {time.perf_counter() - started:.1f}s "
+          f"(events: {', '.join(events)}; grouped by: {', '.join(dimensions) or 'nothing'})")
+
+
+def write_typed_table(df, conn, table_name="filled_asset_data"):
+    """Infers column types, normalizes values, replaces the table with declared types and indexes it."""
+    column_types = infer_column_types(df)
+    df = normalize_columns(df, column_types)
+    # The full-text index points at rowids of the table being replaced; rebuilt below
+    conn.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    df.to_sql(table_name, conn, if_exists='replace', index=False, dtype=column_types)
+    # Row hashes describe the old table; the next upsert rebuilds them (see upsert_data_to_sqlite)
+    conn.execute(f"DROP TABLE IF EXISTS {ROW_HASH_TABLE}")
+    create_asset_indexes(conn, table_name)
+    ensure_fts_index(conn, table_name)
+    ensure_lifecycle_rollups(conn, table_name)  # the replaced table took the old triggers with it
+    typed = {col: t for col, t in column_types.items() if t != "TEXT"}
+    print(f"🔢 Typed columns: {typed}")
+    return column_types
+
 
 def load_data_to_sqlite(file_path, db_name=None, table_name="filled_asset_data"):
     # Default path to app/assets_data.db
@@ -44,24 +313,231 @@ def load_data_to_sqlite(file_path, db_name=None, table_name="filled_asset_data")
     if dir_path and not os.path.exists(dir_path):
         os.makedirs(dir_path, exist_ok=True)
 
-    # Save the asset data
+    # Save the asset data with declared column types, ISO dates and indexes
     conn = sqlite3.connect(db_name)
-    df.to_sql(table_name, conn, if_exists='replace', index=False)
+    write_typed_table(df, conn, table_name)
     conn.close()
 
     print(f"📦 Data written to {db_name} (table: {table_name})")
 
-    # Ensure upload fields exist
-    add_upload_columns_if_missing(db_name)
+# ---------------------------
+# Streaming, incremental upsert
+# ---------------------------
+def _excel_cell_to_text(value):
+    # Same text shape read_csv(dtype=str) produces, so both sources type identically
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%d/%m/%Y")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def iter_source_chunks(file_path, chunksize=DEFAULT_CHUNKSIZE):
+    """Yields the sheet as DataFrames of at most chunksize rows, every cell as text (or None)."""
+    if file_path.endswith('.csv'):
+        yield from pd.read_csv(file_path, chunksize=chunksize, dtype=str, keep_default_na=False, na_values=[""])
+    elif file_path.endswith('.xlsx'):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(col) for col in next(rows)]
+            batch = []
+            for row in rows:
+                if all(value is None for value in row):
+                    continue
+                batch.append([_excel_cell_to_text(value) for value in row])
+                if len(batch) >= chunksize:
+                    yield pd.DataFrame(batch, columns=header)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=header)
+        finally:
+            workbook.close()
+    else:
+        raise ValueError("Streaming upsert supports .csv or .xlsx")
+
+
+def _table_columns(conn, table_name):
+    return {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+
+
+def _prepare_target_table(conn, table_name, chunk):
+    """
+    Creates the table from the first chunk's inferred types, or adds any new columns to
+    an existing one. Returns the declared types used to normalize every chunk.
+    """
+    # Chunks arrive as text; give fully numeric columns a numeric dtype so they type like read_csv would
+    sample = chunk.copy()
+    for col in sample.columns:
+        numeric = pd.to_numeric(sample[col], errors="coerce")
+        if numeric.notna().sum() == sample[col].notna().sum() and numeric.notna().any():
+            sample[col] = numeric
+    inferred = infer_column_types(sample)
+    existing = _table_columns(conn, table_name)
+    if not existing:
+        columns_sql = ", ".join(f'"{col}" {col_type}' for col, col_type in inferred.items())
+        conn.execute(f'CREATE TABLE "{table_name}" ({columns_sql})')
+        existing = dict(inferred)
+    for col, col_type in inferred.items():
+        if col not in existing:
+            conn.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{col}" {col_type}')
+            existing[col] = col_type
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {ROW_HASH_TABLE} ("{KEY_COLUMN}" TEXT PRIMARY KEY, row_hash INTEGER NOT NULL)')
+    return {col: existing[col].upper() for col in chunk.columns}
+
+
+def _fetch_keyed(conn, sql, keys, batch_size=10000):
+    # Stays under SQLITE_MAX_VARIABLE_NUMBER whatever --chunksize is
+    rows = []
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        rows.extend(conn.execute(sql.format(placeholders=", ".join("?" for _ in batch)), batch).fetchall())
+    return rows
+
+
+def find_duplicate_keys(file_path, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    ({Equipment ID: position of its last row} for IDs that appear more than once, number of
+    earlier rows those supersede). Positions count every data row of the file from 0.
+    """
+    last_rows, occurrences, position = {}, {}, 0
+    for chunk in iter_source_chunks(file_path, chunksize):
+        for key in chunk[KEY_COLUMN]:
+            if pd.notna(key):
+                last_rows[key] = position
+                occurrences[key] = occurrences.get(key, 0) + 1
+            position += 1
+    duplicated = {key: last_rows[key] for key, count in occurrences.items() if count > 1}
+    return duplicated, sum(count - 1 for count in occurrences.values())
+
+
+def _upsert_chunk(conn, table_name, chunk, counts, first_position=0, last_rows=None):
+    # Only the last row of a duplicated ID is written (as a sequence of upserts would end),
+    # wherever its earlier rows are, so re-upserting an unchanged file writes nothing
+    last_rows = last_rows or {}
+    latest = [last_rows.get(key, position) == position
+              for position, key in enumerate(chunk[KEY_COLUMN], start=first_position)]
+    chunk = chunk[chunk[KEY_COLUMN].notna() & pd.Series(latest, index=chunk.index, dtype=bool)]
+    if chunk.empty:
+        return
+
+    # Content hash per row (vectorized) of the values as written, so it doesn't depend on a
+    # column's dtype in this chunk (e.g. a YEARS column holding one unconverted text value);
+    # stored as a signed 64-bit INTEGER
+    records = chunk.astype(object).where(chunk.notna(), None)
+    hashes = pd.util.hash_pandas_object(records, index=False).astype("int64")
+    keys = chunk[KEY_COLUMN].tolist()
+    existing_ids = {row[0] for row in _fetch_keyed(
+        conn, f'SELECT "{KEY_COLUMN}" FROM "{table_name}" WHERE "{KEY_COLUMN}" IN ({{placeholders}})', keys)}
+    stored_hashes = dict(_fetch_keyed(
+        conn, f'SELECT "{KEY_COLUMN}", row_hash FROM {ROW_HASH_TABLE} WHERE "{KEY_COLUMN}" IN ({{placeholders}})', keys))
+
+    is_new = ~chunk[KEY_COLUMN].isin(existing_ids)
+    is_unchanged = ~is_new & (chunk[KEY_COLUMN].map(stored_hashes) == hashes)
+    is_changed = ~is_new & ~is_unchanged
+    counts["inserted"] += int(is_new.sum())
+    counts["updated"] += int(is_changed.sum())
+    counts["unchanged"] += int(is_unchanged.sum())
+
+    columns = list(chunk.columns)
+    if is_new.any():
+        placeholders = ", ".join("?" for _ in columns)
+        column_list = ", ".join(f'"{col}"' for col in columns)
+        conn.executemany(f'INSERT INTO "{table_name}" ({column_list}) VALUES ({placeholders})',
+                         records[is_new].itertuples(index=False, name=None))
+    if is_changed.any():
+        value_columns = [col for col in columns if col != KEY_COLUMN]
+        assignments = ", ".join(f'"{col}" = ?' for col in value_columns)
+        conn.executemany(f'UPDATE "{table_name}" SET {assignments} WHERE "{KEY_COLUMN}" = ?',
+                         records[is_changed][value_columns + [KEY_COLUMN]].itertuples(index=False, name=None))
+    touched = ~is_unchanged
+    if touched.any():
+        conn.executemany(f'INSERT OR REPLACE INTO {ROW_HASH_TABLE} ("{KEY_COLUMN}", row_hash) VALUES (?, ?)',
+                         zip(chunk.loc[touched, KEY_COLUMN], hashes[touched].tolist()))
+
+
+def upsert_data_to_sqlite(file_path, db_name=None, table_name="filled_asset_data", chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Streams the sheet in chunks and upserts it on "Equipment ID", writing only rows whose
+    content hash changed. Unlike load_data_to_sqlite this never drops the table, so
+    uploaded documents and any other columns survive a refresh.
+    """
+    if db_name is None:
+        db_name = os.path.join(os.path.dirname(__file__), "assets_data.db")
+    dir_path = os.path.dirname(db_name)
+    if dir_path and not os.path.exists(dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+
+    started = time.perf_counter()
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "duplicates": 0, "unconverted": {}}
+    # A first pass over the IDs only: duplicates may sit in different chunks
+    last_rows, counts["duplicates"] = find_duplicate_keys(file_path, chunksize)
+    conn = sqlite3.connect(db_name)
+    try:
+        # Bulk-load tuning: WAL keeps app readers working, no fsync per commit, big page cache
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA wal_autocheckpoint = 0")
+        conn.execute("PRAGMA cache_size = -262144")
+        conn.execute("PRAGMA temp_store = MEMORY")
+
+        column_types, rows_in_transaction, position = None, 0, 0
+        for chunk in iter_source_chunks(file_path, chunksize):
+            if column_types is None:
+                column_types = _prepare_target_table(conn, table_name, chunk)
+                create_asset_indexes(conn, table_name, analyze=False)  # the key lookups below need them
+                ensure_fts_index(conn, table_name)  # its triggers then index every inserted/updated row
+                ensure_lifecycle_rollups(conn, table_name)  # same for the lifecycle rollups
+            normalized = normalize_columns(chunk, column_types, counts["unconverted"])
+            _upsert_chunk(conn, table_name, normalized, counts, position, last_rows)
+            position += len(chunk)
+            rows_in_transaction += len(chunk)
+            if rows_in_transaction >= ROWS_PER_TRANSACTION:
+                conn.commit()
+                rows_in_transaction = 0
+        conn.commit()
+
+        create_asset_indexes(conn, table_name, analyze=False)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA wal_autocheckpoint = 1000")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"📦 Upserted {file_path} into {db_name} (table: {table_name}) in {elapsed:.1f}s: "
+          f"{counts['inserted']} inserted, {counts['updated']} updated, {counts['unchanged']} unchanged"
+          + (f", {counts['duplicates']} duplicate Equipment IDs in the file (last one kept)" if counts["duplicates"] else ""))
+    if counts["unconverted"]:
+        print(f"⚠️ Values that don't fit the column type inferred from the first chunk were kept as text: "
+              f"{counts['unconverted']}")
+    return counts
+
 
 # ---------------------------
 # Run script interactively
 # ---------------------------
 if __name__ == "__main__":
-    print("📂 Enter the full path to your Excel or CSV file:")
-    file_path = input("> ").strip()
+    parser = argparse.ArgumentParser(description="Load the asset sheet into SQLite.")
+    parser.add_argument("file_path", nargs="?", help="Excel or CSV file (prompted for when omitted)")
+    parser.add_argument("--upsert", action="store_true",
+                        help="Stream the file and upsert on Equipment ID instead of replacing the table (keeps uploaded documents)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args()
+
+    file_path = args.file_path
+    if not file_path:
+        print("📂 Enter the full path to your Excel or CSV file:")
+        file_path = input("> ").strip()
 
     if os.path.exists(file_path):
-        load_data_to_sqlite(file_path)
+        if args.upsert:
+            upsert_data_to_sqlite(file_path, chunksize=args.chunksize)
+        else:
+            load_data_to_sqlite(file_path)
     else:
         print("❌ File not found. Please check the path and try again.")
@@ -0,0 +1,119 @@
+# app_state.py (State shared by every Streamlit rerun and session)
+#
+# Streamlit re-executes the UI script from the top on every widget interaction. What
+# should survive a rerun lives here:
+#   - st.cache_resource: one shared object, never copied (LLM clients, connection pools,
+#     the schema snapshot), created once per process by warm_up()
+#   - st.cache_data: immutable values handed out as copies (thumbnails and document bytes,
+#     which are content-addressed and so never stale, similarity results, sidebar panels)
+# Uploads and reloads call the invalidation hooks at the bottom.
+import time
+
+import streamlit as st
+
+import db_pool
+import document_store
+import schema_cache
+import schema_linking
+import smatbotest_async
+import smatbotest_v
+import telemetry
+import thumbnails
+from phash_index import find_similar
+
+
+# -----------------------------
+# Config
+# -----------------------------
+PANEL_TTL_SECONDS = 15                 # sidebar metrics may lag this much behind
+SIMILAR_TTL_SECONDS = 300
+RESULT_PAGE_TTL_SECONDS = 60           # a page stays put while the user clicks around it
+RESULT_PAGE_CACHE_ENTRIES = 64
+THUMBNAIL_CACHE_ENTRIES = 1000
+DOCUMENT_CACHE_ENTRIES = 16            # originals can be several MB each
+
+
+# -----------------------------
+# Shared resources (once per process)
+# -----------------------------
+@st.cache_resource(show_spinner=False)
+def warm_up(db_path=smatbotest_v.DB_PATH, table_name=smatbotest_v.TABLE_NAME):
+    """
+    Opens the connection pool, loads the schema snapshot and creates the LLM clients
+    before the first question, so it doesn't pay for them. Returns {step: seconds or error}.
+    """
+    steps = {
+        "db_pool": lambda: db_pool.get_pool(db_path),
+        "document_schema": lambda: document_store.ensure_schema_once(db_path),
+        "table_schema": lambda: schema_cache.get_schema(db_path, table_name),
+        "llm_client": smatbotest_v.get_llm_client,
+        "async_llm_client": smatbotest_async.get_async_llm_client,
+    }
+    timings = {}
+    for name, step in steps.items():
+        started = time.perf_counter()
+        try:
+            step()
+            timings[name] = round(time.perf_counter() - started, 4)
+        except Exception as e:  # e.g. no database yet: the first question reports it properly
+            timings[name] = f"{type(e).__name__}: {e}"
+    return timings
+
+
+# -----------------------------
+# Cached values
+# -----------------------------
+@st.cache_data(ttl=PANEL_TTL_SECONDS, show_spinner=False)
+def pipeline_latency(db_path, window_s=3600):
+    telemetry.flush()
+    return telemetry.stage_summary(db_path, window_s=window_s)
+
+
+@st.cache_data(max_entries=THUMBNAIL_CACHE_ENTRIES, show_spinner=False)
+def thumbnail(db_path, sha256, mime):
+    """thumbnails.ensure_thumbnail, without its SQLite round trips on every rerun."""
+    return thumbnails.ensure_thumbnail(db_path, sha256, mime)
+
+
+@st.cache_data(max_entries=DOCUMENT_CACHE_ENTRIES, show_spinner=False)
+def document_bytes(sha256):
+    return smatbotest_v.load_document_bytes(sha256)
+
+
+@st.cache_data(ttl=RESULT_PAGE_TTL_SECONDS, max_entries=RESULT_PAGE_CACHE_ENTRIES, show_spinner=False)
+def result_page(sql_query, params, cursor):
+    return smatbotest_v.fetch_result_page(sql_query, tuple(params), cursor)
+
+
+@st.cache_data(ttl=RESULT_PAGE_TTL_SECONDS, max_entries=RESULT_PAGE_CACHE_ENTRIES, show_spinner=False)
+def document_page(sql_query, params, cursor):
+    return smatbotest_v.fetch_document_page(sql_query, tuple(params), cursor)
+
+
+@st.cache_data(ttl=SIMILAR_TTL_SECONDS, show_spinner=False)
+def similar_documents(db_path, sha256):
+    return find_similar(db_path, sha256)
+
+
+# -----------------------------
+# Invalidation hooks
+# -----------------------------
+def on_documents_changed():
+    """After an upload: document lists and which photos look alike may have changed; thumbnails and bytes are keyed by content and stay valid."""
+    similar_documents.clear()
+    document_page.clear()
+
+
+def on_data_reloaded(db_path=smatbotest_v.DB_PATH):
+    """After the asset sheet was (re)loaded: schema snapshot, value dictionaries and every cached value."""
+    schema_cache.invalidate(db_path)
+    schema_linking.invalidate(db_path)
+    st.cache_data.clear()
+
+
+def reset_connections():
+    """Closes pooled connections and LLM clients; the next warm_up() recreates them."""
+    db_pool.close_all()
+    smatbotest_v.client = None
+    smatbotest_async.async_client = None
+    st.cache_resource.clear()
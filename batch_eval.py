@@ -0,0 +1,261 @@
+# batch_eval.py (Run a file of canned questions through the NL → SQL → answer pipeline)
+#
+# Usage:
+#   python batch_eval.py questions.txt -o results.jsonl --workers 8 --rpm 30
+#
+# Input may be a .txt file (one question per line), a .csv with a "question" column or
+# a .jsonl file with a "question" field. Results are appended to the output file
+# (.csv or .jsonl) as each question finishes; a re-run skips questions already answered
+# and retries the ones that failed (their old records are replaced). --no-resume starts
+# the output file over.
+import argparse
+import csv
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import smatbotest_v
+from sql_cache import normalize_question
+
+
+# -----------------------------
+# Config
+# -----------------------------
+DEFAULT_WORKERS = 4
+DEFAULT_REQUESTS_PER_MINUTE = 30
+DEFAULT_RETRIES = 3
+BACKOFF_BASE_SECONDS = 2.0
+RESULT_FIELDS = ["question", "occurrences", "sql_query", "params", "routed", "sql_attempt", "rows", "answer",
+                 "error", "attempts", "elapsed_s"]
+
+
+# -----------------------------
+# Rate limiting
+# -----------------------------
+class TokenBucket:
+    """
+    Thread-safe token bucket: refills at rate_per_minute and holds at most burst tokens.
+    acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = float(burst if burst is not None else max(1, int(rate_per_minute // 10)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_second)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate_per_second
+            time.sleep(wait)
+
+
+# -----------------------------
+# Input / output
+# -----------------------------
+def load_questions(path):
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            return [row["question"] for row in csv.DictReader(f) if row.get("question", "").strip()]
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line)["question"] for line in f if line.strip()]
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def deduplicate(questions):
+    """Collapses questions that normalize to the same text; returns {question: occurrences} in input order."""
+    unique, seen = {}, {}
+    for question in questions:
+        key = normalize_question(question)
+        if key in seen:
+            unique[seen[key]] += 1
+        else:
+            seen[key] = question
+            unique[question] = 1
+    return unique
+
+
+def _read_records(output_path):
+    if output_path.endswith(".csv"):
+        with open(output_path, newline="", encoding="utf-8") as f:
+            return list(csv.DictReader(f))
+    with open(output_path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_finished(output_path):
+    """Normalized questions already answered without an error in the output file, so a re-run can resume."""
+    if not os.path.exists(output_path):
+        return set()
+    return {normalize_question(record["question"]) for record in _read_records(output_path) if not record.get("error")}
+
+
+def drop_failed(output_path, retrying):
+    """Rewrites the output file without the failed records of questions (normalized) a resumed run is about to retry."""
+    if not os.path.exists(output_path):
+        return 0
+    records = _read_records(output_path)
+    kept = [record for record in records
+            if not record.get("error") or normalize_question(record["question"]) not in retrying]
+    if len(kept) == len(records):
+        return 0
+    temp_path = output_path + ".tmp"
+    with open(temp_path, "w", newline="", encoding="utf-8") as f:
+        if output_path.endswith(".csv"):
+            with open(output_path, newline="", encoding="utf-8") as source:
+                fieldnames = next(csv.reader(source))
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(kept)
+        else:
+            f.writelines(json.dumps(record, default=str) + "\n" for record in kept)
+    os.replace(temp_path, output_path)
+    return len(records) - len(kept)
+
+
+class ResultWriter:
+    """
+    Appends one record per finished question and flushes immediately, so a crash loses
+    nothing. With append=False the file is started over instead.
+    """
+
+    def __init__(self, output_path, append=True):
+        self.output_path = output_path
+        is_new = not append or not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self._file = open(output_path, "a" if append else "w", newline="", encoding="utf-8")
+        self._csv = None
+        if output_path.endswith(".csv"):
+            fieldnames = RESULT_FIELDS
+            if not is_new:
+                # Keep appending under the file's own header (e.g. one written before sql_attempt existed)
+                with open(output_path, newline="", encoding="utf-8") as existing:
+                    fieldnames = next(csv.reader(existing))
+                if "question" not in fieldnames:
+                    self._file.close()
+                    raise ValueError(f"{output_path} has no 'question' column; is it a batch_eval results file?")
+            self._csv = csv.DictWriter(self._file, fieldnames=fieldnames, extrasaction="ignore")
+            if is_new:
+                self._csv.writeheader()
+
+    def write(self, record):
+        if self._csv is not None:
+            self._csv.writerow({**record, "params": json.dumps(record["params"])})
+        else:
+            self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+# -----------------------------
+# Pipeline
+# -----------------------------
+def answer_one(question, occurrences=1, retries=DEFAULT_RETRIES):
+    """
+    Runs one question end to end. SQL generation retries inside generate_valid_sql (with
+    error feedback); only execution and answer synthesis are retried here, with jittered
+    exponential backoff, so a question costs at most 3 + retries LLM calls.
+    """
+    started = time.perf_counter()
+    record = {"question": question, "occurrences": occurrences, "sql_query": None, "params": [],
+              "routed": False, "sql_attempt": None, "rows": 0, "answer": None, "error": None, "attempts": 0}
+    try:
+        column_metadata, example_sql_query = smatbotest_v.extract_table_metadata()
+        outcome = smatbotest_v.generate_valid_sql(question, example_sql_query, column_metadata, smatbotest_v.TABLE_NAME)
+    except Exception as e:
+        outcome = None
+        record["error"] = f"{type(e).__name__}: {e}"
+    if outcome is not None and outcome.sql_query is None:
+        record["error"] = f"ValueError: no valid SQL after {outcome.attempts} attempts: {outcome.errors[-1]}"
+    elif outcome is not None:
+        record.update(sql_query=outcome.sql_query, params=list(outcome.params), routed=outcome.routed,
+                      sql_attempt=outcome.succeeded_on)
+        for attempt in range(1, retries + 1):
+            record["attempts"] = attempt
+            try:
+                result_df = smatbotest_v.fetch_answer_from_db(outcome.sql_query, outcome.params, raise_errors=True)
+                answer = smatbotest_v.answer_question_from_df(question, result_df)
+                record.update(rows=len(result_df), answer=answer, error=None)
+                break
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+                if attempt < retries:
+                    time.sleep(BACKOFF_BASE_SECONDS * (2 ** (attempt - 1)) * (0.5 + random.random()))
+    record["elapsed_s"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def run_batch(questions, output_path, workers=DEFAULT_WORKERS, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+              retries=DEFAULT_RETRIES, resume=True):
+    """
+    Evaluates questions with a pool of workers, sharing one token bucket across every
+    LLM call. Returns a summary dict.
+    """
+    unique = deduplicate(questions)
+    finished = set()
+    if resume:
+        finished = load_finished(output_path)
+        drop_failed(output_path, {normalize_question(q) for q in unique} - finished)
+    pending = {q: n for q, n in unique.items() if normalize_question(q) not in finished}
+
+    previous_limiter = smatbotest_v.rate_limiter
+    smatbotest_v.rate_limiter = TokenBucket(requests_per_minute)
+    # Without resume every question runs again, so the old records would only be duplicates
+    writer = ResultWriter(output_path, append=resume)
+    summary = {"questions": len(questions), "unique": len(unique), "skipped_finished": len(unique) - len(pending),
+               "succeeded": 0, "failed": 0}
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(answer_one, q, n, retries) for q, n in pending.items()]
+            for done, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                writer.write(record)
+                summary["failed" if record["error"] else "succeeded"] += 1
+                print(f"[{done}/{len(futures)}] {'❌' if record['error'] else '✅'} {record['question']}")
+    finally:
+        writer.close()
+        smatbotest_v.rate_limiter = previous_limiter
+
+    elapsed = time.perf_counter() - started
+    summary["elapsed_s"] = round(elapsed, 3)
+    summary["questions_per_minute"] = round(60 * len(pending) / elapsed, 2) if elapsed > 0 else None
+    return summary
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-evaluate questions through the NL → SQL → answer pipeline.")
+    parser.add_argument("questions", help="Questions file (.txt, .csv with a 'question' column, or .jsonl)")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="Results file (.jsonl or .csv)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent questions in flight")
+    parser.add_argument("--rpm", type=float, default=DEFAULT_REQUESTS_PER_MINUTE, help="LLM requests per minute allowed by the provider")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help="Attempts at execution + answer per question (SQL generation retries on its own)")
+    parser.add_argument("--no-resume", action="store_true", help="Re-run every question and overwrite the output file")
+    args = parser.parse_args(argv)
+
+    questions = load_questions(args.questions)
+    summary = run_batch(questions, args.output, workers=args.workers, requests_per_minute=args.rpm,
+                        retries=args.retries, resume=not args.no_resume)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# bench_phash.py (Lookup latency of the perceptual-hash index at 100k images)
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_phash.py --images 100000 --queries 500
+#
+# Builds a throwaway SQLite index of synthetic 64-bit pHashes (clusters of near-duplicates
+# plus random photos), then times multi-index lookups against a linear Hamming scan.
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import phash_index  # noqa: E402
+
+
+def _flip_bits(value, n, rng):
+    for position in rng.sample(range(64), n):
+        value ^= 1 << position
+    return value
+
+
+def synthetic_hashes(count, rng, cluster_share=0.3, cluster_size=5):
+    """(sha256, dhash, phash) rows; cluster_share of them are near-duplicates of a base photo."""
+    rows = []
+    while len(rows) < count:
+        base = rng.getrandbits(64)
+        members = cluster_size if rng.random() < cluster_share else 1
+        for _ in range(min(members, count - len(rows))):
+            phash = _flip_bits(base, rng.randint(0, 4), rng) if members > 1 else base
+            rows.append((f"{len(rows):064x}", rng.getrandbits(64), phash))
+    return rows
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies):
+    ms = [t * 1000 for t in latencies]
+    return {"p50_ms": round(percentile(ms, 0.50), 3), "p95_ms": round(percentile(ms, 0.95), 3),
+            "p99_ms": round(percentile(ms, 0.99), 3), "mean_ms": round(statistics.mean(ms), 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark perceptual-hash lookups.")
+    parser.add_argument("--images", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    rows = synthetic_hashes(args.images, rng)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        phash_index.ensure_table(conn)
+        started = time.perf_counter()
+        with conn:
+            phash_index.insert_hashes(conn, rows)
+        build_s = time.perf_counter() - started
+
+        # Queries: perturbed copies of stored photos, so every lookup has at least one true match
+        queries = [_flip_bits(rng.choice(rows)[2], rng.randint(0, 3), rng) for _ in range(args.queries)]
+        all_hashes = [phash for _, _, phash in rows]
+        report = {"images": args.images, "queries": args.queries, "index_build_s": round(build_s, 3)}
+        for label, radius in (("near_duplicate", phash_index.NEAR_DUPLICATE_DISTANCE),
+                              ("similar", phash_index.SIMILAR_DISTANCE)):
+            latencies, found = [], 0
+            for query in queries:
+                started = time.perf_counter()
+                found += len(phash_index.lookup(conn, query, radius, limit=50))
+                latencies.append(time.perf_counter() - started)
+            report[f"{label}_radius_{radius}"] = {**summarize(latencies), "avg_matches": round(found / len(queries), 2)}
+
+        scan_latencies = []
+        for query in queries[:50]:
+            started = time.perf_counter()
+            [h for h in all_hashes if phash_index.hamming(query, h) <= phash_index.NEAR_DUPLICATE_DISTANCE]
+            scan_latencies.append(time.perf_counter() - started)
+        report["linear_scan_in_memory"] = summarize(scan_latencies)
+        conn.close()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+# bench_pipeline.py (End-to-end latency of the question → SQL → answer pipeline, offline)
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_pipeline.py --scales 100000 1000000 --repeat 5 \
+#       --llm-latency-ms 300 -o benchmarks/results/pipeline.json [--baseline old.json]
+#
+# For every scale a synthetic database is built (or reused) with synth_data.py, the Groq
+# client in smatbotest_v is swapped for fake_llm.FakeGroqClient, and every question in
+# gold_set.jsonl runs through the same functions the UI calls. Reported per scale:
+# latency percentiles for each stage (metadata, generation, execution, answer), whether
+# the pipeline's result matches the gold SQL's, Python and process memory peaks, and the
+# database size. With --baseline the p50/p95 of each stage are compared to an earlier run.
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource  # Unix only: process-wide peak RSS
+except ImportError:
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import db_pool  # noqa: E402
+import smatbotest_v  # noqa: E402
+import sql_cache  # noqa: E402
+import sql_guard  # noqa: E402
+import telemetry  # noqa: E402
+from fake_llm import FakeGroqClient, load_gold_set  # noqa: E402
+from synth_data import DATA_DIR, DOCS_PER_THOUSAND, MAX_DOCUMENTS, ensure_dataset  # noqa: E402
+
+
+# -----------------------------
+# Config
+# -----------------------------
+STAGES = ["metadata", "generation", "execution", "answer", "total"]
+DEFAULT_SCALES = [100_000, 1_000_000]
+REGRESSION_THRESHOLD = 0.10            # --baseline flags stages whose p50 or p95 grew by more than this
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies):
+    ms = [t * 1000 for t in latencies]
+    return {"p50_ms": round(percentile(ms, 0.50), 3), "p95_ms": round(percentile(ms, 0.95), 3),
+            "p99_ms": round(percentile(ms, 0.99), 3), "mean_ms": round(statistics.mean(ms), 3), "n": len(ms)}
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)  # bytes on macOS, KiB on Linux
+
+
+def _db_size_bytes(db_path):
+    return sum(os.path.getsize(db_path + suffix) for suffix in ("", "-wal") if os.path.exists(db_path + suffix))
+
+
+# -----------------------------
+# One question
+# -----------------------------
+def run_question(example, keep_sql_cache=False):
+    """Runs one gold question through the pipeline; returns ({stage: seconds}, details)."""
+    question, kind = example["question"], example["kind"]
+    timings = {}
+    started = time.perf_counter()
+
+    t = time.perf_counter()
+    column_metadata, example_sql_query = smatbotest_v.extract_table_metadata()
+    timings["metadata"] = time.perf_counter() - t
+
+    cache_kind = smatbotest_v.DOCUMENT_CACHE_KIND if kind == "document" else "sql"
+    if not keep_sql_cache:
+        # Otherwise every repeat after the first is a cache hit and generation measures nothing
+        sql_cache.forget_cached_sql(smatbotest_v.DB_PATH, cache_kind, question, column_metadata, smatbotest_v.MODEL_NAME)
+
+    t = time.perf_counter()
+    if kind == "document":
+        sql_query, params, routed = smatbotest_v.route_or_generate_document_sql_query(
+            question, column_metadata, smatbotest_v.TABLE_NAME)
+        attempts = 1
+    else:
+        outcome = smatbotest_v.generate_valid_sql(question, example_sql_query, column_metadata, smatbotest_v.TABLE_NAME)
+        if outcome.sql_query is None:
+            raise ValueError(f"no valid SQL after {outcome.attempts} attempts: {outcome.errors[-1]}")
+        sql_query, params, routed, attempts = outcome.sql_query, outcome.params, outcome.routed, outcome.attempts
+    timings["generation"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    if kind == "document":
+        df = smatbotest_v.fetch_document_blobs_from_db(sql_query, params)
+    else:
+        df = smatbotest_v.fetch_answer_from_db(sql_query, params, raise_errors=True)
+    timings["execution"] = time.perf_counter() - t
+
+    # The document tab's "answer" is reading the first document's bytes for display
+    t = time.perf_counter()
+    if kind == "document":
+        if not df.empty:
+            smatbotest_v.load_document_bytes(df.iloc[0]["sha256"])
+    else:
+        smatbotest_v.answer_question_from_df(question, df)
+    timings["answer"] = time.perf_counter() - t
+
+    timings["total"] = time.perf_counter() - started
+    return timings, {"sql_query": sql_query, "params": params, "routed": routed, "attempts": attempts, "rows": len(df)}
+
+
+def _guarded_rows(example, sql, params=()):
+    if example["kind"] == "document":
+        sql = smatbotest_v.document_metadata_sql(sql)
+    with db_pool.get_pool(smatbotest_v.DB_PATH).reader() as conn:
+        columns, rows, _ = sql_guard.guarded_execute(
+            conn, sql, params, blob_columns=smatbotest_v._blob_columns(),
+            row_cap=smatbotest_v.DOCUMENT_ROW_CAP if example["kind"] == "document" else smatbotest_v.QUERY_ROW_CAP)
+    return [col.lower() for col in columns], rows
+
+
+def result_matches(example, sql_query, params=()):
+    """
+    Does the pipeline's SQL return the gold SQL's rows (for documents: the same documents)?
+    Compared on the gold query's columns, so extra columns (the router always selects
+    "Equipment ID") don't count as a mismatch; with differently named columns (e.g. an
+    unaliased COUNT(*)) the same number of columns is compared by position.
+    """
+    columns, rows = _guarded_rows(example, sql_query, params)
+    gold_columns, gold_rows = _guarded_rows(example, example["sql"])
+    if all(col in columns for col in gold_columns):
+        positions = [columns.index(col) for col in gold_columns]
+    elif len(columns) == len(gold_columns):
+        positions = list(range(len(columns)))
+    else:
+        return False
+    projected = sorted(repr(tuple(row[i] for i in positions)) for row in rows)
+    return projected == sorted(repr(tuple(row)) for row in gold_rows)
+
+
+# -----------------------------
+# One scale
+# -----------------------------
+def bench_scale(rows, gold_set, args):
+    db_path, dataset = ensure_dataset(rows, args.data_dir, args.regenerate,
+                                      docs_per_thousand=args.docs_per_thousand, max_documents=args.max_documents)
+    client = FakeGroqClient(gold_set, latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms,
+                            ms_per_output_token=args.llm_ms_per_token, bad_sql_rate=args.bad_sql_rate, seed=args.seed)
+    smatbotest_v.DB_PATH = db_path
+    smatbotest_v.client = client
+    telemetry.configure(db_path)
+
+    stage_times = {stage: [] for stage in STAGES}
+    per_question, failures = {}, []
+    started = time.perf_counter()
+    try:
+        for _ in range(args.warmup):
+            for example in gold_set:
+                try:
+                    run_question(example, args.keep_sql_cache)
+                except Exception:
+                    pass  # counted in the measured runs below
+        warmup_s = time.perf_counter() - started
+
+        for repeat in range(args.repeat):
+            for example in gold_set:
+                entry = per_question.setdefault(example["question"], {"kind": example["kind"], "total": []})
+                try:
+                    timings, details = run_question(example, args.keep_sql_cache)
+                except Exception as e:
+                    failures.append({"question": example["question"], "error": f"{type(e).__name__}: {e}"})
+                    continue
+                for stage, seconds in timings.items():
+                    stage_times[stage].append(seconds)
+                entry["total"].append(timings["total"])
+                if repeat == 0:
+                    matches = result_matches(example, details["sql_query"], details["params"])
+                    entry.update(routed=details["routed"], attempts=details["attempts"], rows=details["rows"],
+                                 sql_query=details["sql_query"], matches_gold=matches)
+
+        # One more pass under tracemalloc for the Python allocation peak; tracing would skew the timings above
+        tracemalloc.start()
+        for example in gold_set:
+            try:
+                run_question(example, args.keep_sql_cache)
+            except Exception:
+                pass
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        telemetry.flush()
+        db_pool.close_all()
+
+    for entry in per_question.values():
+        entry["total"] = summarize(entry["total"]) if entry["total"] else None
+    checked = [entry for entry in per_question.values() if "matches_gold" in entry]
+    return {
+        "rows": dataset["rows"],
+        "documents": dataset["documents"],
+        "distinct_documents": dataset["distinct_documents"],
+        "dataset_build_s": None if dataset["reused"] else dataset["build_s"],
+        "db_size_mb": round(_db_size_bytes(db_path) / (1024 * 1024), 1),
+        "warmup_s": round(warmup_s, 3),
+        "stages": {stage: summarize(times) for stage, times in stage_times.items() if times},
+        "gold_match_rate": round(sum(e["matches_gold"] for e in checked) / len(checked), 3) if checked else None,
+        "routed_share": round(sum(bool(e["routed"]) for e in checked) / len(checked), 3) if checked else None,
+        "llm_calls": client.call_counts(),
+        "python_peak_mb": round(python_peak / (1024 * 1024), 1),
+        "max_rss_mb": _max_rss_mb(),
+        "failures": failures,
+        "questions": per_question,
+    }
+
+
+# -----------------------------
+# Regression report
+# -----------------------------
+def compare_to_baseline(report, baseline):
+    """Lines describing p50/p95 changes per scale and stage; regressions are marked."""
+    lines = []
+    old_scales = {str(scale["rows"]): scale for scale in baseline.get("scales", [])}
+    for scale in report["scales"]:
+        old = old_scales.get(str(scale["rows"]))
+        if old is None:
+            continue
+        for stage, new_stats in scale["stages"].items():
+            old_stats = old.get("stages", {}).get(stage)
+            if not old_stats:
+                continue
+            for metric in ("p50_ms", "p95_ms"):
+                before, after = old_stats[metric], new_stats[metric]
+                change = (after - before) / before if before else 0.0
+                marker = "⚠️" if change > REGRESSION_THRESHOLD else "  "
+                lines.append(f"{marker} {scale['rows']:>10,} rows  {stage:<10} {metric}: "
+                             f"{before:9.2f} → {after:9.2f} ms ({change:+.0%})")
+    return lines
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the NL → SQL → answer pipeline against a fake LLM.")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="Row counts to benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="Measured passes over the gold set per scale")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured passes first (model loading, caches)")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="Fake LLM time to first token")
+    parser.add_argument("--llm-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--llm-ms-per-token", type=float, default=0.0, help="Fake LLM time per output token")
+    parser.add_argument("--bad-sql-rate", type=float, default=0.0, help="Share of SQL responses that need a repair")
+    parser.add_argument("--keep-sql-cache", action="store_true", help="Let repeats hit the SQL cache")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--regenerate", action="store_true", help="Rebuild cached synthetic databases")
+    parser.add_argument("--docs-per-thousand", type=float, default=DOCS_PER_THOUSAND)
+    parser.add_argument("--max-documents", type=int, default=MAX_DOCUMENTS)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("-o", "--output", default=os.path.join(BENCH_DIR, "results", "pipeline.json"))
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    gold_set = load_gold_set(table_name=smatbotest_v.TABLE_NAME)
+    previous_fewshot_path = smatbotest_v.FEWSHOT_STORE_PATH
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "scales": [],
+    }
+    with tempfile.TemporaryDirectory() as fewshot_dir:
+        # An empty few-shot store, so the prompts match a fresh install
+        smatbotest_v.FEWSHOT_STORE_PATH = fewshot_dir
+        try:
+            for rows in args.scales:
+                print(f"⏱️ {rows:,} rows")
+                scale = bench_scale(rows, gold_set, args)
+                report["scales"].append(scale)
+                total = scale["stages"].get("total", {})
+                print(f"   total p50 {total.get('p50_ms')} ms, p95 {total.get('p95_ms')} ms, "
+                      f"gold match {scale['gold_match_rate']}, db {scale['db_size_mb']} MB, "
+                      f"peak RSS {scale['max_rss_mb']} MB, {len(scale['failures'])} failures")
+        finally:
+            smatbotest_v.FEWSHOT_STORE_PATH = previous_fewshot_path
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"📝 Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            lines = compare_to_baseline(report, json.load(f))
+        print("\n".join(lines) if lines else "No overlapping scales with the baseline.")
+
+
+if __name__ == "__main__":
+    main()
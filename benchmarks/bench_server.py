@@ -0,0 +1,250 @@
+# bench_server.py (Load test of server.py: requests/second and latency under concurrent clients)
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_server.py --rows 100000 --clients 16 --requests 400 --mode sse \
+#       --llm-latency-ms 300 -o benchmarks/results/server.json
+#   python benchmarks/bench_server.py --url http://127.0.0.1:8000 --clients 16    # an already running server
+#
+# Without --url the server runs in this process on a threaded WSGI server, against a
+# synthetic database (synth_data.py) and fake_llm's stand-ins for both Groq clients, so no
+# API calls are made. Clients replay the gold-set questions: SQL questions POST /chat
+# (JSON, or SSE with --mode sse, which also reports time to first token), document
+# questions GET /documents?question=... and then download the first document's first
+# 64 KiB with a Range request.
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fake_llm import FakeAsyncGroqClient, FakeGroqClient, load_gold_set  # noqa: E402
+from synth_data import DATA_DIR, ensure_dataset  # noqa: E402
+
+
+# -----------------------------
+# Config
+# -----------------------------
+RANGE_BYTES = 64 * 1024
+REQUEST_TIMEOUT_SECONDS = 120
+READ_SIZE = 64 * 1024
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies):
+    if not latencies:
+        return None
+    ms = [t * 1000 for t in latencies]
+    return {"p50_ms": round(percentile(ms, 0.50), 3), "p95_ms": round(percentile(ms, 0.95), 3),
+            "p99_ms": round(percentile(ms, 0.99), 3), "mean_ms": round(statistics.mean(ms), 3), "n": len(ms)}
+
+
+# -----------------------------
+# In-process server
+# -----------------------------
+def start_server(args, gold_set):
+    """Points the pipeline at the synthetic database and fake LLMs and serves server.app; returns (url, stop)."""
+    from werkzeug.serving import make_server
+
+    import server
+    import smatbotest_async
+    import smatbotest_v
+    import telemetry
+
+    db_path, _ = ensure_dataset(args.rows, args.data_dir)
+    llm_options = dict(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms,
+                       ms_per_output_token=args.llm_ms_per_token, seed=args.seed)
+    smatbotest_v.DB_PATH = db_path
+    smatbotest_v.client = FakeGroqClient(gold_set, **llm_options)
+    smatbotest_async.async_client = FakeAsyncGroqClient(gold_set, **llm_options)
+    # An empty few-shot store, so the prompts match a fresh install
+    smatbotest_v.FEWSHOT_STORE_PATH = tempfile.mkdtemp(prefix="fewshot_")
+    telemetry.configure(db_path)
+
+    # Per-request access and guardrail log lines would dominate the run
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    logging.getLogger("sql_guard").setLevel(logging.ERROR)
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, name="bench-server", daemon=True).start()
+    return f"http://127.0.0.1:{httpd.server_port}", httpd.shutdown
+
+
+# -----------------------------
+# Clients
+# -----------------------------
+_connections = threading.local()
+
+
+def _connection(url):
+    # One keep-alive connection per client thread, like a browser tab
+    conn = getattr(_connections, "conn", None)
+    if conn is None:
+        parts = urlsplit(url)
+        conn = _connections.conn = http.client.HTTPConnection(parts.hostname, parts.port,
+                                                              timeout=REQUEST_TIMEOUT_SECONDS)
+    return conn
+
+
+def request(url, method, path, body=None, headers=None, marker=None):
+    """
+    (status, body bytes, seconds until marker first appeared in the body or None). Reads
+    the body as it arrives, so the marker time is real for streamed responses.
+    """
+    for attempt in range(2):
+        conn = _connection(url)
+        started = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            received, marker_s = bytearray(), None
+            while True:
+                chunk = response.read1(READ_SIZE)
+                if not chunk:
+                    break
+                received += chunk
+                if marker is not None and marker_s is None and marker in received:
+                    marker_s = time.perf_counter() - started
+            return response.status, bytes(received), marker_s
+        except (http.client.HTTPException, ConnectionError):
+            # A keep-alive connection the server closed; retry once on a fresh one
+            conn.close()
+            _connections.conn = None
+            if attempt:
+                raise
+
+
+def ask_chat(url, question, mode):
+    body = json.dumps({"message": question}).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if mode == "sse":
+        headers["Accept"] = "text/event-stream"
+    started = time.perf_counter()
+    status, payload, first_token_s = request(url, "POST", "/chat", body, headers,
+                                             marker=b"event: token" if mode == "sse" else None)
+    latency = time.perf_counter() - started
+    if status != 200 or b"event: error" in payload:
+        raise RuntimeError(f"HTTP {status}: {payload[-300:].decode('utf-8', 'replace')}")
+    return {"kind": "chat", "latency": latency, "first_token": first_token_s}
+
+
+def ask_documents(url, question):
+    started = time.perf_counter()
+    status, payload, _ = request(url, "GET", f"/documents?question={quote(question)}")
+    if status != 200:
+        raise RuntimeError(f"HTTP {status}: {payload[:300].decode('utf-8', 'replace')}")
+    latency = time.perf_counter() - started
+    documents = json.loads(payload)["documents"]
+    result = {"kind": "documents", "latency": latency, "first_token": None}
+    if documents:
+        started = time.perf_counter()
+        status, payload, _ = request(url, "GET", f"/documents/{documents[0]['sha256']}",
+                                     headers={"Range": f"bytes=0-{RANGE_BYTES - 1}"})
+        if status not in (200, 206):
+            raise RuntimeError(f"HTTP {status} downloading {documents[0]['sha256']}")
+        result.update(download_latency=time.perf_counter() - started, download_bytes=len(payload))
+    return result
+
+
+def run_one(url, example, mode):
+    try:
+        if example["kind"] == "document":
+            return ask_documents(url, example["question"])
+        return ask_chat(url, example["question"], mode)
+    except Exception as e:
+        return {"kind": example["kind"], "error": f"{type(e).__name__}: {e}"}
+
+
+def run_load(url, gold_set, clients, total, mode):
+    """Sends `total` requests from `clients` concurrent clients, cycling through the gold set."""
+    examples = list(itertools.islice(itertools.cycle(gold_set), total))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(lambda example: run_one(url, example, mode), examples))
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if "error" not in r]
+    by_kind = {}
+    for kind in ("chat", "documents"):
+        latencies = [r["latency"] for r in ok if r["kind"] == kind]
+        if latencies:
+            by_kind[kind] = summarize(latencies)
+    first_tokens = [r["first_token"] for r in ok if r.get("first_token") is not None]
+    downloads = [r["download_latency"] for r in ok if "download_latency" in r]
+    errors = [r["error"] for r in results if "error" in r]
+    return {
+        "clients": clients,
+        "requests": len(results),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(ok) / elapsed, 2) if elapsed else None,
+        "latency": summarize([r["latency"] for r in ok]),
+        "by_kind": by_kind,
+        "first_token": summarize(first_tokens),
+        "range_download": summarize(downloads),
+    }
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the HTTP service against a fake LLM.")
+    parser.add_argument("--url", help="Test an already running server instead of starting one in-process")
+    parser.add_argument("--rows", type=int, default=100_000, help="Synthetic database size (in-process server)")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 16], help="Concurrency levels to run")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests first")
+    parser.add_argument("--mode", choices=["json", "sse"], default="json", help="How /chat answers are requested")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="Fake LLM time to first token")
+    parser.add_argument("--llm-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--llm-ms-per-token", type=float, default=0.0, help="Fake LLM time per output token")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("-o", "--output", default=os.path.join(BENCH_DIR, "results", "server.json"))
+    args = parser.parse_args(argv)
+
+    gold_set = load_gold_set()
+    url, stop = (args.url, None) if args.url else start_server(args, gold_set)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "runs": [],
+    }
+    try:
+        run_load(url, gold_set, max(args.clients), args.warmup, args.mode)
+        for clients in args.clients:
+            run = run_load(url, gold_set, clients, args.requests, args.mode)
+            report["runs"].append(run)
+            latency = run["latency"] or {}
+            ttft = f", first token p95 {run['first_token']['p95_ms']} ms" if run["first_token"] else ""
+            print(f"⏱️ {clients:>3} clients: {run['requests_per_s']} req/s, p50 {latency.get('p50_ms')} ms, "
+                  f"p95 {latency.get('p95_ms')} ms{ttft}, {run['errors']} errors")
+    finally:
+        if stop:
+            stop()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"📝 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
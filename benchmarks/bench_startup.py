@@ -0,0 +1,88 @@
+# bench_startup.py (Cold-start and per-rerun time of the Streamlit UI)
+#
+# Usage (from the repository root; run it on two commits to compare before/after):
+#   python benchmarks/bench_startup.py --cold-runs 3 --reruns 20 -o benchmarks/results/startup.json
+#
+# Every cold run starts a fresh interpreter that runs chatbot_ui_v.py once through
+# streamlit.testing.v1.AppTest (imports, warm-up and the first render, as for the first
+# visitor after a deploy), then reruns it --reruns times the way a widget interaction
+# does. It also reports which heavy optional libraries the first render imported.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_SCRIPT = os.path.join(ROOT, "chatbot_ui_v.py")
+# Only needed once a feature uses them (thumbnails, similarity, embeddings, few-shot search)
+HEAVY_MODULES = ["cv2", "torch", "transformers", "sentence_transformers", "faiss", "fitz", "groq"]
+APP_TIMEOUT_SECONDS = 300
+
+
+def _child(reruns):
+    """Runs inside the fresh interpreter; prints one JSON line."""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP_SCRIPT, default_timeout=APP_TIMEOUT_SECONDS)
+    app.run()
+    cold_s = time.perf_counter() - started
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    rerun_s = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run()
+        rerun_s.append(time.perf_counter() - started)
+    errors = [str(e.value) for e in app.exception] if app.exception else []
+    print(json.dumps({"cold_s": cold_s, "rerun_s": rerun_s, "heavy_modules_loaded": loaded, "errors": errors}))
+
+
+def _ms(values):
+    ordered = sorted(values)
+    return {"p50_ms": round(statistics.median(ordered) * 1000, 1),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 1),
+            "max_ms": round(ordered[-1] * 1000, 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure Streamlit UI cold start and rerun time.")
+    parser.add_argument("--cold-runs", type=int, default=3)
+    parser.add_argument("--reruns", type=int, default=20)
+    parser.add_argument("-o", "--output", help="Write the report as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        _child(args.reruns)
+        return
+
+    runs = []
+    for _ in range(args.cold_runs):
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", "--reruns", str(args.reruns)],
+                                 capture_output=True, text=True, cwd=ROOT)
+        if process.returncode != 0:
+            raise SystemExit(f"Cold run failed:\n{process.stderr}")
+        runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cold_start": _ms([run["cold_s"] for run in runs]),
+        "rerun": _ms([t for run in runs for t in run["rerun_s"]]),
+        "heavy_modules_loaded": sorted({name for run in runs for name in run["heavy_modules_loaded"]}),
+        "errors": sorted({error for run in runs for error in run["errors"]}),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
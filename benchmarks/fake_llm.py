@@ -0,0 +1,195 @@
+# fake_llm.py (Offline stand-in for the Groq chat-completions client)
+#
+# FakeGroqClient / FakeAsyncGroqClient answer client.chat.completions.create(...) like
+# groq.Groq / groq.AsyncGroq do (choices[0].message.content, usage, stream=True chunks),
+# after a configurable delay, without any network access:
+#   - SQL and document-SQL prompts get the canned SQL for their "User Question" (from the
+#     gold set), or a harmless COUNT(*) / DISTINCT "Equipment ID" query for unknown questions
+#   - repair prompts get the canned SQL again
+#   - answer prompts get a short canned sentence
+#
+# Usage:
+#   import smatbotest_v
+#   from fake_llm import FakeGroqClient, load_gold_set
+#   smatbotest_v.client = FakeGroqClient(load_gold_set(), latency_ms=300)
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_compaction import estimate_tokens  # noqa: E402
+from sql_cache import normalize_question  # noqa: E402
+
+
+# -----------------------------
+# Config
+# -----------------------------
+GOLD_SET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gold_set.jsonl")
+DEFAULT_TABLE_NAME = "filled_asset_data"
+STREAM_CHUNK_WORDS = 3                 # words per streamed delta
+
+
+def load_gold_set(path=GOLD_SET_PATH, table_name=DEFAULT_TABLE_NAME):
+    """[{"question", "sql", "kind"}] with {table} in each SQL replaced by table_name."""
+    with open(path, encoding="utf-8") as f:
+        examples = [json.loads(line) for line in f if line.strip()]
+    for example in examples:
+        example["sql"] = example["sql"].format(table=table_name)
+        example.setdefault("kind", "sql")
+    return examples
+
+
+# -----------------------------
+# Canned responses
+# -----------------------------
+def _prompt_text(messages):
+    return "\n".join(str(message.get("content", "")) for message in messages)
+
+
+def classify_prompt(messages):
+    """"sql", "document_sql", "repair" or "answer", from the prompts smatbotest_v builds."""
+    text = _prompt_text(messages)
+    if "That query fails in SQLite" in text:
+        return "repair"
+    if "**documents (images, PDFs, manuals)**" in text:
+        return "document_sql"
+    if "converts natural language questions into" in text:
+        return "sql"
+    return "answer"
+
+
+def _question_in(text, kind):
+    if kind == "answer":
+        match = re.search(r"answer this question: (.*?)\.?\nHere is the data:", text, re.DOTALL)
+        return match.group(1).strip() if match else ""
+    matches = re.findall(r"^\s*User Question: (.+)$", text, re.MULTILINE)
+    return matches[-1].strip() if matches else ""
+
+
+class CannedResponder:
+    """Picks the response text for a request; shared by the sync and async clients."""
+
+    def __init__(self, gold_set=(), bad_sql_rate=0.0, seed=0):
+        self.sql_by_question = {normalize_question(e["question"]): e["sql"] for e in gold_set}
+        self.bad_sql_rate = bad_sql_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def respond(self, messages):
+        kind = classify_prompt(messages)
+        text = _prompt_text(messages)
+        question = _question_in(text, kind)
+        table = re.search(r"for the table '([^']+)'", text)
+        table_name = table.group(1) if table else DEFAULT_TABLE_NAME
+
+        if kind == "answer":
+            rows = max(0, text.count("\n") - 3)
+            return kind, f"Based on the {rows} lines of data provided, here is the answer to: {question}."
+
+        sql = self.sql_by_question.get(normalize_question(question))
+        if sql is None:
+            sql = (f'SELECT DISTINCT "Equipment ID" FROM "{table_name}" LIMIT 5' if kind == "document_sql"
+                   else f'SELECT COUNT(*) AS "count" FROM "{table_name}"')
+        if kind == "sql":
+            with self._lock:
+                broken = self._rng.random() < self.bad_sql_rate
+            if broken:
+                # A misspelt column, so the repair loop in generate_valid_sql gets exercised
+                sql = sql.replace('"Equipment ID"', '"Equipment Identifier"', 1) if '"Equipment ID"' in sql \
+                    else sql.replace("SELECT", 'SELECT "No Such Column",', 1)
+        return kind, f"```sql\n{sql}\n```"
+
+
+def _completion(model, content, prompt_tokens):
+    completion_tokens = estimate_tokens(content)
+    return SimpleNamespace(
+        model=model,
+        choices=[SimpleNamespace(index=0, finish_reason="stop",
+                                 message=SimpleNamespace(role="assistant", content=content))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                              total_tokens=prompt_tokens + completion_tokens),
+    )
+
+
+def _chunks(model, content):
+    words = content.split(" ")
+    for i in range(0, len(words), STREAM_CHUNK_WORDS):
+        piece = " ".join(words[i:i + STREAM_CHUNK_WORDS]) + (" " if i + STREAM_CHUNK_WORDS < len(words) else "")
+        yield SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, finish_reason=None,
+                                                                    delta=SimpleNamespace(content=piece))])
+
+
+# -----------------------------
+# Clients
+# -----------------------------
+class _FakeClientBase:
+    def __init__(self, gold_set=(), latency_ms=300.0, jitter_ms=50.0, ms_per_output_token=0.0,
+                 bad_sql_rate=0.0, seed=0):
+        self.responder = CannedResponder(gold_set, bad_sql_rate, seed)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.ms_per_output_token = ms_per_output_token
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = []            # (kind, seconds slept) per request
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _prepare(self, messages):
+        kind, content = self.responder.respond(messages)
+        with self._lock:
+            jitter = self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+        first_token_s = max(0.0, self.latency_ms + jitter) / 1000
+        generation_s = estimate_tokens(content) * self.ms_per_output_token / 1000
+        with self._lock:
+            self.calls.append((kind, first_token_s + generation_s))
+        return content, estimate_tokens(_prompt_text(messages)), first_token_s, generation_s
+
+    def call_counts(self):
+        with self._lock:
+            counts = {}
+            for kind, _ in self.calls:
+                counts[kind] = counts.get(kind, 0) + 1
+            return counts
+
+
+class FakeGroqClient(_FakeClientBase):
+    """Drop-in for smatbotest_v.client."""
+
+    def create(self, messages, model=None, stream=False, **kwargs):
+        content, prompt_tokens, first_token_s, generation_s = self._prepare(messages)
+        time.sleep(first_token_s)
+        if not stream:
+            time.sleep(generation_s)
+            return _completion(model, content, prompt_tokens)
+        return self._stream(model, content, generation_s)
+
+    def _stream(self, model, content, generation_s):
+        chunks = list(_chunks(model, content))
+        for chunk in chunks:
+            time.sleep(generation_s / len(chunks))
+            yield chunk
+
+
+class FakeAsyncGroqClient(_FakeClientBase):
+    """Drop-in for smatbotest_async.async_client."""
+
+    async def create(self, messages, model=None, stream=False, **kwargs):
+        content, prompt_tokens, first_token_s, generation_s = self._prepare(messages)
+        await asyncio.sleep(first_token_s)
+        if not stream:
+            await asyncio.sleep(generation_s)
+            return _completion(model, content, prompt_tokens)
+        return self._stream(model, content, generation_s)
+
+    async def _stream(self, model, content, generation_s):
+        chunks = list(_chunks(model, content))
+        for chunk in chunks:
+            await asyncio.sleep(generation_s / len(chunks))
+            yield chunk
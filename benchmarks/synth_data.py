@@ -0,0 +1,224 @@
+# synth_data.py (Scale the 500-row asset sheet up to a benchmark database with documents)
+#
+# Usage (from the repository root):
+#   python benchmarks/synth_data.py --rows 1000000 --db benchmarks/data/assets_1000000.db
+#
+# The sample sheet is loaded with the app loader (same declared types, indexes and FTS
+# index as app/assets_data.db) and then replicated in SQL: every synthetic row copies a
+# sample row with a fresh Equipment ID and Serial No and its dates shifted by up to two
+# years, so range filters and GROUP BYs see realistic spreads. A share of the equipment
+# gets document attachments in the content-addressed store (JPEG/PDF-shaped BLOBs with a
+# long-tailed size distribution and some content shared between equipment).
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+import db_loaderwithimg  # noqa: E402
+import document_store  # noqa: E402
+
+
+# -----------------------------
+# Config
+# -----------------------------
+SAMPLE_PATH = os.path.join(ROOT, "Filled_Asset_Data_csv.csv")
+TABLE_NAME = "filled_asset_data"
+DATA_DIR = os.path.join(ROOT, "benchmarks", "data")
+ROWS_PER_BATCH = 250_000
+DOCS_PER_THOUSAND = 5                  # documents per 1000 equipment rows...
+MAX_DOCUMENTS = 5_000                  # ...capped so a 10M-row database stays a few GB
+DOCUMENT_MEDIAN_KB = 180
+DOCUMENT_MIN_KB, DOCUMENT_MAX_KB = 8, 8 * 1024
+PDF_SHARE = 0.2
+SHARED_CONTENT_SHARE = 0.1             # documents whose bytes are already stored for other equipment
+DATE_SHIFT_DAYS = 730
+
+
+# -----------------------------
+# Rows
+# -----------------------------
+def load_seed(conn, sample_path=SAMPLE_PATH, table_name=TABLE_NAME):
+    """Loads the sample sheet through the app loader; returns {column: declared type}."""
+    import pandas as pd
+
+    db_loaderwithimg.write_typed_table(pd.read_csv(sample_path), conn, table_name)
+    return {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+
+
+def _drop_secondary_structures(conn, table_name):
+    """Indexes and the FTS triggers make bulk inserts several times slower; they are rebuilt afterwards."""
+    for kind, name in conn.execute(
+            "SELECT type, name FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+            (table_name,)).fetchall():
+        conn.execute(f'DROP {kind.upper()} "{name}"')
+    conn.execute(f"DROP TABLE IF EXISTS {db_loaderwithimg.FTS_TABLE}")
+
+
+def _row_expressions(column_types):
+    expressions = []
+    for col, col_type in column_types.items():
+        if col == "Equipment ID":
+            expressions.append("printf('EQ-%07d', n.i)")
+        elif col == "Serial No":
+            expressions.append("printf('SN-%09d', n.i)")
+        elif col_type.upper() == "DATE":
+            shift = f"((n.i * 7919) % {2 * DATE_SHIFT_DAYS + 1}) - {DATE_SHIFT_DAYS}"
+            expressions.append(f"date(s.\"{col}\", printf('%+d days', {shift}))")
+        else:
+            expressions.append(f's."{col}"')
+    return expressions
+
+
+def scale_up(conn, rows, table_name=TABLE_NAME, batch_size=ROWS_PER_BATCH):
+    """Replicates the rows already in table_name until it holds `rows` rows."""
+    column_types = {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    seed_count = conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+    if seed_count == 0 or rows <= seed_count:
+        return seed_count
+    conn.execute("DROP TABLE IF EXISTS temp._seed")
+    conn.execute(f'CREATE TEMP TABLE _seed AS SELECT row_number() OVER () - 1 AS seq, * FROM "{table_name}"')
+    conn.execute("CREATE UNIQUE INDEX temp.idx_seed_seq ON _seed (seq)")
+    _drop_secondary_structures(conn, table_name)
+
+    columns = ", ".join(f'"{col}"' for col in column_types)
+    select = ", ".join(_row_expressions(column_types))
+    sql = f"""
+        WITH RECURSIVE n(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+        INSERT INTO "{table_name}" ({columns})
+        SELECT {select} FROM n JOIN _seed AS s ON s.seq = n.i % {seed_count}
+    """
+    # Synthetic IDs start at the seed count, so they never collide with the sample's EQ-dddd IDs
+    for start in range(seed_count, rows, batch_size):
+        with conn:
+            conn.execute(sql, (start, min(rows, start + batch_size)))
+        print(f"  … {min(rows, start + batch_size):,} rows")
+    conn.execute("DROP TABLE temp._seed")
+
+    db_loaderwithimg.create_asset_indexes(conn, table_name)
+    db_loaderwithimg.ensure_fts_index(conn, table_name)
+    db_loaderwithimg.ensure_lifecycle_rollups(conn, table_name)
+    return rows
+
+
+# -----------------------------
+# Documents
+# -----------------------------
+def _document_bytes(rng, size, is_pdf):
+    if is_pdf:
+        header, trailer = b"%PDF-1.4\n", b"\n%%EOF\n"
+    else:
+        header, trailer = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00", b"\xff\xd9"
+    return header + rng.randbytes(max(0, size - len(header) - len(trailer))) + trailer
+
+
+def _document_size(rng, median_kb):
+    kb = rng.lognormvariate(math.log(median_kb), 0.9)
+    return int(min(DOCUMENT_MAX_KB, max(DOCUMENT_MIN_KB, kb)) * 1024)
+
+
+def add_documents(conn, count, table_name=TABLE_NAME, median_kb=DOCUMENT_MEDIAN_KB, seed=7):
+    """Attaches `count` documents to random equipment (always including EQ-3115). Returns the number of distinct BLOBs."""
+    document_store.ensure_schema(conn)
+    rng = random.Random(seed)
+    max_rowid = conn.execute(f'SELECT MAX(rowid) FROM "{table_name}"').fetchone()[0] or 0
+    if count == 0 or max_rowid == 0:
+        return 0
+    rowids = [rng.randint(1, max_rowid) for _ in range(count)]
+    equipment_ids = [row[0] for row in conn.execute(
+        f'SELECT "Equipment ID" FROM "{table_name}" WHERE rowid IN ({", ".join(map(str, set(rowids)))})')]
+    equipment_ids = ["EQ-3115"] + equipment_ids
+
+    stored, distinct = [], 0
+    for n in range(count):
+        equipment_id = equipment_ids[n % len(equipment_ids)]
+        upload_date = date(2018, 1, 1) + timedelta(days=rng.randint(0, 7 * 365))
+        is_pdf = rng.random() < PDF_SHARE
+        if stored and rng.random() < SHARED_CONTENT_SHARE:
+            data, is_pdf = rng.choice(stored)
+        else:
+            data = _document_bytes(rng, _document_size(rng, median_kb), is_pdf)
+            stored = (stored + [(data, is_pdf)])[-20:]  # keep a few around to share; not all in memory
+        file_name = f"{equipment_id}_{upload_date:%d_%m_%Y}.{'pdf' if is_pdf else 'jpg'}"
+        _, deduplicated = document_store.store_document(
+            conn, equipment_id, file_name, "application/pdf" if is_pdf else "image/jpeg", data,
+            upload_date=upload_date.isoformat())
+        distinct += not deduplicated
+        if n % 200 == 199:
+            conn.commit()
+    conn.commit()
+    return distinct
+
+
+# -----------------------------
+# Datasets
+# -----------------------------
+def document_count(rows, docs_per_thousand=DOCS_PER_THOUSAND, max_documents=MAX_DOCUMENTS):
+    return min(max_documents, round(rows * docs_per_thousand / 1000))
+
+
+def build_dataset(db_path, rows, docs_per_thousand=DOCS_PER_THOUSAND, max_documents=MAX_DOCUMENTS,
+                  median_kb=DOCUMENT_MEDIAN_KB, table_name=TABLE_NAME):
+    """Creates db_path from scratch; returns a summary dict (also saved next to it as <db>.json)."""
+    for suffix in ("", "-wal", "-shm", ".json"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")
+        load_seed(conn, table_name=table_name)
+        rows_written = scale_up(conn, rows, table_name)
+        documents = document_count(rows_written, docs_per_thousand, max_documents)
+        distinct = add_documents(conn, documents, table_name, median_kb)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    summary = {"rows": rows_written, "documents": documents, "distinct_documents": distinct,
+               "build_s": round(time.perf_counter() - started, 3)}
+    with open(db_path + ".json", "w", encoding="utf-8") as f:
+        json.dump(summary, f)
+    return summary
+
+
+def ensure_dataset(rows, data_dir=DATA_DIR, regenerate=False, **options):
+    """Path and summary of the benchmark database with `rows` rows, building it when missing."""
+    db_path = os.path.join(data_dir, f"assets_{rows}.db")
+    if not regenerate and os.path.exists(db_path) and os.path.exists(db_path + ".json"):
+        with open(db_path + ".json", encoding="utf-8") as f:
+            return db_path, {**json.load(f), "reused": True}
+    print(f"🏗️ Building {db_path} ({rows:,} rows)")
+    return db_path, {**build_dataset(db_path, rows, **options), "reused": False}
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a scaled-up synthetic asset database.")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--db", default=None, help="Output database (default benchmarks/data/assets_<rows>.db)")
+    parser.add_argument("--docs-per-thousand", type=float, default=DOCS_PER_THOUSAND)
+    parser.add_argument("--max-documents", type=int, default=MAX_DOCUMENTS)
+    parser.add_argument("--document-kb", type=int, default=DOCUMENT_MEDIAN_KB, help="Median document size")
+    args = parser.parse_args(argv)
+
+    db_path = args.db or os.path.join(DATA_DIR, f"assets_{args.rows}.db")
+    summary = build_dataset(db_path, args.rows, args.docs_per_thousand, args.max_documents, args.document_kb)
+    print(f"📦 {db_path}: {summary['rows']:,} rows, {summary['documents']} documents "
+          f"({summary['distinct_documents']} distinct) in {summary['build_s']}s")
+
+
+if __name__ == "__main__":
+    main()
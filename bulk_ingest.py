@@ -0,0 +1,435 @@
+# bulk_ingest.py (Bulk document ingestion from a ZIP or a directory, resumable, with a background queue)
+#
+# Files must be named like single uploads (EQ-XXXX_DD_MM_YYYY.pdf/jpg/jpeg/png). Worker
+# processes hash each file and render its thumbnail and perceptual hashes; this process
+# is the only writer and stores the results in batches, one transaction per batch. Every
+# file's outcome is recorded in ingest_files in that same transaction, so re-running a
+# job (same source) skips what is already stored and retries what failed.
+#
+# Usage:
+#   python bulk_ingest.py run Assets/ --db app/assets_data.db --workers 4
+#   python bulk_ingest.py run survey.zip
+#   python bulk_ingest.py status
+#   python bulk_ingest.py errors <job id> -o errors.csv
+import argparse
+import csv
+import hashlib
+import itertools
+import logging
+import mimetypes
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import db_pool
+import document_store
+import phash_index
+import thumbnails
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Config
+# -----------------------------
+JOBS_TABLE = "ingest_jobs"
+FILES_TABLE = "ingest_files"
+TABLE_NAME = "filled_asset_data"
+WRITE_BATCH_FILES = 200                # files per write transaction...
+WRITE_BATCH_BYTES = 256 * 1024 * 1024  # ...or fewer, once their originals add up to this
+IN_FLIGHT_PER_WORKER = 4               # files submitted ahead per worker; results (thumbnails) are held only this far
+DONE_STATUSES = ("stored", "duplicate")
+
+_ensured = set()
+_ensure_lock = threading.Lock()
+_open_zips = {}                        # per worker process: ZIP path -> ZipFile
+
+
+# -----------------------------
+# Sources
+# -----------------------------
+def job_id_for(source):
+    """The same source (absolute path) always maps to the same job, which is what makes re-runs resume."""
+    return hashlib.sha256(os.path.abspath(source).encode("utf-8")).hexdigest()[:16]
+
+
+def _skip(member):
+    name = os.path.basename(member)
+    return not name or name.startswith(".") or "__MACOSX" in member
+
+
+def list_source_files(source):
+    """[(member path, size)] for every file in a ZIP or (recursively) a directory."""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return [(info.filename, info.file_size) for info in archive.infolist()
+                    if not info.is_dir() and not _skip(info.filename)]
+    if os.path.isdir(source):
+        files = []
+        for root, _, names in os.walk(source):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                member = os.path.relpath(path, source).replace(os.sep, "/")
+                if not _skip(member):
+                    files.append((member, os.path.getsize(path)))
+        return sorted(files)
+    raise ValueError(f"{source} is neither a ZIP file nor a directory")
+
+
+def open_member(source, member):
+    """Seekable binary stream of one file of the source."""
+    if os.path.isdir(source):
+        return open(os.path.join(source, member), "rb")
+    archive = _open_zips.get(source)
+    if archive is None:
+        archive = _open_zips[source] = zipfile.ZipFile(source)
+    return archive.open(member)
+
+
+def guess_mime(file_name):
+    return mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+
+
+# -----------------------------
+# Worker (pure function, runs in the process pool)
+# -----------------------------
+def prepare_file(source, member):
+    """
+    Reads one file and computes what the writer needs: SHA-256, size, thumbnail and
+    perceptual hashes. Never raises; failures come back in the "error" field.
+    """
+    result = {"member": member, "error": None}
+    try:
+        with open_member(source, member) as stream:
+            data = stream.read()
+        mime = guess_mime(member)
+        result.update(sha256=hashlib.sha256(data).hexdigest(), size=len(data), mime=mime, thumbnail=None, hashes=None)
+        try:
+            result["thumbnail"] = thumbnails.render_thumbnail(data, mime)
+            if mime.startswith("image/"):
+                result["hashes"] = phash_index.compute_hashes(data)
+        except Exception as e:  # stored without a preview; the backfills can retry later
+            logger.warning("Preview failed for %s: %s", member, e)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+# -----------------------------
+# Progress tables
+# -----------------------------
+def ensure_tables(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {JOBS_TABLE} (
+            job_id TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            status TEXT NOT NULL,          -- queued, running, done, failed
+            total INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {FILES_TABLE} (
+            job_id TEXT NOT NULL,
+            member TEXT NOT NULL,
+            size INTEGER,
+            status TEXT NOT NULL,          -- stored, duplicate, error
+            equipment_id TEXT,
+            sha256 TEXT,
+            error TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (job_id, member)
+        )
+    """)
+
+
+def _ensure_tables(db_path):
+    if db_path in _ensured:
+        return
+    with _ensure_lock:
+        if db_path in _ensured:
+            return
+        with db_pool.get_pool(db_path).writer() as conn:
+            ensure_tables(conn)
+            phash_index.ensure_table(conn)
+        _ensured.add(db_path)
+
+
+def _set_job(db_path, job_id, **fields):
+    fields["updated_at"] = time.time()
+    with db_pool.get_pool(db_path).writer() as conn:
+        conn.execute(f"UPDATE {JOBS_TABLE} SET {', '.join(f'{k} = ?' for k in fields)} WHERE job_id = ?",
+                     (*fields.values(), job_id))
+
+
+def register_job(db_path, source):
+    """Creates (or re-queues) the job for source; returns its id."""
+    _ensure_tables(db_path)
+    job_id, now = job_id_for(source), time.time()
+    with db_pool.get_pool(db_path).writer() as conn:
+        conn.execute(f"""
+            INSERT INTO {JOBS_TABLE} (job_id, source, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)
+            ON CONFLICT (job_id) DO UPDATE SET status = 'queued', error = NULL, updated_at = excluded.updated_at
+        """, (job_id, os.path.abspath(source), now, now))
+    return job_id
+
+
+def job_status(db_path, job_id=None):
+    """[{job_id, source, status, total, stored, duplicate, error, done, ...}] newest first (one job when job_id is given)."""
+    _ensure_tables(db_path)
+    where, params = ("WHERE j.job_id = ?", (job_id,)) if job_id else ("", ())
+    with db_pool.get_pool(db_path).reader() as conn:
+        rows = conn.execute(f"""
+            SELECT j.job_id, j.source, j.status, j.total, j.error, j.updated_at,
+                   COALESCE(SUM(f.status = 'stored'), 0), COALESCE(SUM(f.status = 'duplicate'), 0),
+                   COALESCE(SUM(f.status = 'error'), 0)
+            FROM {JOBS_TABLE} j LEFT JOIN {FILES_TABLE} f ON f.job_id = j.job_id
+            {where} GROUP BY j.job_id ORDER BY j.created_at DESC
+        """, params).fetchall()
+    return [{"job_id": r[0], "source": r[1], "status": r[2], "total": r[3], "job_error": r[4], "updated_at": r[5],
+             "stored": r[6], "duplicate": r[7], "errors": r[8], "processed": r[6] + r[7] + r[8]} for r in rows]
+
+
+def error_report(db_path, job_id):
+    """[{member, size, equipment_id, error}] for every file of the job that wasn't stored."""
+    _ensure_tables(db_path)
+    with db_pool.get_pool(db_path).reader() as conn:
+        rows = conn.execute(f"""
+            SELECT member, size, equipment_id, error FROM {FILES_TABLE}
+            WHERE job_id = ? AND status = 'error' ORDER BY member
+        """, (job_id,)).fetchall()
+    return [{"member": r[0], "size": r[1], "equipment_id": r[2], "error": r[3]} for r in rows]
+
+
+# -----------------------------
+# Writer
+# -----------------------------
+def _record(conn, job_id, entry, status, equipment_id=None, sha256=None, error=None):
+    conn.execute(f"""
+        INSERT OR REPLACE INTO {FILES_TABLE} (job_id, member, size, status, equipment_id, sha256, error, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (job_id, entry["member"], entry.get("size"), status, equipment_id, sha256, error, time.time()))
+
+
+def write_batch(db_path, job_id, source, batch, table_name=TABLE_NAME):
+    """
+    Stores a batch of prepared files in one transaction (documents, links, perceptual
+    hashes and per-file progress), then their thumbnails. Returns {status: count}.
+    """
+    counts = {"stored": 0, "duplicate": 0, "error": 0}
+    previews = []
+    with db_pool.get_pool(db_path).writer() as conn:
+        equipment_ids = sorted({entry["equipment_id"] for entry in batch if entry.get("equipment_id")})
+        known = {row[0] for row in conn.execute(
+            f'SELECT "Equipment ID" FROM "{table_name}" WHERE "Equipment ID" IN ({", ".join("?" for _ in equipment_ids)})',
+            equipment_ids)} if equipment_ids else set()
+        hashes = []
+        for entry in batch:
+            error = entry.get("error")
+            if error is None and entry["equipment_id"] not in known:
+                error = f"Equipment ID '{entry['equipment_id']}' not found in {table_name}"
+            if error is not None:
+                _record(conn, job_id, entry, "error", entry.get("equipment_id"), entry.get("sha256"), error)
+                counts["error"] += 1
+                continue
+            file_name = os.path.basename(entry["member"])
+            with open_member(source, entry["member"]) as stream:
+                sha256, deduplicated = document_store.store_document(
+                    conn, entry["equipment_id"], file_name, entry["mime"], stream,
+                    upload_date=entry["upload_date"], sha256=entry["sha256"], size=entry["size"])
+            status = "duplicate" if deduplicated else "stored"
+            _record(conn, job_id, entry, status, entry["equipment_id"], sha256)
+            counts[status] += 1
+            if entry["hashes"] is not None:
+                hashes.append((sha256, *entry["hashes"]))
+            if entry["thumbnail"] is not None and not deduplicated:
+                previews.append((sha256, entry["thumbnail"][0], entry["thumbnail"][1]))
+        phash_index.insert_hashes(conn, hashes)
+    if previews:
+        thumbnails.put_thumbnails(db_path, previews)
+    return counts
+
+
+# -----------------------------
+# Ingestion
+# -----------------------------
+def ingest(db_path, source, workers=None, restart=False, table_name=TABLE_NAME, mp_context=None, progress=None):
+    """
+    Ingests every valid file of source (ZIP or directory) not already stored by an
+    earlier run of the same job. progress(summary) is called after each batch. Returns
+    the summary dict.
+    """
+    document_store.ensure_schema_once(db_path)
+    job_id = register_job(db_path, source)
+    try:
+        files = list_source_files(source)
+        with db_pool.get_pool(db_path).writer() as conn:
+            if restart:
+                conn.execute(f"DELETE FROM {FILES_TABLE} WHERE job_id = ?", (job_id,))
+            done = {row[0]: row[1] for row in conn.execute(
+                f"SELECT member, size FROM {FILES_TABLE} WHERE job_id = ? AND status IN ({', '.join('?' for _ in DONE_STATUSES)})",
+                (job_id, *DONE_STATUSES))}
+        _set_job(db_path, job_id, status="running", total=len(files))
+
+        summary = {"job_id": job_id, "total": len(files), "already_done": 0, "stored": 0, "duplicate": 0, "error": 0}
+        invalid, pending = [], []
+        for member, size in files:
+            if done.get(member) == size:
+                summary["already_done"] += 1
+                continue
+            parsed = document_store.parse_document_file_name(os.path.basename(member))
+            if parsed is None:
+                invalid.append({"member": member, "size": size, "equipment_id": None,
+                                "error": "Invalid file name; it must be EQ-XXXX_DD_MM_YYYY.pdf/jpg/jpeg/png"})
+            else:
+                pending.append((member, size, *parsed))
+        if invalid:
+            _merge(summary, write_batch(db_path, job_id, source, invalid, table_name))
+
+        started = time.perf_counter()
+        parsed_by_member = {member: (equipment_id, upload_date) for member, _, equipment_id, upload_date in pending}
+        batch, batch_bytes = [], 0
+        members = iter(pending)
+        max_in_flight = (workers or os.cpu_count() or 1) * IN_FLIGHT_PER_WORKER
+        in_flight = set()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+            while True:
+                # Submit in a bounded window, so a large survey never holds every result at once
+                for member, _, _, _ in itertools.islice(members, max_in_flight - len(in_flight)):
+                    in_flight.add(pool.submit(prepare_file, source, member))
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    entry = future.result()
+                    entry["equipment_id"], entry["upload_date"] = parsed_by_member[entry["member"]]
+                    batch.append(entry)
+                    batch_bytes += entry.get("size") or 0
+                    if len(batch) >= WRITE_BATCH_FILES or batch_bytes >= WRITE_BATCH_BYTES:
+                        _merge(summary, write_batch(db_path, job_id, source, batch, table_name))
+                        batch, batch_bytes = [], 0
+                        if progress:
+                            progress(summary)
+        if batch:
+            _merge(summary, write_batch(db_path, job_id, source, batch, table_name))
+        summary["elapsed_s"] = round(time.perf_counter() - started, 3)
+        _set_job(db_path, job_id, status="done")
+        if progress:
+            progress(summary)
+        return summary
+    except Exception as e:
+        _set_job(db_path, job_id, status="failed", error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        for archive in _open_zips.values():
+            archive.close()
+        _open_zips.clear()
+
+
+def _merge(summary, counts):
+    for status, count in counts.items():
+        summary[status] += count
+
+
+# -----------------------------
+# Background queue (used by the UI)
+# -----------------------------
+class IngestQueue:
+    """
+    One background thread running submitted jobs in order, so the Streamlit request only
+    enqueues and then polls job_status(). Workers are spawned, not forked, because the
+    server process is multi-threaded.
+    """
+
+    def __init__(self, db_path, workers=None):
+        self.db_path = db_path
+        self.workers = workers
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="bulk-ingest", daemon=True)
+        self._thread.start()
+
+    def submit(self, source, restart=False, cleanup=False):
+        """Queues source; returns the job id to poll. cleanup deletes source (an uploaded temp ZIP) afterwards."""
+        job_id = register_job(self.db_path, source)
+        self._jobs.put((source, restart, cleanup))
+        return job_id
+
+    def _run(self):
+        while True:
+            source, restart, cleanup = self._jobs.get()
+            try:
+                ingest(self.db_path, source, self.workers, restart, mp_context=multiprocessing.get_context("spawn"))
+            except Exception:
+                logger.exception("Bulk ingestion of %s failed", source)  # recorded on the job by ingest()
+            finally:
+                if cleanup and os.path.isfile(source):
+                    os.remove(source)
+                self._jobs.task_done()
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_queue(db_path, workers=None):
+    """The process-wide ingestion queue for db_path."""
+    with _queues_lock:
+        if db_path not in _queues:
+            _queues[db_path] = IngestQueue(db_path, workers)
+        return _queues[db_path]
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-ingest documents from a ZIP file or a directory.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run = subparsers.add_parser("run", help="Ingest (or resume ingesting) a ZIP file or directory")
+    run.add_argument("source")
+    run.add_argument("--db", default="app/assets_data.db")
+    run.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    run.add_argument("--restart", action="store_true", help="Forget earlier progress of this source and start over")
+    status = subparsers.add_parser("status", help="List ingestion jobs")
+    status.add_argument("--db", default="app/assets_data.db")
+    errors = subparsers.add_parser("errors", help="Per-file error report of a job")
+    errors.add_argument("job_id")
+    errors.add_argument("--db", default="app/assets_data.db")
+    errors.add_argument("-o", "--output", help="Write the report as CSV")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        def show(summary):
+            print(f"  … {summary['already_done'] + summary['stored'] + summary['duplicate'] + summary['error']}"
+                  f"/{summary['total']} files")
+        summary = ingest(args.db, args.source, args.workers, args.restart, progress=show)
+        print(f"📥 Job {summary['job_id']}: {summary['stored']} stored, {summary['duplicate']} already stored, "
+              f"{summary['error']} errors, {summary['already_done']} done by an earlier run "
+              f"({summary['total']} files, {summary.get('elapsed_s', 0)}s)")
+        if summary["error"]:
+            print(f"   See: python bulk_ingest.py errors {summary['job_id']} --db {args.db}")
+    elif args.command == "status":
+        for job in job_status(args.db):
+            print(f"{job['job_id']}  {job['status']:<8} {job['processed']}/{job['total']}  "
+                  f"stored {job['stored']}, duplicate {job['duplicate']}, errors {job['errors']}  {job['source']}")
+    else:
+        report = error_report(args.db, args.job_id)
+        if args.output:
+            with open(args.output, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=["member", "size", "equipment_id", "error"])
+                writer.writeheader()
+                writer.writerows(report)
+            print(f"📝 {len(report)} errors written to {args.output}")
+        else:
+            for row in report:
+                print(f"{row['member']}: {row['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+# change_detection.py (Headless change detection between consecutive site photos of an asset)
+#
+# Photos are paired per Equipment ID in upload-date order (EQ-XXXX_DD_MM_YYYY names),
+# the later photo is aligned onto the earlier one (ORB features + partial affine), and
+# the aligned pair is diffed the way picture.py always did: grayscale absdiff, Otsu
+# threshold, dilation, contours. Scores and boxes are stored in SQLite keyed by the two
+# image hashes, so a re-run only processes pairs created by new uploads.
+#
+# Usage:
+#   python change_detection.py run --db app/assets_data.db --workers 4
+#   python change_detection.py show EQ-6156 --db app/assets_data.db
+#   python change_detection.py compare Assets/IMG_9599.JPG Assets/IMG_9601.JPG -o diff.png
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+
+import cv2
+import imutils
+import numpy as np
+
+import db_pool
+import document_store
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Config
+# -----------------------------
+CHANGES_TABLE = "image_changes"
+DIFF_SIZE = (600, 360)                 # (width, height) both photos are compared at
+MIN_CONTOUR_AREA = 100                 # ignore changed regions smaller than this (pixels at DIFF_SIZE)
+MIN_DIFF_THRESHOLD = 25                # floor under Otsu so two near-identical photos don't light up with noise
+ORB_FEATURES = 2000
+MIN_ALIGNMENT_MATCHES = 12
+ALGORITHM_VERSION = 1                  # bump when the comparison changes so cached results are recomputed
+WRITE_BATCH_SIZE = 50
+
+
+@dataclass
+class ChangeResult:
+    score: float                       # share of the frame covered by changed regions (0..1)
+    boxes: list = field(default_factory=list)   # [x, y, w, h] at DIFF_SIZE
+    aligned: bool = False              # False when too few feature matches to align; diffed as-is
+
+
+# -----------------------------
+# Comparison (pure functions, safe to run in worker processes)
+# -----------------------------
+def decode_image(data):
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("not a decodable image")
+    return image
+
+
+def align_images(reference_gray, moving_gray):
+    """
+    Warps moving_gray onto reference_gray with a RANSAC partial-affine (rotation, scale,
+    translation) fitted to ORB matches. Returns (warped image, True) or (moving_gray, False).
+    """
+    orb = cv2.ORB_create(ORB_FEATURES)
+    ref_keypoints, ref_descriptors = orb.detectAndCompute(reference_gray, None)
+    mov_keypoints, mov_descriptors = orb.detectAndCompute(moving_gray, None)
+    if ref_descriptors is None or mov_descriptors is None:
+        return moving_gray, False
+
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    matches = sorted(matcher.match(mov_descriptors, ref_descriptors), key=lambda m: m.distance)
+    if len(matches) < MIN_ALIGNMENT_MATCHES:
+        return moving_gray, False
+
+    src = np.float32([mov_keypoints[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
+    dst = np.float32([ref_keypoints[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
+    matrix, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if matrix is None or inliers is None or int(inliers.sum()) < MIN_ALIGNMENT_MATCHES:
+        return moving_gray, False
+    height, width = reference_gray.shape[:2]
+    return cv2.warpAffine(moving_gray, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE), True
+
+
+def compare_images(before, after):
+    """Diffs two BGR images after aligning `after` onto `before`; returns a ChangeResult."""
+    before = cv2.resize(before, DIFF_SIZE)
+    after = cv2.resize(after, DIFF_SIZE)
+    gray1 = cv2.cvtColor(before, cv2.COLOR_BGR2GRAY)
+    gray2 = cv2.cvtColor(after, cv2.COLOR_BGR2GRAY)
+    gray2, aligned = align_images(gray1, gray2)
+
+    # Absolute difference, Otsu threshold (with a floor), dilation to merge adjacent changes
+    diff = cv2.absdiff(gray1, gray2)
+    otsu, _ = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    thresh = cv2.threshold(diff, max(otsu, MIN_DIFF_THRESHOLD), 255, cv2.THRESH_BINARY)[1]
+    kernel = np.ones((5, 5), np.uint8)
+    dilate = cv2.dilate(thresh, kernel, iterations=2)
+
+    contours = cv2.findContours(dilate.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours = imutils.grab_contours(contours)
+    boxes, changed_area = [], 0
+    for contour in contours:
+        if cv2.contourArea(contour) > MIN_CONTOUR_AREA:  # Filter small areas
+            x, y, w, h = cv2.boundingRect(contour)
+            boxes.append([int(x), int(y), int(w), int(h)])
+            changed_area += int(np.count_nonzero(dilate[y:y + h, x:x + w]))
+    score = min(1.0, changed_area / float(DIFF_SIZE[0] * DIFF_SIZE[1]))
+    return ChangeResult(score=round(score, 4), boxes=boxes, aligned=aligned)
+
+
+def annotate(before, after, result):
+    """Side-by-side image of the pair with the changed regions boxed in red (what picture.py displayed)."""
+    before = cv2.resize(before, DIFF_SIZE)
+    after = cv2.resize(after, DIFF_SIZE)
+    for x, y, w, h in result.boxes:
+        cv2.rectangle(before, (x, y), (x + w, y + h), (0, 0, 255), 2)
+        cv2.rectangle(after, (x, y), (x + w, y + h), (0, 0, 255), 2)
+    spacer = np.zeros((DIFF_SIZE[1], 10, 3), np.uint8)
+    return np.hstack((before, spacer, after))
+
+
+def compare_files(before_path, after_path):
+    before, after = cv2.imread(before_path), cv2.imread(after_path)
+    if before is None or after is None:
+        raise FileNotFoundError(f"Could not read {before_path if before is None else after_path}")
+    return before, after, compare_images(before, after)
+
+
+# -----------------------------
+# Pairing photos from the document store
+# -----------------------------
+def photo_pairs(conn, equipment_id=None):
+    """
+    Consecutive (equipment_id, before_sha256, after_sha256, before_date, after_date) pairs
+    of distinct photos per Equipment ID, ordered by upload date.
+    """
+    sql = """
+        SELECT ed.equipment_id, ed.sha256, ed.upload_date
+        FROM equipment_documents ed JOIN documents d ON d.sha256 = ed.sha256
+        WHERE d.mime LIKE 'image/%'
+    """
+    params = ()
+    if equipment_id is not None:
+        sql += " AND ed.equipment_id = ?"
+        params = (equipment_id,)
+    rows = conn.execute(sql + " ORDER BY ed.equipment_id, ed.upload_date, ed.uploaded_at", params).fetchall()
+
+    pairs, previous = [], None
+    for equipment, sha256, upload_date in rows:
+        if previous is not None and previous[0] == equipment and previous[1] != sha256:
+            pairs.append((equipment, previous[1], sha256, previous[2], upload_date))
+        previous = (equipment, sha256, upload_date)
+    return pairs
+
+
+# -----------------------------
+# Storage
+# -----------------------------
+def ensure_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+            before_sha256 TEXT NOT NULL,
+            after_sha256 TEXT NOT NULL,
+            algorithm_version INTEGER NOT NULL,
+            score REAL,
+            aligned INTEGER,
+            boxes TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (before_sha256, after_sha256, algorithm_version)
+        )
+    """)
+
+
+def _cached_pair_keys(conn):
+    return {(a, b) for a, b in conn.execute(
+        f"SELECT before_sha256, after_sha256 FROM {CHANGES_TABLE} WHERE algorithm_version = ?", (ALGORITHM_VERSION,))}
+
+
+def _store_results(db_path, results):
+    now = time.time()
+    with db_pool.get_pool(db_path).writer() as conn:
+        conn.executemany(f"""
+            INSERT OR REPLACE INTO {CHANGES_TABLE}
+                (before_sha256, after_sha256, algorithm_version, score, aligned, boxes, error, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(before, after, ALGORITHM_VERSION,
+               result["score"] if result else None,
+               int(result["aligned"]) if result else None,
+               json.dumps(result["boxes"]) if result else None,
+               error, now) for before, after, result, error in results])
+
+
+def change_history(db_path, equipment_id):
+    """Stored results for every consecutive photo pair of one asset, oldest first."""
+    with db_pool.get_pool(db_path).reader() as conn:
+        pairs = photo_pairs(conn, equipment_id)
+        history = []
+        for _, before, after, before_date, after_date in pairs:
+            row = conn.execute(f"""
+                SELECT score, aligned, boxes, error FROM {CHANGES_TABLE}
+                WHERE before_sha256 = ? AND after_sha256 = ? AND algorithm_version = ?
+            """, (before, after, ALGORITHM_VERSION)).fetchone()
+            history.append({
+                "before_sha256": before, "after_sha256": after,
+                "before_date": before_date, "after_date": after_date,
+                "score": row[0] if row else None,
+                "aligned": bool(row[1]) if row and row[1] is not None else None,
+                "boxes": json.loads(row[2]) if row and row[2] else [],
+                "error": row[3] if row else "not processed yet",
+            })
+    return history
+
+
+# -----------------------------
+# Batch run
+# -----------------------------
+def _compare_stored_pair(db_path, before_sha256, after_sha256):
+    """Worker: reads both photos on its own read-only connection and compares them."""
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        before = decode_image(document_store.read_document(conn, before_sha256))
+        after = decode_image(document_store.read_document(conn, after_sha256))
+    except Exception as e:  # one unreadable photo shouldn't stop the run
+        return before_sha256, after_sha256, None, f"{type(e).__name__}: {e}"
+    finally:
+        conn.close()
+    return before_sha256, after_sha256, asdict(compare_images(before, after)), None
+
+
+def detect_changes(db_path, workers=None, equipment_id=None):
+    """
+    Compares every consecutive photo pair without a cached result on a process pool and
+    stores the scores/boxes. Returns a summary dict.
+    """
+    document_store.ensure_schema_once(db_path)
+    with db_pool.get_pool(db_path).writer() as conn:
+        ensure_table(conn)
+    with db_pool.get_pool(db_path).reader() as conn:
+        pairs = photo_pairs(conn, equipment_id)
+        cached = _cached_pair_keys(conn)
+
+    # Several assets can share a pair of identical photos; compare each pair once
+    pending = list(dict.fromkeys((before, after) for _, before, after, _, _ in pairs if (before, after) not in cached))
+    summary = {"pairs": len(pairs), "cached": len(pairs) - len(pending), "compared": 0, "failed": 0}
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_compare_stored_pair, db_path, before, after) for before, after in pending]
+        for future in as_completed(futures):
+            before, after, result, error = future.result()
+            summary["failed" if error else "compared"] += 1
+            if error:
+                logger.warning("Change detection failed for %s -> %s: %s", before[:12], after[:12], error)
+            batch.append((before, after, result, error))
+            if len(batch) >= WRITE_BATCH_SIZE:
+                _store_results(db_path, batch)
+                batch = []
+    if batch:
+        _store_results(db_path, batch)
+    return summary
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect physical changes between consecutive equipment photos.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Compare every new photo pair in the document store")
+    run.add_argument("--db", default="app/assets_data.db")
+    run.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    run.add_argument("--equipment", default=None, help="Only this Equipment ID")
+
+    show = subparsers.add_parser("show", help="Print the stored change history of one asset")
+    show.add_argument("equipment_id")
+    show.add_argument("--db", default="app/assets_data.db")
+
+    compare = subparsers.add_parser("compare", help="Compare two image files directly")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    compare.add_argument("-o", "--output", default=None, help="Write the annotated side-by-side image here")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        started = time.perf_counter()
+        summary = detect_changes(args.db, args.workers, args.equipment)
+        print(f"🔍 {summary['pairs']} photo pairs: {summary['compared']} compared, {summary['cached']} cached, "
+              f"{summary['failed']} failed in {time.perf_counter() - started:.1f}s")
+    elif args.command == "show":
+        print(json.dumps(change_history(args.db, args.equipment_id), indent=2))
+    else:
+        before, after, result = compare_files(args.before, args.after)
+        print(json.dumps(asdict(result), indent=2))
+        if args.output:
+            cv2.imwrite(args.output, annotate(before, after, result))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,23 +8,106 @@ import base64
 # Make sure your smartbo test.py file is named 'smatbotest.py'
 # or adjust this import statement accordingly.
 from smatbotest_v import (
+    DB_PATH,
+    DOCUMENT_PAGE_SIZE,
+    RESULT_PAGE_SIZE,
     extract_table_metadata,
-    generate_sql_query,
     fetch_answer_from_db,
-    answer_question_from_df,
-    # New imports for document feature:
-    generate_document_sql_query,
-    fetch_document_blobs_from_db,
+    forget_document_sql,
+    record_verified_example,
     _get_display_type 
 )
+# Async/streaming variants: SQL generation overlaps with rendering, answers stream as they arrive
+from smatbotest_async import (
+    agenerate_valid_sql,
+    aroute_or_generate_document_sql_query,
+    astream_answer_from_df,
+    iter_async_generator,
+    submit,
+)
 # Assuming fileuploadnew is a separate module for handling uploads,
 # though it's not directly used in the query/document retrieval flow.
-from fileuploadnew import handle_file_upload_and_store 
+from fileuploadnew import handle_file_upload_and_store, handle_bulk_import
+from query_router import router_stats
+from schema_linking import linking_stats
+import app_state
 
 
 st.set_page_config(layout="centered")
 st.title("Ask Your Equipment Database")
 
+# Connection pool, schema snapshot and LLM clients: built on the first run of this process only
+app_state.warm_up()
+
+def show_guard_report(report):
+    """Lists every execution guardrail that applied to a query (sql_guard.GuardReport)."""
+    if report is None:
+        return
+    with st.expander("Query guardrails"):
+        st.caption(f"Ran in {report.elapsed_s:.3f}s (~{report.vm_steps:,} VM steps), row cap {report.row_cap}.")
+        for note in report.messages():
+            st.warning(note)
+        st.code(report.executed_sql, language="sql")
+
+
+def page_navigation(pager, page, key, container=st):
+    """
+    Previous/Next buttons for a result pager kept in session state ({"sql", "params",
+    "cursors", "page"}); cursors[i] is where page i starts.
+    """
+    start = pager["page"] * page["size"]
+    previous_col, label_col, next_col = container.columns([1, 2, 1])
+    label_col.caption(f"Page {pager['page'] + 1} · rows {start + 1}–{start + page['rows']}")
+    if previous_col.button("◀ Previous", key=f"{key}_previous", disabled=pager["page"] == 0):
+        pager["page"] -= 1
+        st.rerun()
+    if next_col.button("Next ▶", key=f"{key}_next", disabled=page["next_cursor"] is None):
+        del pager["cursors"][pager["page"] + 1:]
+        pager["cursors"].append(page["next_cursor"])
+        pager["page"] += 1
+        st.rerun()
+
+
+def show_result_pages(container):
+    """Renders the current page of the last query's result (loaded on demand, one page at a time)."""
+    pager = st.session_state.get("result_pager")
+    if not pager:
+        return
+    try:
+        page = app_state.result_page(pager["sql"], pager["params"], pager["cursors"][pager["page"]])
+    except Exception as e:
+        container.error(f"Could not load the result page: {e}")
+        return
+    if page.num_rows == 0 and pager["page"] == 0:
+        container.info("No matching data found.")
+        return
+    container.dataframe(page.table)
+    page_navigation(pager, {"size": RESULT_PAGE_SIZE, "rows": page.num_rows, "next_cursor": page.next_cursor},
+                    "result_page", container)
+
+
+# Share of questions answered by the fast-path router without an LLM call (this process)
+with st.sidebar.expander("Fast-path router coverage"):
+    st.json(router_stats())
+
+# Prompt tokens saved by sending only the linked columns (this process)
+with st.sidebar.expander("Schema linking"):
+    st.json(linking_stats())
+
+# Latency and throughput per pipeline stage over the last hour (every process, see telemetry.py)
+with st.sidebar.expander("Pipeline latency (last hour)"):
+    stage_rows = app_state.pipeline_latency(DB_PATH)
+    if stage_rows:
+        st.dataframe(pd.DataFrame(stage_rows).set_index("stage"))
+    else:
+        st.caption("No questions answered in the last hour.")
+    st.caption("Prometheus: `python telemetry.py serve` exposes /metrics.")
+
+# After reloading the asset sheet with the loader, drop what was cached from the old data
+if st.sidebar.button("Reload data caches", key="reload_data_caches"):
+    app_state.on_data_reloaded(DB_PATH)
+    st.sidebar.success("Schema and cached results will be reloaded.")
+
 # Create tabs for different functionalities
 tab1, tab2 = st.tabs(["Text-to-SQL Query", "Document Retrieval"])
 
@@ -35,36 +118,68 @@ with tab1:
     st.header("Query Your Database with Natural Language")
     question_sql = st.text_input("Enter your question:", placeholder="e.g. Where is EQ-3115 located?", key="sql_query_input")
 
-    if st.button("Submit Query", key="submit_sql_query"):
-        with st.spinner("Generating SQL and fetching results..."):
-            try:
-                # Agent 0: Get schema
-                column_metadata, example_sql_query = extract_table_metadata()
+    submitted = st.button("Submit Query", key="submit_sql_query")
+    if submitted:
+        try:
+            # Agents 0 + 1: schema + SQL generation run on the background event loop
+            # (fast-path router first, LLM only if it isn't confident) while the page renders
+            sql_future = submit(agenerate_valid_sql(question_sql))
+
+            st.subheader("LLM Answer")
+            answer_container = st.container()
+            st.subheader("Retrieved Data")
+            data_container = st.container()
+
+            with st.spinner("Generating SQL and fetching results..."):
+                outcome = sql_future.result()
+                if outcome.sql_query is None:
+                    raise RuntimeError(f"No valid SQL after {outcome.attempts} attempts: {outcome.errors[-1] if outcome.errors else 'unknown error'}")
+                sql_query, params = outcome.sql_query, outcome.params
 
-                # Agent 1: Generate SQL query
-                sql_query = generate_sql_query(question_sql, example_sql_query, column_metadata, "filled_asset_data")
-                
                 # Hide SQL query in an expander
                 with st.expander("Show Generated SQL Query"):
                     st.code(sql_query, language="sql")
+                    if outcome.routed:
+                        st.caption(f"Answered by the fast-path router (no LLM call). Parameters: {list(params)}")
+                    if outcome.succeeded_on and outcome.succeeded_on > 1:
+                        st.caption(f"Valid SQL on attempt {outcome.succeeded_on}; earlier errors fed back to the model:")
+                        for error in outcome.errors:
+                            st.text(error)
 
-                # Agent 2: Execute SQL query
-                df = fetch_answer_from_db(sql_query)
+                # Agent 2: Execute SQL query (read-only, row-capped, time-budgeted; see sql_guard.py)
+                df = fetch_answer_from_db(sql_query, params)
+                show_guard_report(df.attrs.get("guard_report") if df is not None else None)
 
-                # Agent 3: Answer from LLM
-                answer = answer_question_from_df(question_sql, df)
+            # Show the first page straight away (later pages load on demand); the answer streams in above it
+            st.session_state["result_pager"] = {"sql": sql_query, "params": tuple(params), "cursors": [None], "page": 0}
+            show_result_pages(data_container)
 
-                st.subheader("LLM Answer")
-                st.write(answer)
+            # Agent 3: Answer from LLM, rendered token by token; kept so paging reruns can show it again
+            st.session_state["last_answer_text"] = answer_container.write_stream(
+                iter_async_generator(astream_answer_from_df(question_sql, df)))
 
-                st.subheader("Retrieved Data")
-                if df is not None and not df.empty:
-                    st.dataframe(df)
-                else:
-                    st.info("No matching data found.")
+            # Offer the pair as a few-shot example; router SQL is parameterized and needs no examples
+            st.session_state["last_sql_answer"] = None if outcome.routed or df is None or df.empty else {
+                "question": question_sql, "sql": sql_query}
 
-            except Exception as e:
-                st.error(f"Error occurred during SQL query: {str(e)}")
+        except Exception as e:
+            st.session_state.pop("result_pager", None)
+            st.error(f"Error occurred during SQL query: {str(e)}")
+
+    elif st.session_state.get("result_pager"):
+        # A paging rerun: the answer stays as it was, only the table moves to another page
+        st.subheader("LLM Answer")
+        st.write(st.session_state.get("last_answer_text") or "")
+        st.subheader("Retrieved Data")
+        show_result_pages(st)
+
+    last_answer = st.session_state.get("last_sql_answer")
+    if last_answer:
+        if st.button("👍 Answer is correct — save as an example", key="accept_sql_answer"):
+            added = record_verified_example(last_answer["question"], last_answer["sql"])
+            st.session_state["last_sql_answer"] = None
+            st.success("Saved; similar questions will now see this query as an example." if added
+                       else "This question is already saved as an example.")
 
 # ---------------------------------
 # Tab 2: Document Retrieval (New Feature)
@@ -79,80 +194,107 @@ with tab2:
     if st.button("Retrieve Document", key="submit_doc_query"):
         with st.spinner("Searching for documents..."):
             try:
-                # Agent 0: Get schema (needed for LLM context)
-                column_metadata, _ = extract_table_metadata()
-
-                # Generate SQL query for documents
-                doc_sql_query = generate_document_sql_query(document_question, column_metadata, "filled_asset_data")
+                # Agent 0 + document SQL generation (fast-path router first, LLM only if it isn't confident)
+                doc_sql_query, doc_params, routed = submit(aroute_or_generate_document_sql_query(document_question)).result()
                 
                 # Hide SQL query in an expander
                 with st.expander("Show Generated Document SQL Query"):
                     st.code(doc_sql_query, language="sql")
+                    if routed:
+                        st.caption(f"Answered by the fast-path router (no LLM call). Parameters: {list(doc_params)}")
 
-                # Fetch document BLOBs
-                docs_df = fetch_document_blobs_from_db(doc_sql_query)
-
-                st.subheader("Retrieved Documents:")
-                if docs_df is not None and not docs_df.empty:
-                    # Validate that the required columns are present in the DataFrame
-                    required_doc_cols = ["uploaded_file_name", "uploaded_file_type", "uploaded_file_data"]
-                    
-                    # Ensure this block is correctly indented
-                    if not all(col in docs_df.columns for col in required_doc_cols):
-                       missing_cols = [col for col in required_doc_cols if col not in docs_df.columns]
-                       st.error(f"Error: The generated SQL query did not return all required document columns. Missing: {', '.join(missing_cols)}. Please ensure the generated SQL includes 'uploaded_file_name', 'uploaded_file_type', and 'uploaded_file_data' in its SELECT clause.")
-                       st.dataframe(docs_df) 
-                     # This return is now correctly inside the 'if' block
-                        
-                    # Filter out rows where "uploaded_file_data" is None or empty
-                    docs_df_clean = docs_df[docs_df['uploaded_file_data'].notna() & (docs_df['uploaded_file_data'] != b'')]
-                    
-                    if docs_df_clean.empty:
-                        st.info("No documents found for your query or documents have no data.")
-                    else:
-                        for index, row in docs_df_clean.iterrows():
-                            # Use .get() for robust access, providing a default if column is missing (though it shouldn't be after schema check)
-                            file_name = row.get('uploaded_file_name', f'Unknown Document {index+1}')
-                            file_type = row.get('uploaded_file_type', 'application/octet-stream')
-                            file_data_blob = row.get('uploaded_file_data')
-                            equipment_id = row.get('Equipment ID', 'N/A') # Get Equipment ID if available in select
-
-                            if file_data_blob:
-                                display_type = _get_display_type(file_type)
-                                
-                                st.write(f"--- Document for Equipment ID: **{equipment_id}** ---")
-                                st.write(f"**File Name:** {file_name}")
-                                st.write(f"**File Type:** {file_type}")
-
-                                if display_type == 'image':
-                                    try:
-                                        st.image(file_data_blob, caption=file_name, use_column_width=True)
-                                    except Exception as img_e:
-                                        st.warning(f"Could not display image {file_name}: {img_e}")
-                                    
-                                elif display_type == 'pdf':
-                                    st.info("This is a PDF document.")
-                                    # Optional: For small PDFs, you could try embedding via base64, but it can be slow/resource intensive for large files.
-                                    # For simplicity and reliability, primarily offer download.
-                                    
-                                else:
-                                    st.info("This is a document of an unknown type for direct display. Please download it.")
-
-                                # Provide a download button for all retrieved files
-                                st.download_button(
-                                    label=f"Download {file_name}",
-                                    data=file_data_blob,
-                                    file_name=file_name,
-                                    mime=file_type,
-                                    key=f"download_doc_{index}"
-                                )
-                                st.markdown("---") # Separator between documents
-
-                else:
-                    st.info("No documents found matching your criteria.")
+                # Document metadata is fetched a page at a time below (no bytes yet); kept in
+                # session state so the paging and Open/Download buttons survive their reruns
+                st.session_state["doc_pager"] = {"sql": doc_sql_query, "params": tuple(doc_params), "cursors": [None], "page": 0,
+                                                 "question": document_question, "routed": routed}
+                st.session_state.pop("opened_doc", None)
+                st.session_state.pop("similar_to", None)
 
             except Exception as e:
                 st.error(f"Error occurred during document retrieval: {str(e)}")
 
+    doc_pager = st.session_state.get("doc_pager")
+    if doc_pager is not None:
+        st.subheader("Retrieved Documents:")
+        try:
+            docs_page = app_state.document_page(doc_pager["sql"], doc_pager["params"], doc_pager["cursors"][doc_pager["page"]])
+        except Exception as e:
+            docs_page = None
+            if not doc_pager["routed"]:
+                forget_document_sql(doc_pager["question"], extract_table_metadata()[0])
+            st.error(f"SQL Execution Error during document retrieval: {e}\nQuery: {doc_pager['sql']}")
+        if docs_page is not None and docs_page.num_rows:
+            show_guard_report(docs_page.report)
+            # Thumbnails by default; only the one opened original is read from the store
+            first_index = doc_pager["page"] * DOCUMENT_PAGE_SIZE
+            for index, row in enumerate(docs_page.table.to_pylist(), start=first_index):
+                file_name = row.get('file_name') or f'Unknown Document {index+1}'
+                file_type = row.get('mime') or 'application/octet-stream'
+                equipment_id = row.get('Equipment ID', 'N/A')
+                sha256 = row['sha256']
+                display_type = _get_display_type(file_type)
+
+                st.write(f"--- Document for Equipment ID: **{equipment_id}** ---")
+                st.write(f"**File Name:** {file_name}")
+                st.write(f"**File Type:** {file_type}")
+                if row.get('upload_date'):
+                    st.write(f"**Upload Date:** {row['upload_date']}")
+
+                try:
+                    preview = app_state.thumbnail(DB_PATH, sha256, file_type)
+                except Exception as thumb_e:
+                    preview = None
+                    st.warning(f"Could not build a preview for {file_name}: {thumb_e}")
+
+                if preview is not None:
+                    st.image(preview[0], caption=f"{file_name} (preview)")
+                elif display_type == 'pdf':
+                    st.info("This is a PDF document.")
+                else:
+                    st.info("This is a document of an unknown type for direct display. Please download it.")
+
+                if display_type == 'image':
+                    if st.button("Find similar", key=f"similar_doc_{index}"):
+                        st.session_state["similar_to"] = sha256
+                    if st.session_state.get("similar_to") == sha256:
+                        similar = app_state.similar_documents(DB_PATH, sha256)
+                        if not similar:
+                            st.caption("No other stored photos look like this one.")
+                        for match in similar:
+                            linked = ", ".join(f"{link['Equipment ID']} ({link['file_name']})" for link in match["links"])
+                            similar_preview = app_state.thumbnail(DB_PATH, match["sha256"], match["mime"])
+                            if similar_preview is not None:
+                                st.image(similar_preview[0], width=160)
+                            st.caption(f"{linked} · {match['distance']} bits apart")
+
+                if st.session_state.get("opened_doc") != index:
+                    if st.button(f"Open / download {file_name}", key=f"open_doc_{index}"):
+                        st.session_state["opened_doc"] = index  # opening one closes the previous one
+                        st.rerun()
+                else:
+                    file_data_blob = app_state.document_bytes(sha256)
+                    if display_type == 'image':
+                        try:
+                            st.image(file_data_blob, caption=file_name, use_column_width=True)
+                        except Exception as img_e:
+                            st.warning(f"Could not display image {file_name}: {img_e}")
+
+                    # Provide a download button for the opened file
+                    st.download_button(
+                        label=f"Download {file_name}",
+                        data=file_data_blob,
+                        file_name=file_name,
+                        mime=file_type,
+                        key=f"download_doc_{index}"
+                    )
+                st.markdown("---") # Separator between documents
+
+            page_navigation(doc_pager, {"size": DOCUMENT_PAGE_SIZE, "rows": docs_page.num_rows,
+                                        "next_cursor": docs_page.next_cursor}, "doc_page")
+
+        elif docs_page is not None:
+            st.info("No documents found matching your criteria.")
+
     # The file upload component is now exclusively inside the "Document Retrieval" tab
     handle_file_upload_and_store()
+    handle_bulk_import()
@@ -0,0 +1,197 @@
+# db_pool.py (Shared SQLite connections: pooled read-only readers + a single writer)
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# -----------------------------
+# Config
+# -----------------------------
+MAX_READERS = 8
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KIB = 32768             # per connection; negative cache_size is in KiB
+MMAP_SIZE_BYTES = 256 * 1024 * 1024
+
+
+class ConnectionPool:
+    """
+    Long-lived connections to one SQLite database.
+
+    Readers are opened with mode=ro and handed out one thread at a time, so they keep
+    their page cache warm between requests. All writes (uploads) go through a single
+    writer connection guarded by a lock. The database is switched to WAL mode so
+    readers keep working while the writer has a BLOB upload in flight.
+    """
+
+    def __init__(self, db_path, max_readers=MAX_READERS):
+        self.db_path = os.path.abspath(db_path)
+        self.max_readers = max_readers
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._writer_lock = threading.Lock()
+        self._writer = None
+        self._readers_open = 0
+        self._stats = {
+            "reader_checkouts": 0,
+            "reader_waits": 0,
+            "reader_wait_seconds": 0.0,
+            "readers_in_use": 0,
+            "readers_peak_in_use": 0,
+            "writer_checkouts": 0,
+            "writer_wait_seconds": 0.0,
+            "writer_rollbacks": 0,
+        }
+        # Opening the writer first creates the file if needed and switches it to WAL,
+        # which read-only connections cannot do themselves.
+        self._get_writer()
+
+    # -----------------------------
+    # Connection setup
+    # -----------------------------
+    def _apply_common_pragmas(self, conn):
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE_BYTES}")
+
+    def _open_reader(self):
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        self._apply_common_pragmas(conn)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _get_writer(self):
+        if self._writer is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")  # durable enough under WAL
+            self._apply_common_pragmas(conn)
+            self._writer = conn
+        return self._writer
+
+    # -----------------------------
+    # Checkout API
+    # -----------------------------
+    @contextmanager
+    def reader(self):
+        """Checks out a read-only connection for the duration of the with-block."""
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                self._stats["readers_in_use"] -= 1
+            self._idle.put(conn)
+
+    def _acquire_reader(self):
+        with self._lock:
+            self._stats["reader_checkouts"] += 1
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                if self._readers_open < self.max_readers:
+                    self._readers_open += 1
+                    open_new = True
+                else:
+                    open_new = False
+                    self._stats["reader_waits"] += 1
+
+        if conn is None:
+            if open_new:
+                try:
+                    conn = self._open_reader()
+                except Exception:
+                    with self._lock:
+                        self._readers_open -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                conn = self._idle.get()
+                with self._lock:
+                    self._stats["reader_wait_seconds"] += time.perf_counter() - started
+
+        with self._lock:
+            self._stats["readers_in_use"] += 1
+            self._stats["readers_peak_in_use"] = max(self._stats["readers_peak_in_use"], self._stats["readers_in_use"])
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """
+        Checks out the single writer connection. Commits when the with-block exits
+        cleanly and rolls back if it raises.
+        """
+        started = time.perf_counter()
+        with self._writer_lock:
+            with self._lock:
+                self._stats["writer_checkouts"] += 1
+                self._stats["writer_wait_seconds"] += time.perf_counter() - started
+            conn = self._get_writer()
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                with self._lock:
+                    self._stats["writer_rollbacks"] += 1
+                raise
+
+    # -----------------------------
+    # Introspection / shutdown
+    # -----------------------------
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["readers_open"] = self._readers_open
+            stats["readers_idle"] = self._idle.qsize()
+            stats["max_readers"] = self.max_readers
+        return stats
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                    self._readers_open -= 1
+                except queue.Empty:
+                    break
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+# -----------------------------
+# Process-wide registry
+# -----------------------------
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path):
+    """Returns the shared ConnectionPool for db_path, creating it on first use."""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(key)
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats():
+    """Statistics for every pool opened in this process, keyed by database path."""
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {path: pool.stats() for path, pool in pools}
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
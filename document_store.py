@@ -0,0 +1,263 @@
+# document_store.py (Content-addressed document store: deduplicated BLOBs + per-equipment links)
+#
+# Documents are stored once per SHA-256 in "documents" and linked to any number of
+# equipment through "equipment_documents". Bytes are written and read in chunks through
+# sqlite3.Connection.blobopen, so no full file is ever materialized on the way in or out.
+#
+# Usage (move documents out of the legacy filled_asset_data.uploaded_file_* columns):
+#   python document_store.py migrate --db app/assets_data.db [--vacuum]
+import argparse
+import hashlib
+import io
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Config
+# -----------------------------
+CHUNK_SIZE = 1024 * 1024
+FILE_NAME_PATTERN = re.compile(r"^(EQ-\d{4})_(\d{2})_(\d{2})_(\d{4})\.(pdf|jpg|jpeg|png)$", re.IGNORECASE)
+LEGACY_COLUMNS = ["uploaded_file_name", "uploaded_file_type", "uploaded_file_data", "upload_date"]
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS documents (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mime TEXT,
+    data BLOB NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS equipment_documents (
+    id INTEGER PRIMARY KEY,
+    equipment_id TEXT NOT NULL,
+    sha256 TEXT NOT NULL REFERENCES documents(sha256),
+    file_name TEXT NOT NULL,
+    upload_date TEXT,
+    uploaded_at TEXT NOT NULL,
+    UNIQUE (equipment_id, sha256, file_name)
+);
+CREATE INDEX IF NOT EXISTS idx_equipment_documents_equipment_id ON equipment_documents (equipment_id);
+CREATE INDEX IF NOT EXISTS idx_equipment_documents_sha256 ON equipment_documents (sha256);
+"""
+
+# Metadata only; bytes are loaded on demand with read_document / iter_document_chunks
+DOCUMENT_METADATA_SQL = """
+SELECT ed.equipment_id AS "Equipment ID", ed.file_name, d.mime, d.size, ed.upload_date, ed.sha256
+FROM equipment_documents ed JOIN documents d ON d.sha256 = ed.sha256
+"""
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+# -----------------------------
+# Schema
+# -----------------------------
+def ensure_schema(conn):
+    conn.executescript(SCHEMA_SQL)
+
+
+def ensure_schema_once(db_path):
+    """Creates the store tables through the pool's writer, once per database per process."""
+    import db_pool
+
+    key = os.path.abspath(db_path)
+    with _schema_lock:
+        if key in _schema_ready:
+            return
+        with db_pool.get_pool(db_path).writer() as conn:
+            ensure_schema(conn)
+        _schema_ready.add(key)
+
+
+def parse_document_file_name(file_name):
+    """Returns (equipment_id, ISO upload date) for names like EQ-3115_21_04_2024.jpg, else None."""
+    match = FILE_NAME_PATTERN.match(file_name)
+    if not match:
+        return None
+    equipment_id, day, month, year = match.group(1, 2, 3, 4)
+    try:
+        upload_date = datetime(int(year), int(month), int(day)).date().isoformat()
+    except ValueError:
+        return None
+    return equipment_id.upper(), upload_date
+
+
+# -----------------------------
+# Writing
+# -----------------------------
+def _as_stream(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def _hash_stream(stream, chunk_size=CHUNK_SIZE):
+    """SHA-256 and size of a seekable stream, read in chunks from its start."""
+    stream.seek(0)
+    digest, size = hashlib.sha256(), 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _write_blob(conn, sha256, size, mime, stream, chunk_size=CHUNK_SIZE):
+    cursor = conn.execute(
+        "INSERT INTO documents (sha256, size, mime, data, created_at) VALUES (?, ?, ?, zeroblob(?), ?)",
+        (sha256, size, mime, size, datetime.now().isoformat()))
+    stream.seek(0)
+    with conn.blobopen("documents", "data", cursor.lastrowid) as blob:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            blob.write(chunk)
+
+
+def store_document(conn, equipment_id, file_name, mime, source, upload_date=None, sha256=None, size=None):
+    """
+    Stores a document (bytes or any seekable binary stream, including a sqlite3.Blob) and
+    links it to equipment_id. Identical content is stored once. Runs inside the caller's
+    transaction; returns (sha256, deduplicated). Pass sha256 and size when the caller has
+    already hashed the content (e.g. bulk_ingest.py workers) to skip a second pass.
+    """
+    stream = _as_stream(source)
+    if sha256 is None or size is None:
+        sha256, size = _hash_stream(stream)
+    deduplicated = conn.execute("SELECT 1 FROM documents WHERE sha256 = ?", (sha256,)).fetchone() is not None
+    if not deduplicated:
+        _write_blob(conn, sha256, size, mime, stream)
+    if upload_date is None:
+        parsed = parse_document_file_name(file_name)
+        upload_date = parsed[1] if parsed else None
+    conn.execute(
+        "INSERT OR IGNORE INTO equipment_documents (equipment_id, sha256, file_name, upload_date, uploaded_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (equipment_id, sha256, file_name, upload_date, datetime.now().isoformat()))
+    logger.info("Stored %s for %s (%s, %s bytes%s)", file_name, equipment_id, sha256[:12], size,
+                ", deduplicated" if deduplicated else "")
+    return sha256, deduplicated
+
+
+# -----------------------------
+# Reading
+# -----------------------------
+def _document_rowid(conn, sha256):
+    row = conn.execute("SELECT rowid, size FROM documents WHERE sha256 = ?", (sha256,)).fetchone()
+    if row is None:
+        raise KeyError(f"No document with sha256 {sha256}")
+    return row
+
+
+def iter_document_chunks(conn, sha256, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """Yields the bytes [start, end) of a document in chunks (end defaults to the document size)."""
+    rowid, size = _document_rowid(conn, sha256)
+    end = size if end is None else min(end, size)
+    with conn.blobopen("documents", "data", rowid, readonly=True) as blob:
+        blob.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = blob.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def read_document(conn, sha256):
+    """Whole document as bytes, for consumers (st.image, st.download_button) that need it in memory."""
+    return b"".join(iter_document_chunks(conn, sha256))
+
+
+def list_documents(conn, equipment_ids=None):
+    """Metadata rows (as dicts) for every document, or those linked to equipment_ids."""
+    sql, params = DOCUMENT_METADATA_SQL, ()
+    if equipment_ids is not None:
+        equipment_ids = list(equipment_ids)
+        if not equipment_ids:
+            return []
+        sql += f" WHERE ed.equipment_id IN ({', '.join('?' for _ in equipment_ids)})"
+        params = tuple(equipment_ids)
+    cursor = conn.execute(sql + " ORDER BY ed.equipment_id, ed.upload_date", params)
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+# -----------------------------
+# Migration from the inline columns
+# -----------------------------
+def migrate_inline_documents(conn, table_name="filled_asset_data"):
+    """
+    Copies every uploaded_file_data BLOB in table_name into the store (streaming from the
+    old cell to the new one), then clears the inline columns. Returns a summary dict.
+    """
+    ensure_schema(conn)
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    summary = {"migrated": 0, "deduplicated": 0, "skipped": 0}
+    if not all(col in existing for col in LEGACY_COLUMNS[:3]):
+        return summary
+
+    has_upload_date = "upload_date" in existing
+    rows = conn.execute(
+        f'SELECT rowid, "Equipment ID", uploaded_file_name, uploaded_file_type, '
+        f'{"upload_date" if has_upload_date else "NULL"} FROM "{table_name}" '
+        f'WHERE uploaded_file_data IS NOT NULL AND length(uploaded_file_data) > 0').fetchall()
+    for rowid, equipment_id, file_name, mime, uploaded_at in rows:
+        if not equipment_id:
+            summary["skipped"] += 1
+            continue
+        file_name = file_name or f"{equipment_id}_document"
+        parsed = parse_document_file_name(file_name)
+        upload_date = parsed[1] if parsed else (uploaded_at[:10] if uploaded_at else None)
+        with conn.blobopen(table_name, "uploaded_file_data", rowid, readonly=True) as source:
+            _, deduplicated = store_document(conn, equipment_id, file_name, mime, source, upload_date=upload_date)
+        summary["deduplicated" if deduplicated else "migrated"] += 1
+
+    cleared = ", ".join(f"{col} = NULL" for col in LEGACY_COLUMNS if col in existing)
+    conn.execute(f'UPDATE "{table_name}" SET {cleared} WHERE uploaded_file_data IS NOT NULL')
+    return summary
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the content-addressed document store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="Move inline uploaded_file_* documents into the store")
+    migrate.add_argument("--db", default="app/assets_data.db")
+    migrate.add_argument("--table", default="filled_asset_data")
+    migrate.add_argument("--vacuum", action="store_true", help="Reclaim the space freed by the inline BLOBs")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        with conn:
+            summary = migrate_inline_documents(conn, args.table)
+        if args.vacuum:
+            conn.execute("VACUUM")
+            # VACUUM may renumber rowids of tables without an INTEGER PRIMARY KEY, which
+            # external-content FTS5 indexes (the loader's asset_fts) are keyed on
+            for (fts_table,) in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE sql LIKE 'CREATE VIRTUAL TABLE%fts5%content=%'").fetchall():
+                with conn:
+                    conn.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+    finally:
+        conn.close()
+    print(f"📦 Migrated {summary['migrated']} documents ({summary['deduplicated']} already stored, "
+          f"{summary['skipped']} without an Equipment ID)")
+
+
+if __name__ == "__main__":
+    main()
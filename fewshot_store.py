@@ -0,0 +1,223 @@
+# fewshot_store.py (Verified question → SQL pairs, retrieved as few-shot examples by similarity)
+#
+# Layout of a store directory:
+#   examples.jsonl   one {"question", "sql", "created_at"} per line, append-only
+#   vectors.f32      the matching unit-length float32 embeddings, row-major, append-only
+#   meta.json        {"encoder": ..., "dim": ...}
+#   index.faiss      with faiss installed: an IndexFlatIP over the same vectors (faiss.write_index)
+# Both data files only grow, so adding an example is two appends (no rebuild). On startup
+# vectors.f32 is memory-mapped with NumPy, and index.faiss with faiss.IO_FLAG_MMAP; a new
+# example is added to the loaded index in place and the index file written again.
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from sql_cache import normalize_question
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Config
+# -----------------------------
+DEFAULT_K = 3
+MIN_SIMILARITY = 0.3                   # below this an example is more distracting than helpful
+HASHING_DIM = 512                      # NumPy fallback encoder: hashed word + character-trigram features
+
+_faiss = False                         # not imported yet; None once it turned out not to be installed
+
+
+def _load_faiss():
+    """faiss (optional: exact inner-product search in native code), imported when a store is first opened."""
+    global _faiss
+    if _faiss is False:
+        try:
+            import faiss
+            _faiss = faiss
+        except ImportError:
+            _faiss = None
+    return _faiss
+
+
+# -----------------------------
+# Encoders
+# -----------------------------
+class HashingEncoder:
+    """Dependency-free embedding: signed feature hashing of words and character trigrams."""
+
+    name = f"hashing-{HASHING_DIM}"
+    dim = HASHING_DIM
+
+    def _features(self, text):
+        text = normalize_question(text)
+        words = re.findall(r"[\w-]+", text)
+        padded = f" {text} "
+        return words + [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+    def encode(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                matrix[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+class SentenceEncoder:
+    """sentence-transformers model shared with schema linking."""
+
+    def __init__(self, model):
+        self.model = model
+        self.name = f"st-{type(model).__name__}-{model.get_sentence_embedding_dimension()}"
+        self.dim = model.get_sentence_embedding_dimension()
+
+    def encode(self, texts):
+        return np.asarray(self.model.encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+
+
+def default_encoder():
+    """The sentence-transformers model when it loads (it may not, offline), else the hashing encoder."""
+    import schema_linking
+
+    model = schema_linking.get_embedding_model()
+    return SentenceEncoder(model) if model is not None else HashingEncoder()
+
+
+# -----------------------------
+# Store
+# -----------------------------
+class FewShotStore:
+    def __init__(self, path, encoder=None):
+        self.path = path
+        self.encoder = encoder or default_encoder()
+        self._lock = threading.Lock()
+        self._examples_path = os.path.join(path, "examples.jsonl")
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._meta_path = os.path.join(path, "meta.json")
+        self._index_path = os.path.join(path, "index.faiss")
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def _load(self):
+        self.examples = []
+        if os.path.exists(self._examples_path):
+            with open(self._examples_path, encoding="utf-8") as f:
+                self.examples = [json.loads(line) for line in f if line.strip()]
+        self._seen = {normalize_question(example["question"]) for example in self.examples}
+
+        meta = {}
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        rows = os.path.getsize(self._vectors_path) // (4 * self.encoder.dim) if os.path.exists(self._vectors_path) else 0
+        if meta.get("encoder") != self.encoder.name or rows != len(self.examples):
+            self._reembed_all()  # encoder changed (or a torn write): the only case that rewrites the vectors
+        self._map_vectors()
+
+    def _reembed_all(self):
+        logger.info("Few-shot store: embedding %s examples with %s", len(self.examples), self.encoder.name)
+        vectors = self.encoder.encode([e["question"] for e in self.examples]) if self.examples else \
+            np.zeros((0, self.encoder.dim), dtype=np.float32)
+        with open(self._vectors_path, "wb") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self._meta_path, "w", encoding="utf-8") as f:
+            json.dump({"encoder": self.encoder.name, "dim": self.encoder.dim}, f)
+        if os.path.exists(self._index_path):
+            os.remove(self._index_path)  # built from the old vectors
+
+    def _map_vectors(self):
+        """Memory-maps vectors.f32 (read-only); pages are read on demand and shared between processes."""
+        rows = len(self.examples)
+        if rows:
+            self.vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.encoder.dim))
+        else:
+            self.vectors = np.zeros((0, self.encoder.dim), dtype=np.float32)
+        self.index = None
+        faiss = _load_faiss()
+        if faiss is None:
+            return
+        if os.path.exists(self._index_path):
+            index = faiss.read_index(self._index_path, faiss.IO_FLAG_MMAP)
+            if index.d == self.encoder.dim and index.ntotal == rows:
+                self.index = index
+                return
+        # First start with faiss (or a stale index file): build it once from the vectors
+        self.index = faiss.IndexFlatIP(self.encoder.dim)
+        if rows:
+            self.index.add(np.ascontiguousarray(self.vectors))
+        self._write_index()
+
+    def _write_index(self):
+        temp_path = self._index_path + ".tmp"
+        _load_faiss().write_index(self.index, temp_path)
+        os.replace(temp_path, self._index_path)
+
+    # -----------------------------
+    # Public API
+    # -----------------------------
+    def add(self, question, sql_query):
+        """Appends a verified pair (no-op for a question already stored). Returns True when added."""
+        key = normalize_question(question)
+        with self._lock:
+            if key in self._seen:
+                return False
+            vector = self.encoder.encode([question]).astype(np.float32)
+            example = {"question": question, "sql": sql_query, "created_at": time.time()}
+            with open(self._examples_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(example) + "\n")
+            with open(self._vectors_path, "ab") as f:
+                f.write(vector.tobytes())
+            self.examples.append(example)
+            self._seen.add(key)
+            if self.index is not None:
+                self.index.add(vector)
+                self._write_index()
+                self.vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r",
+                                         shape=(len(self.examples), self.encoder.dim))
+            else:
+                self._map_vectors()
+        return True
+
+    def search(self, question, k=DEFAULT_K, min_similarity=MIN_SIMILARITY):
+        """The k stored pairs most similar to question: [{"question", "sql", "similarity"}]."""
+        with self._lock:
+            count = len(self.examples)
+            if count == 0:
+                return []
+            query = self.encoder.encode([question]).astype(np.float32)
+            if self.index is not None:
+                scores, ids = self.index.search(query, min(k, count))
+                hits = list(zip(ids[0].tolist(), scores[0].tolist()))
+            else:
+                scores = np.asarray(self.vectors @ query[0])
+                top = np.argsort(-scores)[:k]
+                hits = [(int(i), float(scores[i])) for i in top]
+            return [{"question": self.examples[i]["question"], "sql": self.examples[i]["sql"], "similarity": score}
+                    for i, score in hits if i >= 0 and score >= min_similarity]
+
+    def __len__(self):
+        return len(self.examples)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path):
+    """One FewShotStore per directory per process."""
+    key = os.path.abspath(path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = FewShotStore(path)
+        return _stores[key]
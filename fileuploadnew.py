@@ -1,47 +1,50 @@
 
 #works to upload new documents into the db works with the v version
-import sqlite3
-import re
-from datetime import datetime
+import hashlib
+import os
+import shutil
+import tempfile
 import streamlit as st
-import pandas as pd
-from io import StringIO
-from smatbotest_v import (
-    extract_table_metadata,
-    generate_sql_query,
-    fetch_answer_from_db,
-    answer_question_from_df)
+import app_state
+import bulk_ingest
+import db_pool
+import document_store
+import phash_index
+import thumbnails
+from smatbotest_v import DB_PATH
 
 def update_equipment_with_file(equipment_id, file_name, file_type, file_bytes):
-    conn = sqlite3.connect("app/assets_data.db")
-    cursor = conn.cursor()
-
-    # Check if equipment exists
-    cursor.execute('SELECT 1 FROM filled_asset_data WHERE "Equipment ID" = ?', (equipment_id,))
-    exists = cursor.fetchone()
-    if not exists:
-        st.error(f"❌ Equipment ID '{equipment_id}' not found in database.")
-        conn.close()
-        return False
-
-    # Update file fields for matching Equipment ID
-    cursor.execute("""
-        UPDATE filled_asset_data
-        SET uploaded_file_name = ?,
-            uploaded_file_type = ?,
-            uploaded_file_data = ?,
-            upload_date = ?
-        WHERE "Equipment ID" = ?
-    """, (
-        file_name,
-        file_type,
-        file_bytes,
-        datetime.now().isoformat(),
-        equipment_id
-    ))
-
-    conn.commit()
-    conn.close()
+    # file_bytes may also be a seekable stream (e.g. the Streamlit UploadedFile); the
+    # document store hashes and writes it in chunks instead of holding it in memory.
+    document_store.ensure_schema_once(DB_PATH)
+    # Single shared writer connection; readers keep serving queries while this runs (WAL)
+    with db_pool.get_pool(DB_PATH).writer() as conn:
+        cursor = conn.cursor()
+
+        # Check if equipment exists
+        cursor.execute('SELECT 1 FROM filled_asset_data WHERE "Equipment ID" = ?', (equipment_id,))
+        exists = cursor.fetchone()
+        if not exists:
+            st.error(f"❌ Equipment ID '{equipment_id}' not found in database.")
+            return False
+
+        # Content-addressed: identical files are stored once, each equipment can link many
+        sha256, deduplicated = document_store.store_document(conn, equipment_id, file_name, file_type, file_bytes)
+
+    if deduplicated:
+        st.info(f"ℹ️ This file was already stored ({sha256[:12]}); linked it to {equipment_id} without a second copy.")
+
+    # Render the preview now so the Document Retrieval tab never has to ship the original
+    try:
+        thumbnails.ensure_thumbnail(DB_PATH, sha256, file_type)
+    except Exception as e:
+        st.warning(f"⚠️ File stored, but its preview could not be generated: {e}")
+
+    # Perceptual hash for near-duplicate warnings and "find similar"
+    try:
+        phash_index.index_document(DB_PATH, sha256, file_type)
+    except Exception as e:
+        st.warning(f"⚠️ File stored, but it could not be added to the similarity index: {e}")
     return True
 
 def handle_file_upload_and_store():
@@ -53,22 +56,99 @@ def handle_file_upload_and_store():
     )
 
     if uploaded_file:
+        # The uploader keeps returning the same file on every later rerun of the page;
+        # store it once, not again on each unrelated button click
+        upload_key = (getattr(uploaded_file, "file_id", None), uploaded_file.name, uploaded_file.size)
+        if st.session_state.get("stored_upload") == upload_key:
+            st.caption(f"'{uploaded_file.name}' has been stored.")
+            return
+
         file_name = uploaded_file.name
-        pattern = r"^(EQ-\d{4})_(\d{2})_(\d{2})_(\d{4})\.(pdf|jpg|jpeg|png|PDF|JPG|JPEG|PNG)$"
-        match = re.match(pattern, file_name)
+        parsed = document_store.parse_document_file_name(file_name)
 
-        if not match:
+        if not parsed:
             st.error("❌ Invalid file name. Format must be: EQ-XXXX_DD_MM_YYYY.ext")
             return
 
-        equipment_id = match.group(1)
+        equipment_id, _ = parsed
         file_type = uploaded_file.type
-        file_bytes = uploaded_file.read()
 
+        # Warn (without blocking) when this photo looks like one that is already stored
+        if file_type.startswith("image/"):
+            try:
+                near_duplicates = phash_index.find_near_duplicates(DB_PATH, uploaded_file.getvalue())
+            except Exception:
+                near_duplicates = []
+            for match in near_duplicates:
+                linked = ", ".join(f"{link['Equipment ID']} ({link['file_name']})" for link in match["links"]) or "no equipment"
+                st.warning(f"⚠️ Looks like an already stored photo ({match['distance']} bits apart), linked to: {linked}")
 
         # Save to database
         try:
-            update_equipment_with_file(equipment_id, file_name, file_type, file_bytes)
-            st.success(f"✅ File '{file_name}' stored and linked to {equipment_id}.")
+            if update_equipment_with_file(equipment_id, file_name, file_type, uploaded_file):
+                st.session_state["stored_upload"] = upload_key
+                app_state.on_documents_changed()
+                st.success(f"✅ File '{file_name}' stored and linked to {equipment_id}.")
         except Exception as e:
             st.error(f"❌ Failed to save file: {str(e)}")
+
+BULK_STATUS_POLL_SECONDS = 2
+
+def _bulk_upload_path(uploaded_zip):
+    # Same ZIP (name and size) -> same temp path -> same job id, so a re-upload resumes
+    key = hashlib.sha256(f"{uploaded_zip.name}:{uploaded_zip.size}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"bulk_import_{key}.zip")
+
+def show_bulk_job_status(job_id):
+    jobs = bulk_ingest.job_status(DB_PATH, job_id)
+    if not jobs:
+        return
+    job = jobs[0]
+    if job["total"]:
+        st.progress(min(job["processed"] / job["total"], 1.0),
+                    text=f"{job['processed']}/{job['total']} files ({job['status']})")
+    else:
+        st.caption(f"Import {job['status']}…")
+    st.caption(f"{job['stored']} stored, {job['duplicate']} already stored, {job['errors']} errors")
+
+    if job["status"] in ("done", "failed"):
+        if st.session_state.get("bulk_job_finished") != (job_id, job["updated_at"]):
+            st.session_state["bulk_job_finished"] = (job_id, job["updated_at"])
+            app_state.on_documents_changed()
+        if job["status"] == "failed":
+            st.error(f"❌ Import failed: {job['job_error']}")
+        errors = bulk_ingest.error_report(DB_PATH, job_id)
+        if errors:
+            st.warning(f"⚠️ {len(errors)} files were not imported:")
+            st.dataframe(errors, use_container_width=True, hide_index=True)
+
+# Re-run only the status block while a job is in progress (Streamlit >= 1.37)
+if hasattr(st, "fragment"):
+    show_bulk_job_status = st.fragment(run_every=BULK_STATUS_POLL_SECONDS)(show_bulk_job_status)
+
+def handle_bulk_import():
+    with st.expander("📦 Bulk import (ZIP file or server folder)"):
+        uploaded_zip = st.file_uploader("ZIP of files named EQ-xxxx_DD_MM_YYYY.pdf/jpg/png", type=["zip"],
+                                        key="bulk_zip")
+        folder = st.text_input("…or a folder on the server", key="bulk_folder")
+        restart = st.checkbox("Start over (ignore what an earlier run of this source already imported)",
+                              key="bulk_restart")
+
+        if st.button("Start import", key="bulk_start"):
+            # Only enqueues; hashing, previews and writes run in the background
+            if uploaded_zip:
+                source = _bulk_upload_path(uploaded_zip)
+                with open(source, "wb") as f:
+                    shutil.copyfileobj(uploaded_zip, f)
+                st.session_state["bulk_job"] = bulk_ingest.get_queue(DB_PATH).submit(source, restart, cleanup=True)
+            elif folder and os.path.isdir(folder):
+                st.session_state["bulk_job"] = bulk_ingest.get_queue(DB_PATH).submit(folder, restart)
+            else:
+                st.error("❌ Upload a ZIP file or enter an existing folder.")
+
+        job_id = st.session_state.get("bulk_job")
+        if job_id:
+            st.caption(f"Job {job_id}")
+            show_bulk_job_status(job_id)
+            if not hasattr(st, "fragment"):
+                st.button("🔄 Refresh status", key="bulk_refresh")
@@ -0,0 +1,282 @@
+# phash_index.py (Perceptual hashes of stored photos with sub-linear Hamming-distance lookup)
+#
+# Every stored image gets a 64-bit pHash (DCT) and dHash (gradient). Lookups use
+# multi-index hashing: the pHash is split into four 16-bit bands, each with its own
+# index. Two hashes within distance r agree to within r // 4 bits on at least one band
+# (pigeonhole), so a query only reads rows whose band value is in that small
+# neighbourhood and then checks the exact distance. It never scans every row.
+#
+# Usage:
+#   python phash_index.py backfill --db app/assets_data.db --workers 4
+#   python phash_index.py similar Assets/IMG_9599.JPG --db app/assets_data.db
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+import numpy as np
+
+import db_pool
+import document_store
+
+
+# -----------------------------
+# Config
+# -----------------------------
+HASH_TABLE = "image_hashes"
+BANDS = 4
+BAND_BITS = 64 // BANDS
+NEAR_DUPLICATE_DISTANCE = 6            # pHash bits; re-encodes, resizes and light crops land well under this
+SIMILAR_DISTANCE = 11                  # "looks like" search radius; above 11 each band probes ~700 values and nears a scan
+DEFAULT_LIMIT = 10
+
+_ensured = set()
+_ensure_lock = threading.Lock()
+
+
+# -----------------------------
+# Hashing (pure functions, safe to run in worker processes)
+# -----------------------------
+# cv2 is imported per function so importing this module (the UI does at startup) doesn't load OpenCV
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(gray):
+    """64-bit difference hash: is each pixel brighter than its right neighbour on a 9x8 thumbnail."""
+    import cv2
+
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray):
+    """64-bit DCT hash: low-frequency 8x8 DCT coefficients of a 32x32 thumbnail against their median."""
+    import cv2
+
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    median = np.median(low.flatten()[1:])  # the DC term would dominate the median
+    return _bits_to_int(low > median)
+
+
+def compute_hashes(data):
+    """(dhash, phash) of an encoded image, or None when it can't be decoded."""
+    import cv2
+
+    gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if gray is None:
+        return None
+    return dhash(gray), phash(gray)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+# -----------------------------
+# Multi-index hashing helpers
+# -----------------------------
+def _to_signed(value):
+    # SQLite INTEGER is signed 64-bit
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def bands(value):
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (BAND_BITS * (BANDS - 1 - i))) & mask for i in range(BANDS)]
+
+
+def band_neighbours(value, radius):
+    """Every BAND_BITS-bit value within `radius` bits of value."""
+    neighbours = [value]
+    for r in range(1, radius + 1):
+        for positions in combinations(range(BAND_BITS), r):
+            flipped = value
+            for position in positions:
+                flipped ^= 1 << position
+            neighbours.append(flipped)
+    return neighbours
+
+
+# -----------------------------
+# Storage
+# -----------------------------
+def ensure_table(conn):
+    band_columns = ", ".join(f"phash_b{i} INTEGER NOT NULL" for i in range(BANDS))
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {HASH_TABLE} (
+            sha256 TEXT PRIMARY KEY,
+            dhash INTEGER NOT NULL,
+            phash INTEGER NOT NULL,
+            {band_columns},
+            created_at REAL NOT NULL
+        )
+    """)
+    for i in range(BANDS):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{HASH_TABLE}_b{i} ON {HASH_TABLE}(phash_b{i})")
+
+
+def _ensure_table(db_path):
+    if db_path in _ensured:
+        return
+    with _ensure_lock:
+        if db_path in _ensured:
+            return
+        with db_pool.get_pool(db_path).writer() as conn:
+            ensure_table(conn)
+        _ensured.add(db_path)
+
+
+def insert_hashes(conn, rows):
+    """Stores [(sha256, dhash, phash)] (unsigned ints); existing rows are kept."""
+    now = time.time()
+    conn.executemany(f"""
+        INSERT OR IGNORE INTO {HASH_TABLE} (sha256, dhash, phash, {", ".join(f"phash_b{i}" for i in range(BANDS))}, created_at)
+        VALUES (?, ?, ?, {", ".join("?" for _ in range(BANDS))}, ?)
+    """, [(sha256, _to_signed(d), _to_signed(p), *bands(p), now) for sha256, d, p in rows])
+
+
+def lookup(conn, phash_value, max_distance=SIMILAR_DISTANCE, limit=DEFAULT_LIMIT, dhash_value=None):
+    """
+    Stored hashes within max_distance pHash bits of phash_value, nearest first:
+    [(sha256, phash distance, dhash distance or None)].
+    """
+    band_radius = max_distance // BANDS
+    selects, params = [], []
+    for i, band_value in enumerate(bands(phash_value)):
+        neighbours = band_neighbours(band_value, band_radius)
+        selects.append(f"SELECT sha256, dhash, phash FROM {HASH_TABLE} "
+                       f"WHERE phash_b{i} IN ({', '.join('?' for _ in neighbours)})")
+        params.extend(neighbours)
+    candidates = conn.execute(" UNION ".join(selects), params).fetchall()
+
+    matches = []
+    for sha256, stored_dhash, stored_phash in candidates:
+        distance = hamming(phash_value, _to_unsigned(stored_phash))
+        if distance <= max_distance:
+            d_distance = hamming(dhash_value, _to_unsigned(stored_dhash)) if dhash_value is not None else None
+            matches.append((sha256, distance, d_distance))
+    matches.sort(key=lambda m: (m[1], m[2] if m[2] is not None else 0))
+    return matches[:limit]
+
+
+def _describe(conn, matches):
+    """Attaches the Equipment IDs and file names each matching document is linked to."""
+    results = []
+    for sha256, distance, d_distance in matches:
+        links = conn.execute(
+            "SELECT equipment_id, file_name FROM equipment_documents WHERE sha256 = ? ORDER BY equipment_id",
+            (sha256,)).fetchall()
+        mime = conn.execute("SELECT mime FROM documents WHERE sha256 = ?", (sha256,)).fetchone()
+        results.append({"sha256": sha256, "mime": mime[0] if mime else None,
+                        "distance": distance, "dhash_distance": d_distance,
+                        "links": [{"Equipment ID": e, "file_name": f} for e, f in links]})
+    return results
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def index_document(db_path, sha256, mime):
+    """Hashes one stored image (no-op for other types); returns True when it was indexed."""
+    if not (mime or "").lower().startswith("image/"):
+        return False
+    _ensure_table(db_path)
+    with db_pool.get_pool(db_path).reader() as conn:
+        hashes = compute_hashes(document_store.read_document(conn, sha256))
+    if hashes is None:
+        return False
+    with db_pool.get_pool(db_path).writer() as conn:
+        insert_hashes(conn, [(sha256, *hashes)])
+    return True
+
+
+def find_near_duplicates(db_path, data, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """Stored photos that look like the (not yet stored) image bytes in data."""
+    hashes = compute_hashes(data)
+    if hashes is None:
+        return []
+    _ensure_table(db_path)
+    document_store.ensure_schema_once(db_path)
+    with db_pool.get_pool(db_path).reader() as conn:
+        return _describe(conn, lookup(conn, hashes[1], max_distance, dhash_value=hashes[0]))
+
+
+def find_similar(db_path, sha256, max_distance=SIMILAR_DISTANCE, limit=DEFAULT_LIMIT):
+    """Other stored photos that look like the stored document sha256, nearest first."""
+    _ensure_table(db_path)
+    with db_pool.get_pool(db_path).reader() as conn:
+        row = conn.execute(f"SELECT dhash, phash FROM {HASH_TABLE} WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is None:
+            return []
+        matches = lookup(conn, _to_unsigned(row[1]), max_distance, limit + 1, dhash_value=_to_unsigned(row[0]))
+        return _describe(conn, [m for m in matches if m[0] != sha256][:limit])
+
+
+# -----------------------------
+# Backfill
+# -----------------------------
+def _hash_stored_document(db_path, sha256):
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        return sha256, compute_hashes(document_store.read_document(conn, sha256))
+    finally:
+        conn.close()
+
+
+def backfill(db_path, workers=None):
+    """Hashes every stored image missing from the index on a process pool. Returns a summary dict."""
+    _ensure_table(db_path)
+    document_store.ensure_schema_once(db_path)
+    with db_pool.get_pool(db_path).reader() as conn:
+        pending = [row[0] for row in conn.execute(f"""
+            SELECT d.sha256 FROM documents d LEFT JOIN {HASH_TABLE} h ON h.sha256 = d.sha256
+            WHERE h.sha256 IS NULL AND d.mime LIKE 'image/%'
+        """)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_hash_stored_document, [db_path] * len(pending), pending, chunksize=16))
+    rows = [(sha256, *hashes) for sha256, hashes in results if hashes is not None]
+    with db_pool.get_pool(db_path).writer() as conn:
+        insert_hashes(conn, rows)
+    return {"pending": len(pending), "indexed": len(rows), "undecodable": len(pending) - len(rows)}
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perceptual-hash index over stored photos.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subparsers.add_parser("backfill", help="Hash every stored image not yet indexed")
+    backfill_parser.add_argument("--db", default="app/assets_data.db")
+    backfill_parser.add_argument("--workers", type=int, default=None)
+    similar = subparsers.add_parser("similar", help="List stored photos that look like an image file")
+    similar.add_argument("image")
+    similar.add_argument("--db", default="app/assets_data.db")
+    similar.add_argument("--distance", type=int, default=SIMILAR_DISTANCE)
+    args = parser.parse_args(argv)
+
+    if args.command == "backfill":
+        summary = backfill(args.db, args.workers)
+        print(f"🧬 Indexed {summary['indexed']} of {summary['pending']} images ({summary['undecodable']} undecodable)")
+    else:
+        with open(args.image, "rb") as f:
+            data = f.read()
+        for match in find_near_duplicates(args.db, data, args.distance):
+            links = ", ".join(f"{link['Equipment ID']} ({link['file_name']})" for link in match["links"])
+            print(f"{match['distance']:>2} bits  {match['sha256'][:12]}  {links}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# query_router.py (Rule-based fast path: answers common ID lookups without calling the LLM)
+import re
+import threading
+from dataclasses import dataclass, field
+
+import schema_cache
+from sql_cache import extract_entities
+
+
+# -----------------------------
+# Config
+# -----------------------------
+# Which column each entity kind (see sql_cache.ENTITY_PATTERNS) is looked up in
+ENTITY_COLUMNS = {
+    "eq": "Equipment ID",
+    "sn": "Serial No",
+    "part": "Part ID",
+    "p": "Part ID",
+}
+
+# Extra phrasings that refer to a column, applied only if the column exists in the live schema
+COLUMN_SYNONYMS = {
+    "Location": ["where is", "where's", "located", "location of"],
+    "Serial No": ["serial number", "serial"],
+    "Part No": ["part number"],
+    "Part Description": ["description of the part"],
+    "Asset Name": ["name of the asset"],
+    "Asset Owner": ["owner", "owned by", "who owns"],
+    "Software": ["firmware"],
+}
+
+DETAIL_PHRASES = re.compile(
+    r"\b(all (the )?details|full details|all (the )?information|all info|everything|all columns|tell me about|details (for|of|about))\b"
+)
+
+# Anything that needs aggregation, comparison, ordering or cross-row reasoning goes to the LLM
+AMBIGUOUS_PHRASES = re.compile(
+    r"\b(how many|count|average|avg|sum|total|max(imum)?|min(imum)?|before|after|between|older|newer|"
+    r"latest|earliest|oldest|newest|sort|order|top|compare|list all|which|every|each|not|except|"
+    r"greater|less|more than|fewer than|per|group|expir\w*|mention\w*|contain\w*)\b"
+)
+
+# "Which assets mention firmware corruption?" style keyword searches, answered from the FTS5 index
+TEXT_SEARCH_PHRASES = re.compile(
+    r"\b(?:mention(?:s|ing|ed)?|contain(?:s|ing)?|refer(?:s|ring)? to|talk(?:s|ing)? about|"
+    r"with the (?:word|words|phrase|keyword|keywords))\s+(?P<terms>.+)$"
+)
+# Words that may lead into a text search without making it ambiguous
+TEXT_SEARCH_LEADS = re.compile(r"\b(which|what|list all|list|show( me)?|find|search( for)?|every|each|all|any)\b")
+TEXT_SEARCH_STOPWORDS = {"a", "an", "the", "of", "in", "on", "for", "to", "and", "or", "any", "some", "word", "words",
+                         "phrase", "keyword", "keywords", "their", "its", "comments", "comment", "description"}
+TEXT_SEARCH_LIMIT = 50
+
+DOCUMENT_PHRASES = re.compile(r"\b(image|images|photo|photos|picture|pictures|pdf|pdfs|manual|manuals|document|documents|file|files)\b")
+# Documents are linked by this column in the document store (see document_store.py)
+DOCUMENT_KEY_COLUMN = "Equipment ID"
+
+
+@dataclass
+class RoutedQuery:
+    sql: str
+    params: tuple
+    reason: str
+    columns: list = field(default_factory=list)
+
+
+_lock = threading.Lock()
+_stats = {}   # kind -> {"total": n, "routed": n, "fallbacks": {reason: n}}
+
+
+# -----------------------------
+# Schema lexicon
+# -----------------------------
+def _column_phrases(column_metadata):
+    """(phrase, column) pairs for every column in the live schema, longest phrase first."""
+    phrases = []
+    for col in column_metadata:
+        phrases.append((col.lower().replace("_", " "), col))
+        for synonym in COLUMN_SYNONYMS.get(col, []):
+            phrases.append((synonym, col))
+    return sorted(phrases, key=lambda item: len(item[0]), reverse=True)
+
+
+def find_column_mentions(question, column_metadata):
+    """Maps column-name mentions in the question onto live schema columns, in order of appearance."""
+    text = question.lower()
+    claimed, mentions = [], []
+    for phrase, col in _column_phrases(column_metadata):
+        for match in re.finditer(r"(?<!\w)" + re.escape(phrase) + r"(?!\w)", text):
+            span = match.span()
+            if any(span[0] < end and start < span[1] for start, end in claimed):
+                continue  # "location system" already claimed "location"
+            claimed.append(span)
+            mentions.append((span[0], col))
+    ordered = []
+    for _, col in sorted(mentions):
+        if col not in ordered:
+            ordered.append(col)
+    return ordered
+
+
+# -----------------------------
+# Routing
+# -----------------------------
+def _record(kind, routed, reason=None):
+    with _lock:
+        entry = _stats.setdefault(kind, {"total": 0, "routed": 0, "fallbacks": {}})
+        entry["total"] += 1
+        if routed:
+            entry["routed"] += 1
+        else:
+            entry["fallbacks"][reason] = entry["fallbacks"].get(reason, 0) + 1
+
+
+def _entity_filter(question, column_metadata):
+    """Returns (column, [literals]) when the question names IDs of exactly one kind, else a fallback reason."""
+    entities = extract_entities(question)
+    if not entities:
+        return None, "no_entity"
+    columns = {ENTITY_COLUMNS[kind] for kind, _, _ in entities}
+    if len(columns) != 1:
+        return None, "mixed_entities"
+    id_column = columns.pop()
+    if id_column not in column_metadata:
+        return None, "entity_column_missing"
+    literals = list(dict.fromkeys(literal for _, literal, _ in entities))
+    return (id_column, literals), None
+
+
+def _quote_identifier(col):
+    return f'"{col}"'
+
+
+def _where_clause(id_column, literals):
+    if len(literals) == 1:
+        return f"{_quote_identifier(id_column)} = ?"
+    return f"{_quote_identifier(id_column)} IN ({', '.join('?' for _ in literals)})"
+
+
+def _fts_match_expression(terms):
+    """FTS5 query for the searched words: quoted phrases stay phrases, other words are ANDed."""
+    phrases = re.findall(r"[\"']([^\"']+)[\"']", terms)
+    if not phrases:
+        words = [w for w in re.findall(r"[\w-]+", terms.lower()) if w not in TEXT_SEARCH_STOPWORDS]
+        phrases = words
+    # Double-quoting every token keeps FTS5 operators (AND, NEAR, -, *) in user text literal
+    return " ".join('"' + phrase.replace('"', '""') + '"' for phrase in phrases if phrase.strip())
+
+
+def route_text_search(question, column_metadata, table_name):
+    """
+    Returns a relevance-ordered RoutedQuery over the FTS5 index for plain keyword questions
+    ("Which assets mention firmware corruption?"), or None when the question also names an
+    ID, a column or a column value.
+    """
+    fts_table, fts_columns = schema_cache.get_fts_index(column_metadata)
+    text = question.lower().strip().rstrip("?.!")
+    match = TEXT_SEARCH_PHRASES.search(text)
+    if not fts_table or not match:
+        return None
+    prefix = text[:match.start()]
+    if AMBIGUOUS_PHRASES.search(TEXT_SEARCH_LEADS.sub(" ", prefix)):
+        return None  # e.g. "how many assets mention ...": the LLM writes the aggregate
+    # Any other constraint ("Does EQ-3115 ...", "assets in Rack A ...", "owned by ...") would be
+    # dropped by a bare MATCH over all assets; the LLM combines it with the search instead
+    if extract_entities(prefix) or find_column_mentions(prefix, column_metadata):
+        return None
+    import schema_linking  # imports this module
+    if schema_linking.find_value_mentions(prefix, column_metadata):
+        return None
+
+    expression = _fts_match_expression(question.strip().rstrip("?.!")[match.start("terms"):])
+    if not expression:
+        return None
+    id_columns = [col for col in ["Equipment ID"] if col in column_metadata]
+    select = ", ".join(f"t.{_quote_identifier(col)}" for col in id_columns + list(fts_columns))
+    sql = (f'SELECT {select}, bm25({fts_table}) AS relevance FROM {fts_table} '
+           f'JOIN "{table_name}" AS t ON t.rowid = {fts_table}.rowid '
+           f'WHERE {fts_table} MATCH ? ORDER BY relevance LIMIT {TEXT_SEARCH_LIMIT}')
+    return RoutedQuery(sql=sql, params=(expression,), reason="text_search", columns=list(fts_columns))
+
+
+def route_question(question, column_metadata, table_name):
+    """
+    Returns a RoutedQuery for unambiguous ID lookups ("Where is EQ-3115 located?",
+    "Show me all details for SN-366678") and keyword searches over the full-text index,
+    or None when the LLM should handle it.
+    """
+    text = question.lower()
+    routed = route_text_search(question, column_metadata, table_name)
+    if routed is not None:
+        _record("sql", True)
+        return routed
+    if AMBIGUOUS_PHRASES.search(text):
+        _record("sql", False, "ambiguous_intent")
+        return None
+
+    entity_filter, reason = _entity_filter(question, column_metadata)
+    if entity_filter is None:
+        _record("sql", False, reason)
+        return None
+    id_column, literals = entity_filter
+
+    mentions = [col for col in find_column_mentions(question, column_metadata) if col != id_column]
+    if mentions:
+        select = ", ".join(_quote_identifier(col) for col in [id_column] + mentions)
+        reason = "column_lookup"
+    elif DETAIL_PHRASES.search(text):
+        select = "*"
+        reason = "all_details"
+    else:
+        _record("sql", False, "no_column_mention")
+        return None
+
+    sql = f'SELECT {select} FROM "{table_name}" WHERE {_where_clause(id_column, literals)}'
+    _record("sql", True)
+    return RoutedQuery(sql=sql, params=tuple(literals), reason=reason, columns=mentions)
+
+
+def route_document_question(question, column_metadata, table_name):
+    """
+    Returns a RoutedQuery selecting the Equipment IDs behind "show me the photo/manual for
+    EQ-xxxx" style requests, else None.
+    """
+    text = question.lower()
+    if not DOCUMENT_PHRASES.search(text):
+        _record("document", False, "no_document_word")
+        return None
+    if AMBIGUOUS_PHRASES.search(text):
+        _record("document", False, "ambiguous_intent")
+        return None
+    if DOCUMENT_KEY_COLUMN not in column_metadata:
+        _record("document", False, "document_key_missing")
+        return None
+
+    entity_filter, reason = _entity_filter(question, column_metadata)
+    if entity_filter is None:
+        _record("document", False, reason)
+        return None
+    id_column, literals = entity_filter
+
+    # Only the equipment is selected here; the caller joins in the linked documents
+    sql = (f'SELECT DISTINCT {_quote_identifier(DOCUMENT_KEY_COLUMN)} FROM "{table_name}" '
+           f'WHERE {_where_clause(id_column, literals)}')
+    _record("document", True)
+    return RoutedQuery(sql=sql, params=tuple(literals), reason="document_lookup")
+
+
+# -----------------------------
+# Coverage metrics
+# -----------------------------
+def router_stats():
+    """Per-kind totals, routed counts, fallback reasons and the share of questions that skipped the LLM."""
+    with _lock:
+        stats = {}
+        for kind, entry in _stats.items():
+            stats[kind] = {
+                "total": entry["total"],
+                "routed": entry["routed"],
+                "coverage": entry["routed"] / entry["total"] if entry["total"] else 0.0,
+                "fallbacks": dict(entry["fallbacks"]),
+            }
+        return stats
@@ -0,0 +1,161 @@
+# result_compaction.py (Shrinks query results to a token budget before answer synthesis)
+import logging
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from query_router import DETAIL_PHRASES, find_column_mentions
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Config
+# -----------------------------
+DEFAULT_TOKEN_BUDGET = 3000
+CHARS_PER_TOKEN = 4               # rough average for English text and CSV under llama tokenizers
+IDENTIFIER_COLUMNS = ["Equipment ID", "Part ID", "Serial No"]
+SUMMARY_TOP_VALUES = 3
+# Only results at least this wide (e.g. SELECT *) lose the table columns the question doesn't name
+WIDE_RESULT_COLUMNS = 8
+
+
+@dataclass
+class CompactedResult:
+    text: str
+    encoding: str                  # "csv" or "sample+summary"
+    rows_total: int
+    rows_sent: int
+    columns_sent: list = field(default_factory=list)
+    columns_dropped: list = field(default_factory=list)
+    baseline_tokens: int = 0       # estimate for the old df.to_json(orient='records') payload
+    tokens: int = 0
+
+    @property
+    def tokens_saved(self):
+        return max(0, self.baseline_tokens - self.tokens)
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+# -----------------------------
+# Cleaning / pruning
+# -----------------------------
+def _is_binary_column(series):
+    first = series.dropna()
+    return not first.empty and isinstance(first.iloc[0], (bytes, bytearray, memoryview))
+
+
+def clean_text_columns(df):
+    """
+    Strips non-ASCII characters from every string cell with vectorized .str operations
+    (non-string cells are left as they are). Returns a new DataFrame.
+    """
+    df = df.copy()
+    for col in df.select_dtypes(include=["object"]).columns:
+        series = df[col]
+        try:
+            cleaned = series.str.encode("ascii", "ignore").str.decode("ascii")
+        except AttributeError:
+            continue  # object column without any strings (e.g. boxed ints), nothing to clean
+        df[col] = cleaned.where(cleaned.notna(), series)
+    return df
+
+
+def prune_columns(question, df, base_columns=None):
+    """
+    Drops BLOB and all-null columns. For wide results (SELECT * and the like) it also drops
+    the base-table columns (base_columns) the question doesn't refer to, keeping
+    identifiers. Aggregates, expressions and aliases are never base-table columns, so
+    they always stay; without base_columns nothing else is pruned. Questions asking for
+    "all details" keep every column. Returns (pruned DataFrame, dropped column names).
+    """
+    keep = [col for col in df.columns if not _is_binary_column(df[col]) and df[col].notna().any()]
+    base_columns = set(base_columns or ())
+    if len(keep) >= WIDE_RESULT_COLUMNS and base_columns and not DETAIL_PHRASES.search(question.lower()):
+        mentioned = find_column_mentions(question, {col: None for col in keep if col in base_columns})
+        if mentioned:
+            keep = [col for col in keep
+                    if col not in base_columns or col in mentioned or col in IDENTIFIER_COLUMNS]
+    dropped = [col for col in df.columns if col not in keep]
+    return df[keep], dropped
+
+
+def _baseline_json_tokens(df):
+    # Cheap estimate of df.to_json(orient='records'): every cell repeats its key plus quoting/punctuation
+    text_columns = [col for col in df.columns if not _is_binary_column(df[col])]
+    chars = 0
+    for col in text_columns:
+        chars += int(df[col].astype(str).str.len().sum()) + len(df) * (len(str(col)) + 6)
+    return chars // CHARS_PER_TOKEN + 1
+
+
+# -----------------------------
+# Oversize fallback: sample + per-column summary
+# -----------------------------
+def summarize_columns(df):
+    """One CSV line per column with null/distinct counts and min/max/mean or the top values."""
+    rows = []
+    for col in df.columns:
+        series = df[col]
+        entry = {"column": col, "non_null": int(series.notna().sum()), "distinct": int(series.nunique())}
+        numeric = pd.to_numeric(series, errors="coerce")
+        if numeric.notna().any() and numeric.notna().sum() == series.notna().sum():
+            entry["summary"] = f"min={numeric.min():g} max={numeric.max():g} mean={numeric.mean():.4g}"
+        else:
+            top = series.value_counts().head(SUMMARY_TOP_VALUES)
+            entry["summary"] = "; ".join(f"{value} ({count})" for value, count in top.items())
+        rows.append(entry)
+    return pd.DataFrame(rows).to_csv(index=False)
+
+
+def _sample_rows(df, char_budget):
+    csv_chars = len(df.head(20).to_csv(index=False, header=False))
+    avg_row_chars = max(1, csv_chars // max(1, min(20, len(df))))
+    n = max(0, min(len(df), char_budget // avg_row_chars))
+    if n >= len(df):
+        return df
+    return df.sample(n=n, random_state=0).sort_index()
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def compact_result_for_prompt(question, df, token_budget=DEFAULT_TOKEN_BUDGET, base_columns=None):
+    """
+    Turns a result DataFrame into compact prompt text: cleaned, column-pruned CSV when it
+    fits token_budget, otherwise a row sample plus per-column summary statistics.
+    base_columns are the queried table's columns (see prune_columns).
+    """
+    baseline_tokens = _baseline_json_tokens(df)
+    pruned, dropped = prune_columns(question, df, base_columns)
+    pruned = clean_text_columns(pruned)
+
+    text = pruned.to_csv(index=False)
+    encoding, rows_sent = "csv", len(pruned)
+    if estimate_tokens(text) > token_budget:
+        summary = summarize_columns(pruned)
+        remaining_chars = max(0, token_budget * CHARS_PER_TOKEN - len(summary) - 200)
+        sample = _sample_rows(pruned, remaining_chars)
+        text = (f"The result has {len(pruned)} rows; below is a sample of {len(sample)} rows "
+                f"followed by per-column summary statistics over all rows.\n"
+                f"Sample rows (CSV):\n{sample.to_csv(index=False)}\n"
+                f"Column summary (CSV):\n{summary}")
+        encoding, rows_sent = "sample+summary", len(sample)
+
+    compacted = CompactedResult(
+        text=text,
+        encoding=encoding,
+        rows_total=len(df),
+        rows_sent=rows_sent,
+        columns_sent=list(pruned.columns),
+        columns_dropped=dropped,
+        baseline_tokens=baseline_tokens,
+        tokens=estimate_tokens(text),
+    )
+    logger.info("Result compaction: %s rows -> %s (%s), %s -> %s tokens (saved %s)",
+                compacted.rows_total, compacted.rows_sent, encoding,
+                baseline_tokens, compacted.tokens, compacted.tokens_saved)
+    return compacted
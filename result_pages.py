@@ -0,0 +1,135 @@
+# result_pages.py (Page-at-a-time access to query results as Arrow tables)
+#
+# The UI shows results one page at a time instead of handing the whole capped result to
+# st.dataframe. Simple single-table SELECTs (most generated SQL) are paged by keyset: the
+# table's rowid is injected into the query, so page N costs an index range read no
+# matter how deep it is. Anything else (joins, GROUP BY, DISTINCT, ORDER BY, LIMIT, ...)
+# is paged with LIMIT/OFFSET over the query as written, which keeps its order.
+#
+# A page is read with one fetchmany (through sql_guard's budget) and converted to an Arrow
+# record batch; st.dataframe takes a pyarrow.Table directly, so no DataFrame is built.
+import logging
+import re
+from dataclasses import dataclass
+
+import pyarrow as pa
+
+import sql_guard
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Config
+# -----------------------------
+DEFAULT_PAGE_SIZE = 50
+PAGE_KEY = "__page_key"
+FIRST_ROWID = -(2 ** 63)               # keyset cursor of the first page
+
+# Anything that changes which rows come out, or their order, rules out keyset paging
+NOT_KEYSET_PAGEABLE = re.compile(
+    r"\b(JOIN|GROUP\s+BY|ORDER\s+BY|LIMIT|OFFSET|HAVING|UNION|INTERSECT|EXCEPT|DISTINCT|OVER|WINDOW|"
+    r"COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\b",
+    re.IGNORECASE,
+)
+SIMPLE_SELECT = re.compile(
+    r"^SELECT\s+(?P<select>.+?)\s+FROM\s+(?P<table>\"[^\"]+\"|\w+)"
+    r"(?:\s+(?:AS\s+)?(?P<alias>(?!WHERE\b)\w+))?"
+    r"(?:\s+WHERE\s+(?P<where>.+))?$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+@dataclass
+class ResultPage:
+    table: pa.Table                    # this page's rows (without the injected page key)
+    cursor: object                     # where this page started: last rowid of the previous page, or a row offset
+    next_cursor: object                # cursor of the next page, None on the last page
+    keyset: bool                       # False when paged with LIMIT/OFFSET
+    report: sql_guard.GuardReport
+
+    @property
+    def num_rows(self):
+        return self.table.num_rows
+
+
+# -----------------------------
+# Query rewriting
+# -----------------------------
+def _has_rowid(conn, table):
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    return row is not None and "WITHOUT ROWID" not in row[0].upper()
+
+
+def keyset_query(conn, sql_query):
+    """
+    Rewrites a single-table SELECT so it returns the table's rowid as PAGE_KEY and takes
+    two extra parameters (rowid to start after, row limit). Returns None when the query
+    can't be paged that way.
+    """
+    # Keywords inside quoted identifiers ("Card Life From Today") and string literals don't count
+    bare = re.sub(r'"[^"]*"|\'[^\']*\'', '""', sql_query)
+    if NOT_KEYSET_PAGEABLE.search(bare) or len(re.findall(r"\b(SELECT|FROM)\b", bare, re.IGNORECASE)) != 2:
+        return None  # also rules out subqueries and implicit (comma) joins
+    match = SIMPLE_SELECT.match(sql_query)
+    if not match or not _has_rowid(conn, match.group("table").strip('"')):
+        return None
+    qualifier = (match.group("alias") or match.group("table")) + "."
+    where = f"({match.group('where')}) AND " if match.group("where") else ""
+    alias = f" AS {match.group('alias')}" if match.group("alias") else ""
+    return (f'SELECT {qualifier}rowid AS "{PAGE_KEY}", {match.group("select")} FROM {match.group("table")}{alias}\n'
+            f"WHERE {where}{qualifier}rowid > ?\nORDER BY {qualifier}rowid\nLIMIT ?")
+
+
+def offset_query(sql_query):
+    return f"SELECT * FROM (\n{sql_query}\n)\nLIMIT ? OFFSET ?"
+
+
+# -----------------------------
+# Arrow conversion
+# -----------------------------
+def _arrow_column(values):
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # SQLite columns may mix types (e.g. numbers and text under NUMERIC affinity)
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def rows_to_record_batch(columns, rows):
+    if not rows:
+        return pa.record_batch([pa.array([], type=pa.null()) for _ in columns], names=columns)
+    return pa.record_batch([_arrow_column(list(values)) for values in zip(*rows)], names=columns)
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def fetch_page(conn, sql_query, params=(), cursor=None, page_size=DEFAULT_PAGE_SIZE, blob_columns=(),
+               allow_blobs=False, **guard_options):
+    """
+    Returns one ResultPage of sql_query starting at cursor (None for the first page),
+    executed through sql_guard (BLOB columns dropped, time/VM-step budget). Pass the
+    page's next_cursor back in to get the page after it.
+    """
+    sql_query = sql_query.strip().rstrip(";").strip()
+    page_sql = keyset_query(conn, sql_query)
+    keyset = page_sql is not None
+    if keyset:
+        page_params = tuple(params) + (FIRST_ROWID if cursor is None else cursor, page_size + 1)
+    else:
+        page_sql = offset_query(sql_query)
+        page_params = tuple(params) + (page_size + 1, cursor or 0)
+
+    # One row past the page tells whether another page follows (reported as truncated)
+    columns, rows, report = sql_guard.guarded_execute(
+        conn, page_sql, page_params, blob_columns=blob_columns, allow_blobs=allow_blobs, row_cap=page_size,
+        paged=True, **guard_options)
+
+    next_cursor = None
+    if report.truncated:
+        next_cursor = rows[-1][columns.index(PAGE_KEY)] if keyset else (cursor or 0) + page_size
+    table = pa.Table.from_batches([rows_to_record_batch(columns, rows)])
+    if keyset:
+        table = table.drop([PAGE_KEY])
+    return ResultPage(table=table, cursor=cursor, next_cursor=next_cursor, keyset=keyset, report=report)
@@ -0,0 +1,190 @@
+# schema_cache.py (Process-wide cache of the asset table schema)
+import hashlib
+import threading
+from dataclasses import dataclass
+
+import db_pool
+
+
+# -----------------------------
+# Cached schema snapshot
+# -----------------------------
+@dataclass(frozen=True)
+class SchemaSnapshot:
+    schema_version: int
+    column_metadata: dict
+    example_sql_query: str
+    schema_str: str
+    fingerprint: str
+    fts_table: str = None          # FTS5 index over the table's free-text columns, if one exists
+    fts_columns: tuple = ()
+    lifecycle_columns: tuple = ()  # columns of the lifecycle rollup table, if the loader built it
+
+
+_lock = threading.Lock()
+_snapshots = {}       # (db_path, table_name) -> SchemaSnapshot
+
+
+# -----------------------------
+# Utility: Quote column names the way the prompts expect
+# -----------------------------
+def quote_column(col):
+    """Double-quotes column names containing spaces or hyphens, leaves the rest bare."""
+    return f'"{col}"' if ' ' in col or '-' in col else col
+
+
+# Declared types written by app/db_loaderwithimg.py that need explaining to the model
+TYPE_NOTES = {
+    "DATE": "DATE (ISO-8601 text 'YYYY-MM-DD', indexed comparisons work directly)",
+    "YEARS": "YEARS (integer number of years)",
+}
+
+# Lifecycle rollups built by db_loaderwithimg.ensure_lifecycle_rollups: per-asset end
+# dates plus asset counts per year, keyed by the event name of each date column
+LIFECYCLE_TABLE = "asset_lifecycle"
+LIFECYCLE_COUNTS_TABLE = "asset_lifecycle_counts"
+LIFECYCLE_EVENTS = {
+    "Warranty Expiry Date": "warranty_expiry",
+    "Decommissioning Date": "decommissioning",
+    "Card Life Will Reach": "card_end_of_life",
+}
+
+
+def render_schema_str(column_metadata):
+    """Renders the schema block pasted into the SQL-generation prompts."""
+    return "\n".join(f"    {quote_column(col)}: {TYPE_NOTES.get(dtype.upper(), dtype)}"
+                     for col, dtype in column_metadata.items())
+
+
+def compute_fingerprint(column_metadata, fts_columns=(), lifecycle_columns=()):
+    """Stable hash of the column names and types (and full-text/rollup columns), used to key caches built on the schema."""
+    digest = hashlib.sha256()
+    for col, dtype in column_metadata.items():
+        digest.update(f"{col}\x1f{dtype}\x1e".encode("utf-8"))
+    if fts_columns:
+        digest.update(("fts\x1f" + "\x1f".join(fts_columns)).encode("utf-8"))
+    if lifecycle_columns:
+        digest.update(("lifecycle\x1f" + "\x1f".join(lifecycle_columns)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def render_example_sql_query(column_metadata, table_name):
+    columns = ", ".join(quote_column(col) for col in column_metadata.keys())
+    return f'SELECT {columns} FROM "{table_name}" WHERE [CONDITION] LIMIT 10;'
+
+
+# -----------------------------
+# Schema version tracking
+# -----------------------------
+def _current_schema_version(conn):
+    # SQLite bumps schema_version on every DDL statement (e.g. the ALTER TABLEs in
+    # db_loaderwithimg._prepare_target_table), so it is the only thing we
+    # need to look at to know whether the cached snapshot is still valid.
+    return conn.execute("PRAGMA schema_version").fetchone()[0]
+
+
+def _find_fts_index(conn, table_name):
+    """(name, columns) of an FTS5 table whose external content is table_name, else (None, ())."""
+    rows = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%fts5%'").fetchall()
+    for name, sql in rows:
+        if f"content='{table_name}'" in sql:
+            return name, tuple(col[1] for col in conn.execute(f'PRAGMA table_info("{name}")'))
+    return None, ()
+
+
+def _find_lifecycle_rollup(conn):
+    """Columns of the lifecycle rollup table when both rollup tables exist, else ()."""
+    found = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)", (LIFECYCLE_TABLE, LIFECYCLE_COUNTS_TABLE))}
+    if len(found) < 2:
+        return ()
+    return tuple(col[1] for col in conn.execute(f'PRAGMA table_info("{LIFECYCLE_TABLE}")'))
+
+
+def _load_snapshot(conn, table_name, schema_version):
+    schema_info = conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()
+
+    # Store column names exactly as they are in the database (with spaces or underscores)
+    column_metadata = {col[1]: col[2] for col in schema_info}
+    fts_table, fts_columns = _find_fts_index(conn, table_name)
+    lifecycle_columns = _find_lifecycle_rollup(conn)
+    return SchemaSnapshot(
+        schema_version=schema_version,
+        column_metadata=column_metadata,
+        example_sql_query=render_example_sql_query(column_metadata, table_name),
+        schema_str=render_schema_str(column_metadata),
+        fingerprint=compute_fingerprint(column_metadata, fts_columns, lifecycle_columns),
+        fts_table=fts_table,
+        fts_columns=fts_columns,
+        lifecycle_columns=lifecycle_columns,
+    )
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def get_schema(db_path, table_name):
+    """
+    Returns the cached SchemaSnapshot for table_name, reloading it only when
+    PRAGMA schema_version has moved since the snapshot was taken.
+    """
+    key = (db_path, table_name)
+    with db_pool.get_pool(db_path).reader() as conn, _lock:
+        version = _current_schema_version(conn)
+        snapshot = _snapshots.get(key)
+        if snapshot is None or snapshot.schema_version != version:
+            snapshot = _load_snapshot(conn, table_name, version)
+            _snapshots[key] = snapshot
+        return snapshot
+
+
+def _cached_snapshot_for(column_metadata):
+    with _lock:
+        for snapshot in _snapshots.values():
+            if snapshot.column_metadata is column_metadata:
+                return snapshot
+    return None
+
+
+def get_source(column_metadata):
+    """(db_path, table_name) that column_metadata was loaded from, or None for metadata not from get_schema()."""
+    with _lock:
+        for key, snapshot in _snapshots.items():
+            if snapshot.column_metadata is column_metadata:
+                return key
+    return None
+
+
+def get_schema_str(column_metadata):
+    """
+    Returns the pre-rendered prompt schema block for column_metadata. Metadata handed
+    out by get_schema() hits the cache; anything else is rendered on the spot.
+    """
+    snapshot = _cached_snapshot_for(column_metadata)
+    return snapshot.schema_str if snapshot else render_schema_str(column_metadata)
+
+
+def get_fingerprint(column_metadata):
+    """Same as get_schema_str(), for the schema fingerprint."""
+    snapshot = _cached_snapshot_for(column_metadata)
+    return snapshot.fingerprint if snapshot else compute_fingerprint(column_metadata)
+
+
+def get_fts_index(column_metadata):
+    """(FTS5 table name, indexed columns) for the table behind column_metadata, or (None, ())."""
+    snapshot = _cached_snapshot_for(column_metadata)
+    return (snapshot.fts_table, snapshot.fts_columns) if snapshot else (None, ())
+
+
+def get_lifecycle_rollup(column_metadata):
+    """Columns of the lifecycle rollup table for the database behind column_metadata, or ()."""
+    snapshot = _cached_snapshot_for(column_metadata)
+    return snapshot.lifecycle_columns if snapshot else ()
+
+
+def invalidate(db_path=None):
+    """Drops cached snapshots (for one database or all of them)."""
+    with _lock:
+        for key in [k for k in _snapshots if db_path is None or k[0] == db_path]:
+            del _snapshots[key]
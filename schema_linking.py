@@ -0,0 +1,260 @@
+# schema_linking.py (Picks the columns a question needs so prompts don't carry the whole schema)
+#
+# Columns are linked to a question three ways: lexically (column names and synonyms,
+# whole or by distinctive word), through a dictionary of the distinct values of
+# low-cardinality columns ("Rack 3" -> Rack), and optionally by embedding similarity
+# with sentence-transformers. Linked columns plus the identifiers go into the prompt; when
+# nothing links confidently the full schema is used, as before.
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+
+import db_pool
+import schema_cache
+from query_router import COLUMN_SYNONYMS, DETAIL_PHRASES, find_column_mentions
+from result_compaction import estimate_tokens
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Config
+# -----------------------------
+IDENTIFIER_COLUMNS = ["Equipment ID", "Part ID", "Serial No"]
+VALUE_DICT_MAX_DISTINCT = 50           # TEXT columns with at most this many distinct values get a value dictionary
+VALUE_DICT_MIN_LENGTH = 3              # shorter values ("A", "No") match too much
+VALUE_DICT_TTL_SECONDS = 600
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_THRESHOLD = 0.45             # cosine similarity for an embedding-only link
+EMBEDDING_CONFIDENT = 0.55             # an embedding-only link this strong is enough to prune
+MAX_LINKED_COLUMNS = 15                # more than this and the prompt barely shrinks; use the full schema
+GENERIC_WORDS = {"number", "date", "the", "for", "from", "and", "with", "what", "which", "who", "how", "are",
+                 "all", "show", "list", "life", "type", "name", "description", "use", "data", "file", "uploaded",
+                 "asset", "equipment"}
+# Age / date / expiry wording: every DATE and YEARS column stays in a pruned prompt, since
+# any of them may be the one the answer is computed from
+TEMPORAL_PHRASES = re.compile(
+    r"\b(age|aged|ages|old|older|oldest|new|newer|newest|years?|months?|days?|dates?|when|since|before|after|"
+    r"recent\w*|expir\w*|install\w*|commission\w*|decommission\w*|warrant\w*|manufactur\w*|lifespan|end of life)\b"
+)
+TEMPORAL_TYPES = ("DATE", "YEARS")
+
+
+@dataclass
+class LinkedSchema:
+    column_metadata: dict              # columns that go into the prompt
+    linked: dict = field(default_factory=dict)   # column -> reasons it was linked
+    fell_back: bool = False
+    reason: str = ""
+    full_tokens: int = 0               # schema block tokens with every column
+    tokens: int = 0                    # schema block tokens actually sent
+
+    @property
+    def tokens_saved(self):
+        return max(0, self.full_tokens - self.tokens)
+
+
+_lock = threading.Lock()
+_value_dicts = {}      # (db_path, table_name, fingerprint) -> (loaded_at, {value lower: column})
+_embeddings = {}       # fingerprint -> (columns, matrix)
+_embedding_model = None
+_embedding_failed = False
+_stats = {"requests": 0, "pruned": 0, "fell_back": 0, "tokens_saved": 0, "last": None}
+
+
+# -----------------------------
+# Lexical linking
+# -----------------------------
+def _stem(word):
+    # Crude stemmer, enough to make "installed"/"install", "expires"/"expiry", "dates"/"date" meet
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    for suffix in ("ation", "ing", "ed"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            word = word[:-len(suffix)]
+            break
+    if len(word) > 4 and word[-1] in "ey":
+        word = word[:-1]
+    return word
+
+
+def _words(text):
+    # Words under three letters ("in", "is", "id") carry no signal
+    return {_stem(w) for w in re.findall(r"[a-z0-9]{3,}", text.lower())}
+
+
+GENERIC_STEMS = _words(" ".join(GENERIC_WORDS))
+
+
+def _lexical_links(question, column_metadata):
+    """Whole column names / synonyms first, then any distinctive word of a column name."""
+    links = {col: "name" for col in find_column_mentions(question, column_metadata)}
+    question_words = _words(question) - GENERIC_STEMS
+    for col in column_metadata:
+        if col in links:
+            continue
+        col_words = _words(col.replace("_", " ")) - GENERIC_STEMS
+        for synonym in COLUMN_SYNONYMS.get(col, []):
+            col_words |= _words(synonym) - GENERIC_STEMS
+        if col_words & question_words:
+            links[col] = "word"
+    return links
+
+
+# -----------------------------
+# Value dictionary
+# -----------------------------
+def _load_value_dict(db_path, table_name, column_metadata):
+    values = {}
+    with db_pool.get_pool(db_path).reader() as conn:
+        for col, dtype in column_metadata.items():
+            if dtype.upper() not in ("TEXT", ""):
+                continue
+            rows = conn.execute(
+                f'SELECT DISTINCT "{col}" FROM "{table_name}" WHERE "{col}" IS NOT NULL LIMIT {VALUE_DICT_MAX_DISTINCT + 1}'
+            ).fetchall()
+            if len(rows) > VALUE_DICT_MAX_DISTINCT:
+                continue  # high cardinality (IDs, free text): not a dictionary column
+            for (value,) in rows:
+                text = str(value).strip().lower()
+                if len(text) >= VALUE_DICT_MIN_LENGTH:
+                    values.setdefault(text, col)
+    return values
+
+
+def get_value_dict(db_path, table_name, column_metadata):
+    """{distinct value (lower-cased): column} for low-cardinality TEXT columns, refreshed every few minutes."""
+    key = (db_path, table_name, schema_cache.get_fingerprint(column_metadata))
+    with _lock:
+        cached = _value_dicts.get(key)
+    if cached is not None and time.time() - cached[0] < VALUE_DICT_TTL_SECONDS:
+        return cached[1]
+    values = _load_value_dict(db_path, table_name, column_metadata)
+    with _lock:
+        _value_dicts[key] = (time.time(), values)
+    return values
+
+
+def _value_links(question, value_dict):
+    text = question.lower()
+    links = {}
+    for value, col in value_dict.items():
+        if col not in links and re.search(r"(?<!\w)" + re.escape(value) + r"(?!\w)", text):
+            links[col] = f"value '{value}'"
+    return links
+
+
+def find_value_mentions(question, column_metadata):
+    """Columns whose dictionary values the question names, for metadata handed out by schema_cache.get_schema()."""
+    source = schema_cache.get_source(column_metadata)
+    if source is None:
+        return []
+    return list(_value_links(question, get_value_dict(source[0], source[1], column_metadata)))
+
+
+# -----------------------------
+# Optional embeddings
+# -----------------------------
+def get_embedding_model():
+    """The sentence-transformers model, or None when it isn't installed or can't load (e.g. offline)."""
+    global _embedding_model, _embedding_failed
+    if _embedding_model is not None or _embedding_failed:
+        return _embedding_model
+    with _lock:
+        if _embedding_model is None and not _embedding_failed:
+            try:
+                from sentence_transformers import SentenceTransformer
+                _embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+            except Exception as e:
+                _embedding_failed = True
+                logger.info("Schema linking without embeddings (%s)", e)
+    return _embedding_model
+
+
+def _embedding_links(question, column_metadata):
+    """{column: cosine similarity} for columns whose description is close to the question."""
+    model = get_embedding_model()
+    if model is None:
+        return {}
+    fingerprint = schema_cache.get_fingerprint(column_metadata)
+    with _lock:
+        cached = _embeddings.get(fingerprint)
+    if cached is None:
+        columns = list(column_metadata)
+        texts = [col.replace("_", " ") + " " + " ".join(COLUMN_SYNONYMS.get(col, [])) for col in columns]
+        cached = (columns, model.encode(texts, normalize_embeddings=True))
+        with _lock:
+            _embeddings[fingerprint] = cached
+    columns, matrix = cached
+    scores = matrix @ model.encode([question], normalize_embeddings=True)[0]
+    return {col: float(score) for col, score in zip(columns, scores) if score >= EMBEDDING_THRESHOLD}
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def link_schema(question, column_metadata, table_name, db_path):
+    """Returns a LinkedSchema with the columns to put in the prompt for this question."""
+    full_tokens = estimate_tokens(schema_cache.get_schema_str(column_metadata))
+    linked = {}
+    for col, why in _lexical_links(question, column_metadata).items():
+        linked.setdefault(col, []).append(why)
+    try:
+        value_links = _value_links(question, get_value_dict(db_path, table_name, column_metadata))
+    except Exception as e:  # a missing table shouldn't break prompting
+        logger.warning("Schema linking value dictionary unavailable: %s", e)
+        value_links = {}
+    for col, why in value_links.items():
+        linked.setdefault(col, []).append(why)
+    embedding_scores = _embedding_links(question, column_metadata)
+    for col, score in embedding_scores.items():
+        linked.setdefault(col, []).append(f"embedding {score:.2f}")
+
+    # A lone distinctive-word hit ("year" -> Card Life From Subsequent Year) is too weak to prune on
+    confident = any(reason == "name" or reason.startswith("value") for reasons in linked.values() for reason in reasons)
+    confident = confident or (embedding_scores and max(embedding_scores.values()) >= EMBEDDING_CONFIDENT)
+    non_identifiers = [col for col in linked if col not in IDENTIFIER_COLUMNS]
+
+    if DETAIL_PHRASES.search(question.lower()):
+        fell_back, reason = True, "all_details"
+    elif not non_identifiers or not confident:
+        fell_back, reason = True, "low_confidence"
+    elif len(non_identifiers) > MAX_LINKED_COLUMNS:
+        fell_back, reason = True, "too_many_columns"
+    else:
+        fell_back, reason = False, "linked"
+
+    if fell_back:
+        pruned, tokens = column_metadata, full_tokens
+    else:
+        keep = set(linked) | set(IDENTIFIER_COLUMNS)
+        if TEMPORAL_PHRASES.search(question.lower()):
+            keep |= {col for col, dtype in column_metadata.items() if dtype.upper() in TEMPORAL_TYPES}
+        pruned = {col: dtype for col, dtype in column_metadata.items() if col in keep}
+        tokens = estimate_tokens(schema_cache.render_schema_str(pruned))
+
+    result = LinkedSchema(column_metadata=pruned, linked=linked, fell_back=fell_back, reason=reason,
+                          full_tokens=full_tokens, tokens=tokens)
+    with _lock:
+        _stats["requests"] += 1
+        _stats["fell_back" if fell_back else "pruned"] += 1
+        _stats["tokens_saved"] += result.tokens_saved
+        _stats["last"] = {"question": question, "columns": len(pruned), "of": len(column_metadata),
+                          "reason": reason, "tokens_saved": result.tokens_saved}
+    logger.info("Schema linking (%s): %s of %s columns, schema tokens %s -> %s (saved %s)",
+                reason, len(pruned), len(column_metadata), full_tokens, tokens, result.tokens_saved)
+    return result
+
+
+def invalidate(db_path=None):
+    """Drops cached value dictionaries (for one database or all), e.g. after the asset sheet is reloaded."""
+    with _lock:
+        for key in [k for k in _value_dicts if db_path is None or k[0] == db_path]:
+            del _value_dicts[key]
+
+
+def linking_stats():
+    with _lock:
+        return dict(_stats)
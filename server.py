@@ -0,0 +1,264 @@
+# server.py (HTTP service for the NL → SQL → answer pipeline, behind the public/ chat frontends)
+#
+# One process serves every client from threads, sharing what Streamlit shares per process:
+# the db_pool connections, the schema snapshot, the SQL cache, the LLM clients and the
+# background event loop that streams answers (smatbotest_async).
+#
+#   POST /chat                      {"message": "..."} → {"reply", "sql", "params", "rows", "columns", "truncated"}
+#                                   with "Accept: text/event-stream" (or ?stream=1): server-sent events
+#                                   "sql", "rows", then one "token" per answer delta, then "done" (or "error")
+#   GET  /documents?equipment_id=EQ-0001[&equipment_id=...]   linked documents' metadata
+#   GET  /documents?question=...[&cursor=...]                 documents for a question, one page at a time
+#   GET  /documents/<sha256>[?download=1]                     the bytes, streamed; Range and ETag supported
+#   GET  /metrics                   Prometheus text (telemetry of this process)
+#
+# Usage:
+#   python server.py --port 8000 --db app/assets_data.db
+#   gunicorn -w 1 --threads 16 -k gthread server:app     # one process, many threads
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+
+from flask import Flask, Response, abort, jsonify, request, send_from_directory
+
+import db_pool
+import document_store
+import smatbotest_v
+import telemetry
+from smatbotest_async import astream_answer_from_df, iter_async_generator
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Config
+# -----------------------------
+PUBLIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "public")
+RESPONSE_ROWS = 50                     # rows of the result returned next to the answer
+MAX_QUESTION_CHARS = 2000
+DOWNLOAD_CHUNK_SIZE = document_store.CHUNK_SIZE
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+app = Flask(__name__, static_folder=None)
+
+
+# -----------------------------
+# Pipeline
+# -----------------------------
+def _question():
+    payload = request.get_json(silent=True) or {}
+    question = str(payload.get("message") or payload.get("question") or "").strip()
+    if not question:
+        abort(400, description="Send a JSON body with a non-empty \"message\".")
+    if len(question) > MAX_QUESTION_CHARS:
+        abort(413, description=f"Questions are limited to {MAX_QUESTION_CHARS} characters.")
+    return question
+
+
+def run_query(question):
+    """Generates SQL for question and runs it; returns (outcome, result DataFrame). Raises on failure."""
+    column_metadata, example_sql_query = smatbotest_v.extract_table_metadata()
+    outcome = smatbotest_v.generate_valid_sql(question, example_sql_query, column_metadata, smatbotest_v.TABLE_NAME)
+    if outcome.sql_query is None:
+        raise ValueError(f"No valid SQL after {outcome.attempts} attempts: "
+                         f"{outcome.errors[-1] if outcome.errors else 'unknown error'}")
+    df = smatbotest_v.fetch_answer_from_db(outcome.sql_query, outcome.params, raise_errors=True)
+    return outcome, df
+
+
+def _result_payload(outcome, df):
+    report = df.attrs.get("guard_report")
+    head = df.head(RESPONSE_ROWS)
+    return {
+        "sql": outcome.sql_query,
+        "params": list(outcome.params),
+        "routed": outcome.routed,
+        "columns": list(head.columns),
+        # to_json turns numpy scalars, NaN and timestamps into plain JSON
+        "rows": json.loads(head.to_json(orient="values", date_format="iso")),
+        "row_count": len(df),
+        "truncated": bool(report and report.truncated),
+    }
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _stream_chat(question):
+    try:
+        with telemetry.span("http_chat", stream=True):
+            outcome, df = run_query(question)
+        payload = _result_payload(outcome, df)
+        yield _sse("sql", {key: payload[key] for key in ("sql", "params", "routed")})
+        yield _sse("rows", {key: payload[key] for key in ("columns", "rows", "row_count", "truncated")})
+        # Deltas come off the shared background event loop as the LLM produces them
+        reply = []
+        for delta in iter_async_generator(astream_answer_from_df(question, df)):
+            reply.append(delta)
+            yield _sse("token", {"text": delta})
+        yield _sse("done", {"reply": "".join(reply).strip()})
+    except Exception as e:
+        logger.exception("Streaming /chat failed for %r", question)
+        yield _sse("error", {"error": f"{type(e).__name__}: {e}"})
+
+
+@app.post("/chat")
+def chat():
+    question = _question()
+    if request.args.get("stream") == "1" or request.accept_mimetypes.best == "text/event-stream":
+        return Response(_stream_chat(question), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    try:
+        with telemetry.span("http_chat", stream=False):
+            outcome, df = run_query(question)
+            reply = smatbotest_v.answer_question_from_df(question, df)
+    except (ValueError, sqlite3.Error) as e:
+        return jsonify(reply=f"❌ {e}", error=str(e)), 422
+    return jsonify(reply=reply, **_result_payload(outcome, df))
+
+
+# -----------------------------
+# Documents
+# -----------------------------
+@app.get("/documents")
+def list_documents():
+    equipment_ids = request.args.getlist("equipment_id")
+    question = request.args.get("question", "").strip()
+    if equipment_ids:
+        document_store.ensure_schema_once(smatbotest_v.DB_PATH)
+        with db_pool.get_pool(smatbotest_v.DB_PATH).reader() as conn:
+            documents = document_store.list_documents(conn, equipment_ids)
+        return jsonify(documents=documents, next_cursor=None)
+    if not question:
+        abort(400, description="Pass equipment_id or question.")
+
+    column_metadata, _ = smatbotest_v.extract_table_metadata()
+    try:
+        sql_query, params, routed = smatbotest_v.route_or_generate_document_sql_query(
+            question, column_metadata, smatbotest_v.TABLE_NAME)
+    except ValueError as e:
+        return jsonify(error=str(e)), 422
+    cursor = request.args.get("cursor", type=int)
+    try:
+        page = smatbotest_v.fetch_document_page(sql_query, params, cursor)
+    except sqlite3.Error as e:
+        if not routed:
+            smatbotest_v.forget_document_sql(question, column_metadata)
+        return jsonify(error=str(e), sql=sql_query), 422
+    return jsonify(documents=page.table.to_pylist(), next_cursor=page.next_cursor, sql=sql_query, routed=routed)
+
+
+def _byte_range(header, size):
+    """(start, end exclusive) for a single "bytes=a-b" range; None for no/unsupported range; raises on unsatisfiable."""
+    match = RANGE_PATTERN.match(header or "")
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(0, size - int(last)), size    # suffix range: the last N bytes
+    else:
+        start = int(first)
+        end = min(size, int(last) + 1) if last else size
+    if start >= size or start >= end:
+        raise ValueError("unsatisfiable range")
+    return start, end
+
+
+def _iter_document(sha256, start, end):
+    # A pooled reader per chunk, so a slow client never holds a connection between chunks
+    pool = db_pool.get_pool(smatbotest_v.DB_PATH)
+    while start < end:
+        with pool.reader() as conn:
+            chunk = b"".join(document_store.iter_document_chunks(
+                conn, sha256, start, min(end, start + DOWNLOAD_CHUNK_SIZE), DOWNLOAD_CHUNK_SIZE))
+        if not chunk:
+            break
+        start += len(chunk)
+        yield chunk
+
+
+@app.get("/documents/<sha256>")
+def download_document(sha256):
+    if not SHA256_PATTERN.match(sha256):
+        abort(404)
+    document_store.ensure_schema_once(smatbotest_v.DB_PATH)
+    with db_pool.get_pool(smatbotest_v.DB_PATH).reader() as conn:
+        row = conn.execute("""
+            SELECT d.size, d.mime, (SELECT ed.file_name FROM equipment_documents ed WHERE ed.sha256 = d.sha256 LIMIT 1)
+            FROM documents d WHERE d.sha256 = ?
+        """, (sha256,)).fetchone()
+    if row is None:
+        abort(404)
+    size, mime, file_name = row
+
+    # Content-addressed: the hash is a strong validator and the bytes never change
+    etag = f'"{sha256}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "private, max-age=31536000, immutable"}
+    if request.args.get("download") == "1" and file_name:
+        headers["Content-Disposition"] = f'attachment; filename="{file_name}"'
+    if etag in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers=headers)
+
+    try:
+        # If-Range with another validator means the client's partial copy is stale: send it all
+        byte_range = _byte_range(request.headers.get("Range"), size) \
+            if request.headers.get("If-Range", etag) == etag else None
+    except ValueError:
+        return Response(status=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    start, end = byte_range or (0, size)
+    headers["Content-Length"] = str(end - start)
+    status = 200
+    if byte_range:
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    return Response(_iter_document(sha256, start, end), status=status, headers=headers,
+                    mimetype=mime or "application/octet-stream", direct_passthrough=True)
+
+
+# -----------------------------
+# Frontend and metrics
+# -----------------------------
+@app.get("/")
+@app.get("/<page>.html")
+def frontend(page="index"):
+    return send_from_directory(PUBLIC_DIR, f"{page}.html")
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(telemetry.prometheus_text(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.errorhandler(400)
+@app.errorhandler(404)
+@app.errorhandler(413)
+@app.errorhandler(500)
+def json_error(error):
+    return jsonify(reply=f"❌ {error.description}", error=error.description), error.code
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the chat pipeline and documents over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--db", default=smatbotest_v.DB_PATH)
+    args = parser.parse_args(argv)
+
+    if args.db != smatbotest_v.DB_PATH:
+        smatbotest_v.DB_PATH = args.db
+        telemetry.configure(args.db)
+    print(f"🌐 Serving http://{args.host}:{args.port}/ from {args.db}")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# smatbotest_async.py (Async + streaming variants of the smatbotest_v pipeline stages)
+import asyncio
+import queue
+import os
+import threading
+import time
+
+import telemetry
+from smatbotest_v import (
+    LLM_KEEPALIVE_CONNECTIONS,
+    LLM_KEEPALIVE_EXPIRY_SECONDS,
+    MODEL_NAME,
+    TABLE_NAME,
+    build_answer_messages,
+    extract_table_metadata,
+    fetch_answer_from_db,
+    fetch_document_blobs_from_db,
+    generate_valid_sql,
+    route_or_generate_document_sql_query,
+)
+
+
+# -----------------------------
+# Config
+# -----------------------------
+# Created on first use (see get_async_llm_client); tests and benchmarks may assign a stand-in
+async_client = None
+
+
+_client_lock = threading.Lock()
+
+
+def build_async_llm_client():
+    """AsyncGroq client on a keep-alive connection pool (used only from the background event loop to stream answers)."""
+    import httpx
+    from groq import AsyncGroq
+
+    http_client = httpx.AsyncClient(limits=httpx.Limits(max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+                                                        keepalive_expiry=LLM_KEEPALIVE_EXPIRY_SECONDS),
+                                    timeout=httpx.Timeout(60.0, connect=5.0))
+    return AsyncGroq(api_key=os.environ.get("GROQ_API_KEY", ""), http_client=http_client)
+
+
+def get_async_llm_client():
+    global async_client
+    if async_client is None:
+        with _client_lock:
+            if async_client is None:
+                async_client = build_async_llm_client()
+    return async_client
+
+
+# -----------------------------
+# Agent 0: Extract Table Metadata
+# -----------------------------
+async def aextract_table_metadata():
+    return await asyncio.to_thread(extract_table_metadata)
+
+
+# -----------------------------
+# Agent 1: Convert NL → SQL (generation, validation and caching run in smatbotest_v)
+# -----------------------------
+async def agenerate_valid_sql(question, table_name=TABLE_NAME, max_attempts=3):
+    """Async wrapper around smatbotest_v.generate_valid_sql (validation + error-feedback repair)."""
+    column_metadata, example_sql_query = await aextract_table_metadata()
+    return await asyncio.to_thread(generate_valid_sql, question, example_sql_query, column_metadata, table_name, max_attempts)
+
+
+async def aroute_or_generate_document_sql_query(question, table_name=TABLE_NAME):
+    """Returns (sql_query, params, routed) for a document question without blocking the event loop."""
+    column_metadata, _ = await aextract_table_metadata()
+    return await asyncio.to_thread(route_or_generate_document_sql_query, question, column_metadata, table_name)
+
+
+# -----------------------------
+# Agent 2: Execute SQL → DataFrame
+# -----------------------------
+async def afetch_answer_from_db(sql_query, params=()):
+    return await asyncio.to_thread(fetch_answer_from_db, sql_query, params)
+
+
+async def afetch_document_blobs_from_db(sql_query, params=None):
+    return await asyncio.to_thread(fetch_document_blobs_from_db, sql_query, params)
+
+
+# -----------------------------
+# Agent 3: Convert DataFrame → Final Answer (streamed)
+# -----------------------------
+async def astream_answer_from_df(question, df):
+    """Yields the answer text token by token as the LLM produces it."""
+    if df is None or df.empty:
+        yield "No results found."
+        return
+
+    # Recorded by hand: a span held open across yields could be closed from another context
+    started = time.perf_counter()
+    llm_started, first_token_s, usage, error = None, None, None, None
+    try:
+        messages = await asyncio.to_thread(build_answer_messages, question, df)
+        llm_started = time.perf_counter()
+        stream = await get_async_llm_client().chat.completions.create(
+            messages=messages,
+            model=MODEL_NAME,
+            stream=True,
+        )
+        async for chunk in stream:
+            # Groq reports usage on the last chunk (x_groq.usage); OpenAI-style clients on chunk.usage
+            usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or getattr(chunk, "usage", None) or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if first_token_s is None:
+                    first_token_s = time.perf_counter() - llm_started
+                yield delta
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        now = time.perf_counter()
+        if llm_started is not None:
+            telemetry.record("llm_call", now - llm_started, parent="answer_question_from_df", error=error,
+                             model=MODEL_NAME, stream=True,
+                             first_token_ms=round(first_token_s * 1000, 1) if first_token_s is not None else None,
+                             prompt_tokens=getattr(usage, "prompt_tokens", None),
+                             completion_tokens=getattr(usage, "completion_tokens", None))
+        telemetry.record("answer_question_from_df", now - started, error=error)
+
+
+async def aanswer_question_from_df(question, df):
+    return "".join([piece async for piece in astream_answer_from_df(question, df)]).strip()
+
+
+async def arun_pipeline(question):
+    """Full NL → SQL → answer run; returns (sql_query, params, result_df, answer)."""
+    outcome = await agenerate_valid_sql(question)
+    if outcome.sql_query is None:
+        raise ValueError(f"No valid SQL after {outcome.attempts} attempts: {outcome.errors[-1]}")
+    sql_query, params = outcome.sql_query, outcome.params
+    result_df = await afetch_answer_from_db(sql_query, params)
+    answer = await aanswer_question_from_df(question, result_df)
+    return sql_query, params, result_df, answer
+
+
+# -----------------------------
+# Bridging into synchronous callers (Streamlit scripts)
+# -----------------------------
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop():
+    """One long-lived event loop on a daemon thread, shared by every Streamlit session."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="pipeline-event-loop", daemon=True).start()
+        return _loop
+
+
+def submit(coro):
+    """Schedules coro on the background loop and returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop())
+
+
+def iter_async_generator(agen):
+    """Drives an async generator on the background loop and yields its items synchronously."""
+    items = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    submit(pump())
+    while True:
+        item = items.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
@@ -1,46 +1,176 @@
 # smartbo test.py (Updated with underscore column names for documents)
+import logging
 import sqlite3
 import pandas as pd
 import re
 import os
-from groq import Groq
 import streamlit as st
+import threading
 import time
-
+from dataclasses import dataclass, field
+import db_pool
+import document_store
+import fewshot_store
+import query_router
+import result_compaction
+import result_pages
+import schema_cache
+import schema_linking
+import sql_cache
+import sql_guard
+import telemetry
+
+
+logger = logging.getLogger(__name__)
 
 # -----------------------------
 # Config
 # -----------------------------
 DB_PATH = "app/assets_data.db"
 TABLE_NAME = "filled_asset_data"
-client = Groq(api_key="")
+# Created on first use (see get_llm_client); tests and benchmarks may assign a stand-in
+client = None
+LLM_KEEPALIVE_CONNECTIONS = 10
+LLM_KEEPALIVE_EXPIRY_SECONDS = 120
 MODEL_NAME = "llama3-8b-8192"
+# Optional limiter (anything with .acquire(), e.g. batch_eval.TokenBucket) applied to every LLM call
+rate_limiter = None
+# SQL generation/repair: per-LLM-call timeout and exponential backoff between attempts
+SQL_ATTEMPT_TIMEOUT_SECONDS = 20
+REPAIR_BACKOFF_BASE_SECONDS = 0.25
+# Verified question → SQL pairs retrieved as few-shot examples (see fewshot_store.py)
+FEWSHOT_STORE_PATH = "app/fewshot_store"
+FEWSHOT_K = 3
+# Execution guardrails (see sql_guard.py); the document tab shows at most DOCUMENT_ROW_CAP documents
+QUERY_ROW_CAP = sql_guard.DEFAULT_ROW_CAP
+DOCUMENT_ROW_CAP = 50
+# The UI pages results instead of rendering them whole (see result_pages.py)
+RESULT_PAGE_SIZE = 50
+DOCUMENT_PAGE_SIZE = 10
+# Per-stage spans and token usage go to the pipeline_spans table (see telemetry.py)
+telemetry.configure(DB_PATH)
+
+
+# -----------------------------
+# Utility: Single entry point for LLM calls
+# -----------------------------
+_client_lock = threading.Lock()
+
+
+def build_llm_client():
+    """Groq client on a keep-alive connection pool, so repeat calls skip the TCP/TLS handshake."""
+    # Imported here: groq (and httpx/pydantic behind it) isn't needed until the first LLM call
+    import httpx
+    from groq import Groq
+
+    http_client = httpx.Client(limits=httpx.Limits(max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+                                                   keepalive_expiry=LLM_KEEPALIVE_EXPIRY_SECONDS),
+                               timeout=httpx.Timeout(60.0, connect=5.0))
+    return Groq(api_key=os.environ.get("GROQ_API_KEY", ""), http_client=http_client)
+
+
+def get_llm_client():
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                client = build_llm_client()
+    return client
+
+
+def create_chat_completion(**kwargs):
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    # Its own span, so Groq time can be told apart from the stage around it
+    with telemetry.span("llm_call", model=kwargs.get("model")):
+        chat_completion = get_llm_client().chat.completions.create(**kwargs)
+        telemetry.record_llm_usage(getattr(chat_completion, "usage", None))
+    return chat_completion
+
 
 # -----------------------------
 # Agent 0: Extract Table Metadata
 # -----------------------------
+@telemetry.traced()
 def extract_table_metadata():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(f"PRAGMA table_info({TABLE_NAME})")
-    schema_info = cursor.fetchall()
-    conn.close()
-
-    # Store column names exactly as they are in the database (with spaces or underscores)
-    column_metadata = {col[1]: col[2] for col in schema_info}
-    
-    # Example SQL query now correctly quotes column names with spaces or handles underscores
-    example_sql_query = f"SELECT {', '.join([f'\"{col}\"' if ' ' in col or '-' in col else col for col in column_metadata.keys()])} FROM \"{TABLE_NAME}\" WHERE [CONDITION] LIMIT 10;"
-    return column_metadata, example_sql_query
+    # Served from the process-wide schema cache; PRAGMA table_info only runs again
+    # after the table's schema changes (see schema_cache.get_schema).
+    snapshot = schema_cache.get_schema(DB_PATH, TABLE_NAME)
+    return snapshot.column_metadata, snapshot.example_sql_query
 
 
 # -----------------------------
 # Agent 1: Convert NL → SQL via LLM
 # -----------------------------
-def generate_sql_query(question, example_sql_query, column_metadata, table_name):
-    # Prepare schema string for the prompt, quoting columns with spaces or handling underscores
-    schema_str = "\n".join([f"    \"{col}\": {dtype}" if ' ' in col or '-' in col else f"    {col}: {dtype}" for col, dtype in column_metadata.items()])
-    
+def prompt_schema_str(question, column_metadata, table_name, full_schema=False):
+    """
+    Schema block for a prompt: only the columns schema linking ties to the question (plus
+    identifiers), or every column when full_schema is set or linking isn't confident.
+    """
+    if full_schema:
+        return schema_cache.get_schema_str(column_metadata)
+    linked = schema_linking.link_schema(question, column_metadata, table_name, DB_PATH)
+    if linked.fell_back:
+        return schema_cache.get_schema_str(column_metadata)
+    return schema_cache.render_schema_str(linked.column_metadata)
+
+
+def few_shot_examples(question, table_name):
+    """
+    The verified question → SQL pairs most similar to question (see fewshot_store.py),
+    or the static examples while the store has nothing close enough.
+    """
+    try:
+        examples = fewshot_store.get_store(FEWSHOT_STORE_PATH).search(question, k=FEWSHOT_K)
+    except Exception as e:  # a broken store must not block SQL generation
+        logger.warning("Few-shot store unavailable: %s", e)
+        examples = []
+    if not examples:
+        examples = [
+            {"question": "Where is equipment EQ-3115 located?",
+             "sql": f'SELECT "Location" FROM "{table_name}" WHERE "Equipment ID" = \'EQ-3115\';'},
+            {"question": "What is the Asset Name for part P-12345?",
+             "sql": f'SELECT "Asset Name" FROM "{table_name}" WHERE "Part ID" = \'P-12345\';'},
+            {"question": "Show me all details for EQ-3115",
+             "sql": f'SELECT * FROM "{table_name}" WHERE "Equipment ID" = \'EQ-3115\';'},
+        ]
+    return "\n".join(f'    - User Question: "{e["question"]}"\n      SQL: `{e["sql"]}`' for e in examples)
+
+
+def record_verified_example(question, sql_query):
+    """Adds a question whose SQL ran and whose answer the user accepted to the few-shot store."""
+    return fewshot_store.get_store(FEWSHOT_STORE_PATH).add(question, sql_query)
+
+
+def build_lifecycle_rule(column_metadata, table_name, number):
+    """Prompt rule pointing warranty/decommissioning/card-life questions at the rollup tables, or ""."""
+    lifecycle_columns = schema_cache.get_lifecycle_rollup(column_metadata)
+    events = {col: event for col, event in schema_cache.LIFECYCLE_EVENTS.items() if col in lifecycle_columns}
+    if not events:
+        return ""
+    dimensions = [col for col in lifecycle_columns if col not in events and col != "Equipment ID"]
+    date_col = next(iter(events))
+    dimension = dimensions[0] if dimensions else "All"
+    warranty_note = ' ("Warranty Expiry Date" is "Warranty Start" plus "Warranty Period" years)' if "Warranty Expiry Date" in events else ""
+    return f"""
+    {number}.  Warranty expiry, decommissioning and card end-of-life questions have precomputed tables; use them instead of date arithmetic on \"{table_name}\":
+        - `{schema_cache.LIFECYCLE_TABLE}` has one row per asset with {', '.join(schema_cache.quote_column(c) for c in lifecycle_columns)}; {', '.join(schema_cache.quote_column(c) for c in events)} are indexed DATE columns{warranty_note}. Example: `SELECT "Equipment ID", "{date_col}" FROM {schema_cache.LIFECYCLE_TABLE} WHERE "{date_col}" < '2030-01-01';`
+        - `{schema_cache.LIFECYCLE_COUNTS_TABLE}` (dimension, dimension_value, event, year, asset_count) counts the assets whose event date falls in year. dimension is one of {', '.join(repr(d) for d in ['All'] + dimensions)} (dimension_value 'All' for every asset), event is one of {', '.join(repr(e) for e in events.values())}. For "how many" questions use it: `SELECT COALESCE(SUM(asset_count), 0) FROM {schema_cache.LIFECYCLE_COUNTS_TABLE} WHERE dimension = '{dimension}' AND dimension_value = '...' AND event = '{events[date_col]}' AND year = CAST(STRFTIME('%Y', 'now') AS INTEGER);` (use a year range with SUM for "before"/"by" questions; a missing row means zero)."""
+
+
+def build_sql_prompt(question, column_metadata, table_name, full_schema=False):
+    """Prompt for generate_sql_query (also used by the error-feedback repair)."""
+    # Schema block for the prompt (pruned by schema linking), quoting columns with spaces or hyphens
+    schema_str = prompt_schema_str(question, column_metadata, table_name, full_schema)
+    fts_table, fts_columns = schema_cache.get_fts_index(column_metadata)
+    fts_rule = ""
+    if fts_table:
+        id_col = schema_cache.quote_column("Equipment ID") if "Equipment ID" in column_metadata else "rowid"
+        text_col = fts_columns[0]
+        fts_rule = f"""
+    6.  For questions about words or phrases in the free-text columns ({', '.join(schema_cache.quote_column(c) for c in fts_columns)}), do NOT use `LIKE '%...%'`. Use the full-text index `{fts_table}` and rank by relevance: `SELECT t.{id_col}, t."{text_col}" FROM {fts_table} JOIN \"{table_name}\" AS t ON t.rowid = {fts_table}.rowid WHERE {fts_table} MATCH 'firmware corruption' ORDER BY bm25({fts_table});` (always write `{fts_table}` itself, never an alias, with MATCH and bm25; restrict to one column with `MATCH '"{text_col}" : firmware'`)."""
+    lifecycle_rule = build_lifecycle_rule(column_metadata, table_name, 7 if fts_rule else 6)
+
     prompt = f"""
     You are a helpful and precise AI assistant that converts natural language questions into **complete and executable SQLite SQL queries**.
 
@@ -55,31 +185,48 @@ def generate_sql_query(question, example_sql_query, column_metadata, table_name)
     2.  Strictly use the column names exactly as they appear in the `CREATE TABLE` statement. **Enclose column names containing spaces or hyphens in double quotes (e.g., "Equipment ID", "Asset-Name"). For names with underscores (e.g., uploaded_file_name), quotes are typically not needed unless they are keywords, but it's safer to always quote if there's any ambiguity.**
     3.  **Crucially, select ONLY the specific columns that directly answer the user's question.** Do NOT use `SELECT *` unless the user explicitly asks for "all columns" or "all details".
     4.  Do NOT add `GROUP BY`, `ORDER BY`, or `LIMIT` clauses unless explicitly requested by the user in their question.
-    5.  For date-related questions (e.g., involving years), use SQLite's `STRFTIME('%Y', "column name")` for year extraction if the column is in a standard date format. If the date format is consistently `DD/MM/YYYY`, you may use `SUBSTR("column name", 7, 4)` to extract the year. Remember to quote column names with spaces or hyphens if applicable.
+    5.  For date-related questions, columns typed DATE hold ISO-8601 text (`YYYY-MM-DD`): compare them directly with ISO literals (e.g., `"Install Date" >= '2020-01-01'`) so indexes are used, use `STRFTIME('%Y', "column name")` for the year and `DATE("column name", '+N years')` for date arithmetic. Columns typed YEARS are plain integers (e.g., `"Warranty Period" = 6`). Only if a date column is typed TEXT in `DD/MM/YYYY` format, fall back to `SUBSTR("column name", 7, 4)` for the year. Remember to quote column names with spaces or hyphens if applicable.{fts_rule}{lifecycle_rule}
 
     Respond ONLY with the valid SQL query. Do NOT include any other text, explanations, or conversational elements. Enclose the SQL query in a markdown code block (```sql ... ```).
 
     Examples of desired SQL:
-    - User Question: "Where is equipment EQ-3115 located?"
-      SQL: `SELECT "Location" FROM \"{table_name}\" WHERE "Equipment ID" = 'EQ-3115';`
-    - User Question: "What is the Asset Name for part P-12345?"
-      SQL: `SELECT "Asset Name" FROM \"{table_name}\" WHERE "Part ID" = 'P-12345';`
-    - User Question: "Show me all details for EQ-3115"
-      SQL: `SELECT * FROM \"{table_name}\" WHERE "Equipment ID" = 'EQ-3115';`
+{few_shot_examples(question, table_name)}
 
     User Question: {question}
     """
-    chat_completion = client.chat.completions.create(
+    return prompt
+
+
+@telemetry.traced()
+def generate_sql_query(question, example_sql_query, column_metadata, table_name):
+    # Same question + same schema + same model at temperature 0 means the same SQL,
+    # so serve repeats (and entity-swapped variants) from the persistent cache.
+    cached_sql = sql_cache.get_cached_sql(DB_PATH, "sql", question, column_metadata, MODEL_NAME)
+    telemetry.annotate(cache="hit" if cached_sql is not None else "miss")
+    if cached_sql is not None:
+        return cached_sql
+
+    prompt = build_sql_prompt(question, column_metadata, table_name)
+    chat_completion = create_chat_completion(
         model=MODEL_NAME,
         messages=[
             {"role": "system", "content": prompt}
         ],
         temperature=0.0, # Set temperature to 0 for deterministic output, crucial for evaluation
         max_tokens=500, # Max tokens for the SQL query
+        timeout=SQL_ATTEMPT_TIMEOUT_SECONDS,
     )
 
     response = chat_completion.choices[0].message.content.strip()
-    return extract_sql_from_response(response)
+    sql_query = extract_sql_from_response(response)
+    cache_valid_sql("sql", question, column_metadata, sql_query)
+    return sql_query
+
+
+def cache_valid_sql(kind, question, column_metadata, sql_query, executed_sql=None):
+    """Caches freshly generated SQL only once it compiles (as executed_sql when it runs wrapped)."""
+    if validate_sql(executed_sql or sql_query) is None:
+        sql_cache.put_cached_sql(DB_PATH, kind, question, column_metadata, MODEL_NAME, sql_query)
 
 
 # -----------------------------
@@ -101,60 +248,188 @@ def extract_sql_from_response(response):
 
 
 # -----------------------------
-# Agent 2: Execute SQL → DataFrame
+# Fast path: answer common ID lookups without the LLM
 # -----------------------------
-def fetch_answer_from_db(sql_query):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    try:
-        cursor.execute(sql_query)
-        columns = [col[0] for col in cursor.description]
-        df = pd.DataFrame(cursor.fetchall(), columns=columns)
-        return df
-    except sqlite3.Error as e:
-        st.error(f"SQL Execution Error: {e}\nQuery: {sql_query}")
-        return pd.DataFrame() # Return empty DataFrame on error
-    finally:
-        conn.close()
+def route_or_generate_sql_query(question, example_sql_query, column_metadata, table_name):
+    """
+    Returns (sql_query, params, routed). Unambiguous ID lookups get parameterized SQL
+    from query_router; everything else falls back to generate_sql_query.
+    """
+    routed = query_router.route_question(question, column_metadata, table_name)
+    if routed is not None:
+        return routed.sql, routed.params, True
+    return generate_sql_query(question, example_sql_query, column_metadata, table_name), (), False
+
+
+def route_or_generate_document_sql_query(question, column_metadata, table_name):
+    """Document-retrieval counterpart of route_or_generate_sql_query."""
+    routed = query_router.route_document_question(question, column_metadata, table_name)
+    if routed is not None:
+        return routed.sql, routed.params, True
+    return generate_document_sql_query(question, column_metadata, table_name), (), False
+
 
 # -----------------------------
-# New Agent: Generate SQL for Document Retrieval (BLOB Data)
+# SQL validation and error-feedback repair
 # -----------------------------
-def generate_document_sql_query(question, column_metadata, table_name):
+@dataclass
+class SqlGenerationOutcome:
+    sql_query: str = None          # None when no attempt produced valid SQL
+    params: tuple = ()
+    routed: bool = False
+    attempts: int = 0
+    succeeded_on: int = None       # 1-based attempt that produced valid SQL
+    errors: list = field(default_factory=list)
+
+
+repair_stats = {"first_attempt": 0, "repaired": 0, "failed": 0}
+
+
+def validate_sql(sql_query, params=()):
     """
-    Generates a SQL query to retrieve document BLOB data and its metadata
-    (uploaded_file_name, uploaded_file_type, uploaded_file_data).
+    Compiles the query with EXPLAIN (which prepares it without running it) on a pooled
+    read-only connection, then checks its double-quoted names, which SQLite would otherwise
+    read as string literals when misspelled. Returns None when it is valid, else the error message.
     """
-    # CORRECTED: Using underscore column names as confirmed by user
-    document_data_columns = [
-        "uploaded_file_name",
-        "uploaded_file_type",
-        "uploaded_file_data" # This is your BLOB column
-    ]
+    if not re.match(r"^\s*(SELECT|WITH)\b", sql_query, re.IGNORECASE):
+        return "Only a single SELECT statement is allowed."
+    with db_pool.get_pool(DB_PATH).reader() as conn:
+        try:
+            conn.execute(f"EXPLAIN {sql_query}", params).fetchall()
+            unknown = sql_guard.unknown_quoted_identifiers(conn, sql_query)
+        except sqlite3.Error as e:
+            return str(e)
+    if unknown:
+        return f"no such column: \"{unknown[0]}\" (double-quoted names must be columns of the schema; quote string values with single quotes)"
+    return None
+
+
+@telemetry.traced()
+def repair_sql_query(question, failed_sql, error, column_metadata, table_name):
+    """Asks the LLM to fix failed_sql, feeding back the SQLite error it produced."""
+    chat_completion = create_chat_completion(
+        model=MODEL_NAME,
+        messages=[
+            # Full schema here: the failure may well be a column that schema linking left out
+            {"role": "system", "content": build_sql_prompt(question, column_metadata, table_name, full_schema=True)},
+            {"role": "assistant", "content": f"```sql\n{failed_sql}\n```"},
+            {"role": "user", "content": (
+                f"That query fails in SQLite with this error:\n{error}\n"
+                "Return a corrected query that answers the same question. Use only columns from the schema above. "
+                "Respond ONLY with the SQL in a markdown code block (```sql ... ```)."
+            )},
+        ],
+        temperature=0.0,
+        max_tokens=500,
+        timeout=SQL_ATTEMPT_TIMEOUT_SECONDS,
+    )
+    return extract_sql_from_response(chat_completion.choices[0].message.content.strip())
+
+
+@telemetry.traced()
+def generate_valid_sql(question, example_sql_query, column_metadata, table_name, max_attempts=3):
+    """
+    Produces SQL that at least compiles: the first attempt goes through the router/cache/LLM,
+    every later attempt sends the previous query and its SQLite error back to the model
+    instead of repeating the same prompt. Returns a SqlGenerationOutcome.
+    """
+    outcome = SqlGenerationOutcome()
+    candidate, params, routed = None, (), False
+    for attempt in range(1, max_attempts + 1):
+        outcome.attempts = attempt
+        if attempt > 1:
+            time.sleep(REPAIR_BACKOFF_BASE_SECONDS * (2 ** (attempt - 2)))
+        try:
+            if candidate is None:
+                candidate, params, routed = route_or_generate_sql_query(question, example_sql_query, column_metadata, table_name)
+            else:
+                candidate, params, routed = repair_sql_query(question, candidate, outcome.errors[-1], column_metadata, table_name), (), False
+        except Exception as e:
+            outcome.errors.append(f"{type(e).__name__}: {e}")
+            continue
 
-    # Validate that these columns actually exist in the schema
-    # The keys in column_metadata will match the exact names from PRAGMA table_info
-    if not all(col in column_metadata for col in document_data_columns):
-        missing_cols = [col for col in document_data_columns if col not in column_metadata]
-        st.error(f"Error: Missing expected document BLOB columns in database schema: {', '.join(missing_cols)}. Please ensure your '{table_name}' table contains these exact columns and they are populated.")
-        # Return a simple, non-crashing query as a fallback
-        fallback_col = list(column_metadata.keys())[0] if column_metadata else "Equipment ID" 
-        if "Equipment ID" in column_metadata: 
-            fallback_col = "Equipment ID"
-        return f"SELECT \"{fallback_col}\" FROM \"{table_name}\" LIMIT 1;"
+        error = validate_sql(candidate, params)
+        if error is None:
+            outcome.sql_query, outcome.params, outcome.routed, outcome.succeeded_on = candidate, params, routed, attempt
+            repair_stats["first_attempt" if attempt == 1 else "repaired"] += 1
+            telemetry.annotate(attempts=attempt, routed=routed)
+            if attempt > 1:
+                # Cache the repaired query so the next identical question gets it directly
+                sql_cache.put_cached_sql(DB_PATH, "sql", question, column_metadata, MODEL_NAME, candidate)
+            return outcome
 
+        outcome.errors.append(error)
+        # Don't let a cached bad query short-circuit the next identical question
+        sql_cache.forget_cached_sql(DB_PATH, "sql", question, column_metadata, MODEL_NAME)
 
+    repair_stats["failed"] += 1
+    telemetry.annotate(attempts=outcome.attempts, error=outcome.errors[-1] if outcome.errors else "no valid SQL")
+    return outcome
+
+
+# -----------------------------
+# Agent 2: Execute SQL → DataFrame
+# -----------------------------
+def _blob_columns():
+    column_metadata, _ = extract_table_metadata()
+    return {col for col, dtype in column_metadata.items() if dtype.upper() == "BLOB"}
+
+
+@telemetry.traced()
+def fetch_answer_from_db(sql_query, params=(), raise_errors=False):
+    # Pooled read-only connection: keeps its page cache warm between questions and
+    # never blocks behind an upload thanks to WAL mode (see db_pool.py).
+    # sql_guard caps rows, drops BLOB columns and enforces a time/VM-step budget;
+    # its report travels with the result in df.attrs["guard_report"].
+    with db_pool.get_pool(DB_PATH).reader() as conn:
+        try:
+            columns, rows, report = sql_guard.guarded_execute(
+                conn, sql_query, params, blob_columns=_blob_columns(), row_cap=QUERY_ROW_CAP)
+            df = pd.DataFrame(rows, columns=columns)
+            df.attrs["guard_report"] = report
+            telemetry.annotate(rows=len(df), truncated=report.truncated or None)
+            return df
+        except sqlite3.Error as e:
+            if raise_errors:
+                raise
+            telemetry.annotate(error=str(e))
+            st.error(f"SQL Execution Error: {e}\nQuery: {sql_query}")
+            return pd.DataFrame() # Return empty DataFrame on error
+
+
+@telemetry.traced()
+def fetch_result_page(sql_query, params=(), cursor=None, page_size=RESULT_PAGE_SIZE):
+    """
+    One page of the query's result as a result_pages.ResultPage (rows in an Arrow table),
+    starting at cursor (None for the first page, else the previous page's next_cursor).
+    Raises sqlite3.Error.
+    """
+    with db_pool.get_pool(DB_PATH).reader() as conn:
+        page = result_pages.fetch_page(conn, sql_query, params, cursor, page_size, blob_columns=_blob_columns())
+    telemetry.annotate(rows=page.num_rows, keyset=page.keyset)
+    return page
+
+# -----------------------------
+# New Agent: Generate SQL for Document Retrieval
+# -----------------------------
+# Documents live in the content-addressed store (document_store.py), linked by Equipment ID.
+# The LLM only has to pick the equipment; fetch_document_blobs_from_db joins in the documents.
+DOCUMENT_CACHE_KIND = "document_ids"
+
+
+def build_document_sql_prompt(question, column_metadata, table_name):
+    """Prompt for generate_document_sql_query."""
     # Ensure relevant filtering columns are available (using exact names from schema)
     available_filter_cols = [col for col in ["Equipment ID", "Asset Name", "Serial No", "Part ID"] if col in column_metadata]
     filter_clause_hint = ""
     if available_filter_cols:
-        filter_clause_hint = f"You can filter by columns like {', '.join([f'\"{c}\"' if ' ' in c or '-' in c else c for c in available_filter_cols])}."
+        filter_clause_hint = f"You can filter by columns like {', '.join(schema_cache.quote_column(c) for c in available_filter_cols)}."
 
-    # Prepare schema string for the prompt, quoting columns with spaces or handling underscores
-    schema_str = "\n".join([f"    \"{col}\": {dtype}" if ' ' in col or '-' in col else f"    {col}: {dtype}" for col, dtype in column_metadata.items()])
+    # Schema block for the prompt (pruned by schema linking), quoting columns with spaces or hyphens
+    schema_str = prompt_schema_str(question, column_metadata, table_name)
 
     prompt = f"""
-    You are a helpful and precise AI assistant that converts natural language questions into **complete and executable SQLite SQL queries** to retrieve **document BLOB data and its metadata** for specific assets.
+    You are a helpful and precise AI assistant that converts natural language questions into **complete and executable SQLite SQL queries** that find the equipment whose **documents (images, PDFs, manuals)** the user wants.
 
     You are given the following database schema for the table '{table_name}':
 
@@ -163,18 +438,46 @@ def generate_document_sql_query(question, column_metadata, table_name):
     ```
 
     **Instructions for generating SQL for documents:**
-    1.  The user is asking for images, PDFs, or manuals related to an equipment.
-    2.  **Crucially, your SELECT query MUST ALWAYS retrieve the following columns: `"uploaded_file_name"`, `"uploaded_file_type"`, and `"uploaded_file_data"`.** These three columns are absolutely essential for document retrieval and display. You may also include identifying columns like `"Equipment ID"` and `"Asset Name"` if the question implies filtering by them, but the three document-related columns are mandatory.
+    1.  The user is asking for images, PDFs, or manuals related to an equipment. The documents themselves are stored elsewhere and are looked up by Equipment ID.
+    2.  **Crucially, your query MUST select exactly one column: `"Equipment ID"`** (use `SELECT DISTINCT "Equipment ID"`). Do NOT select any other column.
     3.  Always include the `FROM \"{table_name}\"` clause.
-    4.  Strictly use the column names exactly as they appear in the `CREATE TABLE` statement. **Enclose column names containing spaces or hyphens in double quotes (e.g., "Equipment ID"). For names with underscores (e.g., uploaded_file_name), quotes are typically not needed unless they are keywords, but it's safer to always quote if there's any ambiguity.**
+    4.  Strictly use the column names exactly as they appear in the `CREATE TABLE` statement. **Enclose column names containing spaces or hyphens in double quotes (e.g., "Equipment ID").**
     5.  Use a `WHERE` clause to filter by specific equipment details mentioned in the question (e.g., `"Equipment ID"`, `"Asset Name"`, `"Serial No"`, `"Part ID"`). {filter_clause_hint}
-    6.  Ensure the `"uploaded_file_data"` column is NOT NULL in the WHERE clause, to only retrieve records with actual files.
-    7.  Do NOT add `GROUP BY`, `ORDER BY`, or `LIMIT` clauses unless explicitly requested.
-    8.  Respond ONLY with the valid SQL query. Do NOT include any other text, explanations, or conversational elements. Enclose the SQL query in a markdown code block (```sql ... ```).
+    6.  Do NOT add `GROUP BY`, `ORDER BY`, or `LIMIT` clauses unless explicitly requested.
+    7.  Respond ONLY with the valid SQL query. Do NOT include any other text, explanations, or conversational elements. Enclose the SQL query in a markdown code block (```sql ... ```).
 
     User Question: {question}
     """
-    chat_completion = client.chat.completions.create(
+    return prompt
+
+
+def document_columns_error(column_metadata, table_name):
+    """
+    Returns why document SQL can't be generated for the table (it has no "Equipment ID"
+    column to link documents by), or None. Callers surface it; this may run off the script thread.
+    """
+    if "Equipment ID" not in column_metadata:
+        return f"Missing the \"Equipment ID\" column in '{table_name}'; documents are linked to equipment by it."
+    return None
+
+
+@telemetry.traced()
+def generate_document_sql_query(question, column_metadata, table_name):
+    """
+    Generates a SQL query selecting the "Equipment ID"s whose documents the question
+    asks for (see fetch_document_blobs_from_db).
+    """
+    error = document_columns_error(column_metadata, table_name)
+    if error is not None:
+        raise ValueError(error)
+
+    cached_sql = sql_cache.get_cached_sql(DB_PATH, DOCUMENT_CACHE_KIND, question, column_metadata, MODEL_NAME)
+    telemetry.annotate(cache="hit" if cached_sql is not None else "miss")
+    if cached_sql is not None:
+        return cached_sql
+
+    prompt = build_document_sql_prompt(question, column_metadata, table_name)
+    chat_completion = create_chat_completion(
         model=MODEL_NAME,
         messages=[
             {"role": "system", "content": prompt}
@@ -184,55 +487,97 @@ def generate_document_sql_query(question, column_metadata, table_name):
     )
 
     response = chat_completion.choices[0].message.content.strip()
-    return extract_sql_from_response(response)
+    sql_query = extract_sql_from_response(response)
+    cache_valid_sql(DOCUMENT_CACHE_KIND, question, column_metadata, sql_query, document_metadata_sql(sql_query))
+    return sql_query
+
+
+def forget_document_sql(question, column_metadata):
+    """Drops a cached document query that failed to run, so it isn't replayed until the TTL expires."""
+    sql_cache.forget_cached_sql(DB_PATH, DOCUMENT_CACHE_KIND, question, column_metadata, MODEL_NAME)
 
 
 # -----------------------------
-# New Agent: Fetch Document BLOBs from DB
+# New Agent: Fetch Document metadata (bytes are loaded lazily)
 # -----------------------------
-def fetch_document_blobs_from_db(sql_query):
+def document_metadata_sql(sql_query):
+    """Wraps an equipment-selecting query so it returns the linked documents' metadata instead."""
+    sql_query = sql_query.strip().rstrip(";").strip()
+    return (f"{document_store.DOCUMENT_METADATA_SQL.strip()}\n"
+            f'WHERE ed.equipment_id IN (SELECT "Equipment ID" FROM (\n{sql_query}\n))\n'
+            f"ORDER BY ed.equipment_id, ed.upload_date")
+
+
+@telemetry.traced()
+def fetch_document_blobs_from_db(sql_query, params=None):
     """
-    Executes a SQL query to fetch document BLOB data and returns them as a DataFrame.
+    Runs the document query and returns one row of metadata per linked document
+    ("Equipment ID", file_name, mime, size, upload_date, sha256). No document bytes are
+    read here; call load_document_bytes(sha256) when a document is displayed or downloaded.
     """
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        # Use pd.read_sql_query directly, it's robust with BLOBs
-        df = pd.read_sql_query(sql_query, conn)
-        return df
-    except sqlite3.Error as e:
-        st.error(f"SQL Execution Error during document BLOB retrieval: {e}\nQuery: {sql_query}")
-        return pd.DataFrame() # Return empty DataFrame on error
-    finally:
-        conn.close()
+    document_store.ensure_schema_once(DB_PATH)
+    with db_pool.get_pool(DB_PATH).reader() as conn:
+        try:
+            columns, rows, report = sql_guard.guarded_execute(
+                conn, document_metadata_sql(sql_query), params or (), row_cap=DOCUMENT_ROW_CAP)
+            df = pd.DataFrame(rows, columns=columns)
+            df.attrs["guard_report"] = report
+            telemetry.annotate(rows=len(df))
+            return df
+        except sqlite3.Error as e:
+            telemetry.annotate(error=str(e))
+            st.error(f"SQL Execution Error during document retrieval: {e}\nQuery: {sql_query}")
+            return pd.DataFrame() # Return empty DataFrame on error
+
+
+@telemetry.traced()
+def fetch_document_page(sql_query, params=None, cursor=None, page_size=DOCUMENT_PAGE_SIZE):
+    """Page-at-a-time counterpart of fetch_document_blobs_from_db (metadata only). Raises sqlite3.Error."""
+    document_store.ensure_schema_once(DB_PATH)
+    with db_pool.get_pool(DB_PATH).reader() as conn:
+        page = result_pages.fetch_page(conn, document_metadata_sql(sql_query), params or (), cursor, page_size)
+    telemetry.annotate(rows=page.num_rows)
+    return page
+
+
+@telemetry.traced()
+def load_document_bytes(sha256):
+    """Reads one document's bytes from the store, streaming them off a pooled reader."""
+    with db_pool.get_pool(DB_PATH).reader() as conn:
+        data = document_store.read_document(conn, sha256)
+    telemetry.annotate(blob_bytes=len(data))
+    return data
 
 # -----------------------------
 # Agent 3: Convert DataFrame → Final Answer
 # -----------------------------
-def answer_question_from_df(question, df):
-    if df.empty:
-        return "No results found."
-
-    # Robustly handle non-UTF-8 characters in DataFrame before converting to JSON
-    # Iterate through string columns and attempt aggressive ASCII conversion
-    for col in df.select_dtypes(include=['object']).columns:
-        if not df[col].empty and df[col].notna().any():
-            # Apply encoding to ASCII, ignoring errors, then decode back to UTF-8
-            # This is a more aggressive cleaning, replacing problematic characters
-            # with nothing if they cannot be represented in ASCII.
-            df[col] = df[col].apply(lambda x: str(x).encode('ascii', 'ignore').decode('utf-8') if isinstance(x, str) else x)
-
-    df_json = df.to_json(orient='records')
+def build_answer_messages(question, df, token_budget=result_compaction.DEFAULT_TOKEN_BUDGET):
+    """Chat messages for answer synthesis over a (non-empty) result DataFrame."""
+    # Clean, prune and encode the result as compact CSV (falling back to a sample plus
+    # per-column summaries when it doesn't fit token_budget) instead of repeated-key JSON.
+    column_metadata, _ = extract_table_metadata()
+    compacted = result_compaction.compact_result_for_prompt(question, df, token_budget, base_columns=column_metadata)
+    report = df.attrs.get("guard_report")
+    truncation_note = f"(The query result was capped at {report.row_cap} rows.)\n" if report and report.truncated else ""
     prompt = f"""Based on the following data, answer this question: {question}.
 Here is the data:
-{df_json}
+{truncation_note}{compacted.text}
 Provide a concise and accurate response.
 """
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": prompt}
+    ]
 
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ],
+
+@telemetry.traced()
+def answer_question_from_df(question, df, token_budget=result_compaction.DEFAULT_TOKEN_BUDGET):
+    if df.empty:
+        return "No results found."
+
+    messages = build_answer_messages(question, df, token_budget)
+    chat_completion = create_chat_completion(
+        messages=messages,
         model=MODEL_NAME,
     )
     
@@ -255,30 +600,36 @@ def _get_display_type(file_type):
 # Run with Retries (Updated for clarity and Streamlit display)
 # -----------------------------
 def run_with_retries(question, retries=3):
-    success = False
-    attempt = 0
-    result_df = None
-    answer = None
+    column_metadata, example_sql_query = extract_table_metadata()
+    outcome = generate_valid_sql(question, example_sql_query, column_metadata, TABLE_NAME, max_attempts=retries)
+    for attempt, error in enumerate(outcome.errors, start=1):
+        st.warning(f"Attempt {attempt} failed with error: {error}")
 
-    while attempt < retries and not success:
-        try:
-            attempt += 1
-            column_metadata, example_sql_query = extract_table_metadata() # Get both
-            sql_query = generate_sql_query(question, example_sql_query, column_metadata, TABLE_NAME)
-            
-            # st.subheader(f"Generated SQL Query (Attempt {attempt})") # This will be handled by chatbit_ui.py
-            # st.code(sql_query) # This will be handled by chatbit_ui.py
-
-            result_df = fetch_answer_from_db(sql_query)
-            answer = answer_question_from_df(question, result_df)
-            
-            success = True
-        except Exception as e:
-            st.warning(f"Attempt {attempt} failed with error: {e}")
-            time.sleep(1)
-    
-    if success:
-        return result_df, answer
-    else:
+    if outcome.sql_query is None:
         st.error("Failed to process the request after multiple attempts.")
         return None, None
+
+    # st.subheader(f"Generated SQL Query (Attempt {outcome.succeeded_on})") # This will be handled by chatbit_ui.py
+    # st.code(outcome.sql_query) # This will be handled by chatbit_ui.py
+
+    try:
+        result_df = fetch_answer_from_db(outcome.sql_query, outcome.params, raise_errors=True)
+    except sqlite3.Error as e:
+        # Compiled fine but failed at run time; let the model see that error once more
+        st.warning(f"Attempt {outcome.attempts} failed with error: {e}")
+        try:
+            sql_query = repair_sql_query(question, outcome.sql_query, str(e), column_metadata, TABLE_NAME)
+            result_df = fetch_answer_from_db(sql_query, raise_errors=True)
+        except Exception as e:
+            st.error(f"Failed to process the request after multiple attempts: {e}")
+            return None, None
+
+    for attempt in range(1, retries + 1):
+        try:
+            return result_df, answer_question_from_df(question, result_df)
+        except Exception as e:
+            st.warning(f"Answer attempt {attempt} failed with error: {e}")
+            time.sleep(REPAIR_BACKOFF_BASE_SECONDS * (2 ** (attempt - 1)))
+
+    st.error("Failed to process the request after multiple attempts.")
+    return None, None
@@ -0,0 +1,264 @@
+# sql_cache.py (Persistent NL → SQL cache stored in a side table of the asset database)
+import atexit
+import logging
+import re
+import threading
+import time
+
+import db_pool
+import schema_cache
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Config
+# -----------------------------
+CACHE_TABLE = "nl_sql_cache"
+MAX_ENTRIES = 5000
+TTL_SECONDS = 7 * 24 * 3600
+# Hits update last_used_at/hits in memory; they are written in one transaction per batch,
+# off the request path, so a cache hit never waits for the writer
+TOUCH_FLUSH_SIZE = 200
+TOUCH_FLUSH_SECONDS = 30.0
+
+# Entity literals that can be swapped in and out of a cached query. The key is the
+# placeholder name used in the templated question/SQL.
+ENTITY_PATTERNS = {
+    "eq": re.compile(r"\bEQ-\d{4}\b", re.IGNORECASE),
+    "sn": re.compile(r"\bSN-\d+\b", re.IGNORECASE),
+    "part": re.compile(r"\bPart \d+\b", re.IGNORECASE),
+    "p": re.compile(r"\bP-\d+\b", re.IGNORECASE),
+}
+
+_ensured = set()
+_ensure_lock = threading.Lock()
+_stats = {"exact_hits": 0, "template_hits": 0, "misses": 0, "stores": 0}
+_touch_lock = threading.Lock()
+_pending_touches = {}  # db_path -> {(kind, question, fingerprint, model): [last_used_at, hits]}
+_last_touch_flush = {}  # db_path -> time of the last flush
+
+
+# -----------------------------
+# Question normalization / templating
+# -----------------------------
+def normalize_question(question):
+    """Lower-cases, collapses whitespace and drops trailing punctuation."""
+    text = re.sub(r"\s+", " ", question.strip().lower())
+    return text.rstrip(" ?.!")
+
+
+def _canonical_entity(kind, literal):
+    if kind == "part":
+        return "Part " + literal.split()[-1]
+    return literal.upper()
+
+
+def extract_entities(question):
+    """Returns [(kind, canonical literal, span)] for every entity ID in the question, in order."""
+    found = []
+    for kind, pattern in ENTITY_PATTERNS.items():
+        for match in pattern.finditer(question):
+            if any(match.start() < end and start < match.end() for _, _, (start, end) in found):
+                continue  # e.g. "Part 123" already claimed the digits
+            found.append((kind, _canonical_entity(kind, match.group(0)), match.span()))
+    return sorted(found, key=lambda item: item[2][0])
+
+
+def template_question(question):
+    """
+    Replaces entity literals with numbered placeholders, returning the normalized template
+    and the canonical literals, e.g. "Where is EQ-3115 located?" -> ("where is <eq_0> located", ["EQ-3115"]).
+    """
+    entities = extract_entities(question)
+    pieces, literals, last = [], [], 0
+    for index, (kind, literal, (start, end)) in enumerate(entities):
+        pieces.append(question[last:start])
+        pieces.append(f"<{kind}_{index}>")
+        literals.append(literal)
+        last = end
+    pieces.append(question[last:])
+    return normalize_question("".join(pieces)), literals
+
+
+def _template_sql(sql_query, template, literals):
+    """Swaps each literal in the SQL for its placeholder; None if the SQL can't be templated safely."""
+    placeholders = re.findall(r"<(\w+)>", template)
+    templated = sql_query
+    for placeholder, literal in zip(placeholders, literals):
+        quoted = f"'{literal}'"
+        if templated.count(quoted) != 1:
+            return None
+        templated = templated.replace(quoted, "'{{" + placeholder + "}}'")
+    return templated
+
+
+def _fill_template(templated_sql, template, literals):
+    sql_query = templated_sql
+    for placeholder, literal in zip(re.findall(r"<(\w+)>", template), literals):
+        sql_query = sql_query.replace("{{" + placeholder + "}}", literal.replace("'", "''"))
+    return sql_query
+
+
+# -----------------------------
+# Storage
+# -----------------------------
+def _ensure_table(db_path):
+    if db_path in _ensured:
+        return
+    with _ensure_lock:
+        if db_path in _ensured:
+            return
+        with db_pool.get_pool(db_path).writer() as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {CACHE_TABLE} (
+                    kind TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    schema_fingerprint TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    is_template INTEGER NOT NULL DEFAULT 0,
+                    sql TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (kind, question, schema_fingerprint, model)
+                )
+            """)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{CACHE_TABLE}_last_used ON {CACHE_TABLE}(last_used_at)")
+        _ensured.add(db_path)
+
+
+def _lookup(conn, kind, question, fingerprint, model, now):
+    return conn.execute(f"""
+        SELECT sql FROM {CACHE_TABLE}
+        WHERE kind = ? AND question = ? AND schema_fingerprint = ? AND model = ? AND created_at >= ?
+    """, (kind, question, fingerprint, model, now - TTL_SECONDS)).fetchone()
+
+
+def _touch(db_path, kind, question, fingerprint, model, now):
+    """Records a hit; flushes the pending hits on a background thread once enough have piled up."""
+    with _touch_lock:
+        entry = _pending_touches.setdefault(db_path, {}).setdefault((kind, question, fingerprint, model), [now, 0])
+        entry[0] = now
+        entry[1] += 1
+        last_flush = _last_touch_flush.setdefault(db_path, now)
+        due = len(_pending_touches[db_path]) >= TOUCH_FLUSH_SIZE or now - last_flush >= TOUCH_FLUSH_SECONDS
+        if due:
+            _last_touch_flush[db_path] = now
+    if due:
+        threading.Thread(target=flush_touches, args=(db_path,), name="sql-cache-touch", daemon=True).start()
+
+
+def _take_touches(db_path):
+    with _touch_lock:
+        return _pending_touches.pop(db_path, {})
+
+
+def _write_touches(conn, touches):
+    conn.executemany(f"""
+        UPDATE {CACHE_TABLE} SET last_used_at = MAX(last_used_at, ?), hits = hits + ?
+        WHERE kind = ? AND question = ? AND schema_fingerprint = ? AND model = ?
+    """, [(last_used_at, hits, *key) for key, (last_used_at, hits) in touches.items()])
+
+
+def flush_touches(db_path=None):
+    """Writes pending cache hits (for one database or all) in one transaction each."""
+    for path in [db_path] if db_path is not None else list(_pending_touches):
+        touches = _take_touches(path)
+        if not touches:
+            continue
+        try:
+            with db_pool.get_pool(path).writer() as conn:
+                _write_touches(conn, touches)
+        except Exception as e:  # only LRU bookkeeping; never worth failing over
+            logger.warning("Couldn't record %s SQL cache hits: %s", len(touches), e)
+
+
+atexit.register(flush_touches)
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def get_cached_sql(db_path, kind, question, column_metadata, model):
+    """
+    Returns cached SQL for the question, or None on a miss. An exact match on the
+    normalized question wins; otherwise a parameterized template with the same shape
+    (e.g. "where is <eq_0> located") is filled in with this question's entity IDs.
+    """
+    _ensure_table(db_path)
+    fingerprint = schema_cache.get_fingerprint(column_metadata)
+    normalized = normalize_question(question)
+    template, literals = template_question(question)
+    now = time.time()
+
+    with db_pool.get_pool(db_path).reader() as conn:
+        row = _lookup(conn, kind, normalized, fingerprint, model, now)
+        if row is None and literals:
+            template_row = _lookup(conn, kind, template, fingerprint, model, now)
+        else:
+            template_row = None
+
+    if row is not None:
+        _stats["exact_hits"] += 1
+        _touch(db_path, kind, normalized, fingerprint, model, now)
+        return row[0]
+    if template_row is not None:
+        _stats["template_hits"] += 1
+        _touch(db_path, kind, template, fingerprint, model, now)
+        return _fill_template(template_row[0], template, literals)
+
+    _stats["misses"] += 1
+    return None
+
+
+def put_cached_sql(db_path, kind, question, column_metadata, model, sql_query):
+    """
+    Stores generated SQL, plus its parameterized template when it has entity literals.
+    Only store SQL that has been validated (see smatbotest_v.cache_valid_sql).
+    """
+    _ensure_table(db_path)
+    fingerprint = schema_cache.get_fingerprint(column_metadata)
+    template, literals = template_question(question)
+    entries = [(normalize_question(question), 0, sql_query)]
+    if literals:
+        templated_sql = _template_sql(sql_query, template, literals)
+        if templated_sql is not None:
+            entries.append((template, 1, templated_sql))
+
+    now = time.time()
+    with db_pool.get_pool(db_path).writer() as conn:
+        # Pending hits ride along, so the LRU eviction below sees them
+        _write_touches(conn, _take_touches(db_path))
+        conn.executemany(f"""
+            INSERT INTO {CACHE_TABLE} (kind, question, schema_fingerprint, model, is_template, sql, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (kind, question, schema_fingerprint, model)
+            DO UPDATE SET sql = excluded.sql, created_at = excluded.created_at, last_used_at = excluded.last_used_at
+        """, [(kind, q, fingerprint, model, is_template, sql, now, now) for q, is_template, sql in entries])
+
+        # Expire old entries, then evict least-recently-used ones past the size bound
+        conn.execute(f"DELETE FROM {CACHE_TABLE} WHERE created_at < ?", (now - TTL_SECONDS,))
+        conn.execute(f"""
+            DELETE FROM {CACHE_TABLE} WHERE rowid IN (
+                SELECT rowid FROM {CACHE_TABLE} ORDER BY last_used_at ASC
+                LIMIT MAX(0, (SELECT COUNT(*) FROM {CACHE_TABLE}) - ?)
+            )
+        """, (MAX_ENTRIES,))
+    _stats["stores"] += 1
+
+
+def forget_cached_sql(db_path, kind, question, column_metadata, model):
+    """Drops the exact and templated entries for a question whose cached SQL turned out to be bad."""
+    _ensure_table(db_path)
+    fingerprint = schema_cache.get_fingerprint(column_metadata)
+    template, _ = template_question(question)
+    with db_pool.get_pool(db_path).writer() as conn:
+        conn.execute(f"""
+            DELETE FROM {CACHE_TABLE}
+            WHERE kind = ? AND schema_fingerprint = ? AND model = ? AND question IN (?, ?)
+        """, (kind, fingerprint, model, normalize_question(question), template))
+
+
+def cache_stats():
+    return dict(_stats)
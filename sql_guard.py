@@ -0,0 +1,217 @@
+# sql_guard.py (Guardrails around executing LLM-generated SQL)
+import logging
+import re
+import sqlite3
+import time
+from dataclasses import dataclass, field
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Config
+# -----------------------------
+DEFAULT_ROW_CAP = 1000
+DEFAULT_TIMEOUT_SECONDS = 10.0
+DEFAULT_MAX_VM_STEPS = 50_000_000
+PROGRESS_INTERVAL = 10_000          # SQLite VM instructions between progress-handler callbacks
+
+TRAILING_LIMIT = re.compile(r"\bLIMIT\s+(\d+|\?)(\s*(,|OFFSET)\s*(\d+|\?))?\s*$", re.IGNORECASE)
+# Single-quoted strings (skipped) or double-quoted identifiers (group 1)
+QUOTED_TOKEN = re.compile(r"'(?:[^']|'')*'|\"((?:[^\"]|\"\")*)\"")
+# Names a query defines itself: column/table aliases and CTEs (with an optional column list)
+DEFINED_NAME = re.compile(
+    r"\bAS\s+(?:\"((?:[^\"]|\"\")*)\"|(\w+))"
+    r"|(?:\"((?:[^\"]|\"\")*)\"|(\w+))\s*(?:\(([^()]*)\))?\s+AS\s+(?:(?:NOT\s+)?MATERIALIZED\s+)?\(",
+    re.IGNORECASE,
+)
+
+
+class QueryBudgetExceeded(sqlite3.OperationalError):
+    """Raised when a query is interrupted for running past its wall-clock or VM-step budget."""
+
+
+@dataclass
+class GuardReport:
+    executed_sql: str
+    row_cap: int
+    limit_injected: bool = False
+    truncated: bool = False
+    full_scans: list = field(default_factory=list)
+    cartesian_product: bool = False
+    blob_columns_dropped: list = field(default_factory=list)
+    elapsed_s: float = 0.0
+    vm_steps: int = 0
+    paged: bool = False            # row_cap was a page size; rows past it belong to the next page
+
+    def messages(self):
+        """Human-readable notes for every guardrail that kicked in."""
+        notes = []
+        if self.limit_injected:
+            notes.append(f"No LIMIT in the query; capped at {self.row_cap} rows.")
+        if self.truncated and not self.paged:
+            notes.append(f"Result truncated to the first {self.row_cap} rows.")
+        if self.full_scans:
+            notes.append(f"Full table scan on: {', '.join(self.full_scans)}.")
+        if self.cartesian_product:
+            notes.append("Query plan joins tables without a usable constraint (Cartesian product).")
+        if self.blob_columns_dropped:
+            notes.append(f"BLOB columns left out of the result: {', '.join(self.blob_columns_dropped)}.")
+        return notes
+
+
+# -----------------------------
+# Query rewriting / plan inspection
+# -----------------------------
+def _quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def inspect_query_plan(conn, sql_query, params=()):
+    """
+    Returns (tables read by a full scan, whether the plan nests two scans in one join =
+    Cartesian product). Index lookups show up as SEARCH and are not flagged.
+    """
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql_query}", params).fetchall()
+    # Scans of subquery results and CTEs read rows already produced (and checked) elsewhere in the plan
+    derived = {match.group(1) for *_, detail in plan
+               if (match := re.match(r"(?:MATERIALIZE|CO-ROUTINE) (\S+)", detail))}
+    full_scans, scans_per_parent = [], {}
+    for _, parent, _, detail in plan:
+        match = re.match(r"SCAN (\S+)(.*)$", detail)
+        if match and (match.group(1) in derived or re.match(r"\(subquery-\d+\)$|SUBQUERY$", match.group(1))):
+            continue
+        if match and re.search(r"VIRTUAL TABLE INDEX \d+:\S", match.group(2)):
+            continue  # virtual table driven by a constraint, e.g. an FTS5 MATCH
+        if match:
+            full_scans.append(match.group(1) + (" (index scan)" if "USING" in match.group(2) else ""))
+            scans_per_parent[parent] = scans_per_parent.get(parent, 0) + 1
+    cartesian = any(count > 1 for count in scans_per_parent.values())
+    return full_scans, cartesian
+
+
+def _drop_blob_columns(conn, sql_query, params, blob_columns):
+    """Wraps the query so BLOB columns are never read; returns (sql, dropped column names)."""
+    cursor = conn.execute(f"SELECT * FROM (\n{sql_query}\n) LIMIT 0", params)
+    columns = [col[0] for col in cursor.description]
+    cursor.close()
+    dropped = [col for col in columns if col in blob_columns]
+    if not dropped:
+        return sql_query, []
+    kept = [col for col in columns if col not in blob_columns]
+    if not kept:
+        return sql_query, []  # nothing but BLOBs: leave it to the caller's row cap
+    select = ", ".join(_quote_identifier(col) for col in kept)
+    return f"SELECT {select} FROM (\n{sql_query}\n)", dropped
+
+
+# -----------------------------
+# Identifier checks
+# -----------------------------
+_schema_names = {}     # (database file, schema_version) -> lower-cased table and column names
+
+
+def _known_schema_names(conn):
+    key = (conn.execute("PRAGMA database_list").fetchone()[2], conn.execute("PRAGMA schema_version").fetchone()[0])
+    names = _schema_names.get(key)
+    if names is None:
+        names = set()
+        for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')").fetchall():
+            names.add(table.lower())
+            names.update(row[1].lower() for row in conn.execute(f"PRAGMA table_info({_quote_identifier(table)})"))
+        _schema_names[key] = names
+    return names
+
+
+def unknown_quoted_identifiers(conn, sql_query):
+    """
+    Double-quoted names in sql_query that are neither a table/column of the database nor
+    an alias or CTE the query defines. SQLite falls back to reading an unknown "name" as a
+    string literal, so EXPLAIN alone accepts a misspelled quoted column.
+    """
+    defined = set()
+    for match in DEFINED_NAME.finditer(sql_query):
+        alias, bare_alias, cte, bare_cte, cte_columns = match.groups()
+        name = next((n for n in (alias, bare_alias, cte, bare_cte) if n is not None), None)
+        if name is not None:
+            defined.add(name.replace('""', '"').lower())
+        for column in (cte_columns or "").split(","):
+            defined.add(column.strip().strip('"').lower())
+    known = _known_schema_names(conn) | defined
+    unknown = []
+    for match in QUOTED_TOKEN.finditer(sql_query):
+        name = match.group(1)
+        if name is not None and name.replace('""', '"').lower() not in known and name not in unknown:
+            unknown.append(name.replace('""', '"'))
+    return unknown
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def guarded_execute(conn, sql_query, params=(), blob_columns=(), allow_blobs=False,
+                    row_cap=DEFAULT_ROW_CAP, timeout_seconds=DEFAULT_TIMEOUT_SECONDS,
+                    max_vm_steps=DEFAULT_MAX_VM_STEPS, paged=False):
+    """
+    Runs a SELECT on a (read-only) connection with guardrails: BLOB columns dropped unless
+    allow_blobs, a LIMIT injected when missing, the plan checked for full scans and
+    Cartesian products, and a wall-clock / VM-step budget enforced through a progress
+    handler. Returns (column names, rows, GuardReport). With paged, row_cap is a page size
+    (see result_pages.py) and hitting it is not reported as truncation.
+    """
+    sql_query = sql_query.strip().rstrip(";").strip()
+    if not re.match(r"^(SELECT|WITH)\b", sql_query, re.IGNORECASE):
+        raise sqlite3.OperationalError("Only a single SELECT statement may be executed.")
+
+    # Checked before any wrapping: the BLOB-dropping wrapper keeps the query's own LIMIT inside it
+    limit_injected = not TRAILING_LIMIT.search(sql_query)
+    dropped = []
+    if not allow_blobs and blob_columns:
+        sql_query, dropped = _drop_blob_columns(conn, sql_query, params, set(blob_columns))
+
+    if limit_injected:
+        # Newline first so a trailing "-- comment" can't swallow the LIMIT
+        sql_query = f"{sql_query}\nLIMIT {row_cap + 1}"
+
+    report = GuardReport(executed_sql=sql_query, row_cap=row_cap, limit_injected=limit_injected,
+                         blob_columns_dropped=dropped, paged=paged)
+    report.full_scans, report.cartesian_product = inspect_query_plan(conn, sql_query, params)
+
+    started = time.perf_counter()
+    steps = [0]
+    aborted = [None]
+
+    def progress_handler():
+        steps[0] += PROGRESS_INTERVAL
+        if steps[0] > max_vm_steps:
+            aborted[0] = f"exceeded the budget of {max_vm_steps:,} VM steps"
+            return 1
+        if time.perf_counter() - started > timeout_seconds:
+            aborted[0] = f"exceeded the {timeout_seconds:g}s time budget"
+            return 1
+        return 0
+
+    conn.set_progress_handler(progress_handler, PROGRESS_INTERVAL)
+    try:
+        cursor = conn.execute(sql_query, params)
+        columns = [col[0] for col in cursor.description]
+        rows = cursor.fetchmany(row_cap + 1)
+        cursor.close()
+    except sqlite3.OperationalError as e:
+        if aborted[0]:
+            logger.warning("Query aborted (%s): %s", aborted[0], sql_query)
+            raise QueryBudgetExceeded(f"Query {aborted[0]}") from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+    report.truncated = len(rows) > row_cap
+    rows = rows[:row_cap]
+    report.elapsed_s = time.perf_counter() - started
+    report.vm_steps = steps[0]
+
+    notes = report.messages()
+    if notes:
+        logger.warning("SQL guardrails: %s Query: %s", " ".join(notes), sql_query)
+    logger.info("Guarded query returned %s rows in %.3fs (~%s VM steps)", len(rows), report.elapsed_s, report.vm_steps)
+    return columns, rows, report
@@ -0,0 +1,427 @@
+# telemetry.py (Per-stage spans, LLM token usage and Prometheus metrics for the pipeline)
+#
+# Pipeline functions run inside spans (`with telemetry.span("fetch_answer_from_db"):` or
+# the @telemetry.traced decorator). A finished span costs a perf_counter pair and an
+# append to an in-memory buffer: aggregates for Prometheus are updated in place and a
+# background thread writes the buffered spans to the pipeline_spans table every few
+# seconds in one executemany, so nothing on the request path waits for SQLite.
+#
+# Usage:
+#   python telemetry.py summary --db app/assets_data.db --window 3600
+#   python telemetry.py prometheus --db app/assets_data.db
+#   python telemetry.py serve --db app/assets_data.db --port 9464     # GET /metrics
+import argparse
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import db_pool
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Config
+# -----------------------------
+SPANS_TABLE = "pipeline_spans"
+ENABLED = os.environ.get("SMARTASSET_TELEMETRY", "1") != "0"
+FLUSH_INTERVAL_SECONDS = 5.0
+FLUSH_BATCH_SIZE = 500                 # flush early when this many spans are waiting
+MAX_BUFFERED_SPANS = 20000             # drop (and count) spans beyond this if SQLite can't keep up
+RETENTION_SECONDS = 7 * 24 * 3600
+METRIC_PREFIX = "smartasset"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Numeric span fields with their own column (summed into Prometheus counters); anything else goes to attrs
+NUMERIC_FIELDS = ("prompt_tokens", "completion_tokens", "rows", "blob_bytes", "attempts")
+
+_db_path = None
+_current = contextvars.ContextVar("telemetry_span", default=None)
+_buffer = []
+_buffer_lock = threading.Lock()
+_flusher = None
+_flush_requested = threading.Event()
+_ensured = set()
+_ensure_lock = threading.Lock()
+
+
+def configure(db_path):
+    """Sets the database the spans table lives in (the asset database, as for the SQL cache)."""
+    global _db_path
+    _db_path = db_path
+
+
+# -----------------------------
+# Aggregates (Prometheus)
+# -----------------------------
+class Aggregates:
+    """Running totals per span name; rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = {}            # name -> [bucket counts..., +Inf count, sum]
+        self.errors = {}               # name -> count
+        self.numeric = {}              # (name, field) -> total
+        self.tokens = {}               # (stage, kind) -> total, stage = the span the LLM call ran under
+        self.cache = {}                # (name, outcome) -> count
+        self.dropped = 0
+
+    def add(self, entry):
+        name, duration = entry["name"], entry["duration_ms"] / 1000
+        with self._lock:
+            histogram = self.durations.setdefault(name, [0] * (len(LATENCY_BUCKETS) + 1) + [0.0])
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    histogram[i] += 1
+            histogram[len(LATENCY_BUCKETS)] += 1
+            histogram[-1] += duration
+            if entry["status"] != "ok":
+                self.errors[name] = self.errors.get(name, 0) + 1
+            for field in NUMERIC_FIELDS:
+                value = entry.get(field)
+                if value:
+                    self.numeric[(name, field)] = self.numeric.get((name, field), 0) + value
+            for kind in ("prompt", "completion"):
+                value = entry.get(f"{kind}_tokens")
+                if value:
+                    key = (entry.get("parent") or name, kind)
+                    self.tokens[key] = self.tokens.get(key, 0) + value
+            cache = (entry.get("attrs") or {}).get("cache")
+            if cache:
+                self.cache[(name, cache)] = self.cache.get((name, cache), 0) + 1
+
+    def render(self):
+        p = METRIC_PREFIX
+        lines = [f"# HELP {p}_stage_duration_seconds Wall time of each pipeline stage.",
+                 f"# TYPE {p}_stage_duration_seconds histogram"]
+        with self._lock:
+            for name, histogram in sorted(self.durations.items()):
+                for bound, count in zip(LATENCY_BUCKETS, histogram):
+                    lines.append(f'{p}_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'{p}_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {histogram[len(LATENCY_BUCKETS)]}')
+                lines.append(f'{p}_stage_duration_seconds_sum{{stage="{name}"}} {histogram[-1]:.6f}')
+                lines.append(f'{p}_stage_duration_seconds_count{{stage="{name}"}} {histogram[len(LATENCY_BUCKETS)]}')
+            lines += [f"# HELP {p}_stage_errors_total Stage runs that raised or reported an error.",
+                      f"# TYPE {p}_stage_errors_total counter"]
+            lines += [f'{p}_stage_errors_total{{stage="{name}"}} {count}' for name, count in sorted(self.errors.items())]
+            lines += [f"# HELP {p}_llm_tokens_total LLM tokens by the stage that made the call.",
+                      f"# TYPE {p}_llm_tokens_total counter"]
+            lines += [f'{p}_llm_tokens_total{{stage="{stage}",type="{kind}"}} {count}'
+                      for (stage, kind), count in sorted(self.tokens.items())]
+            for field, help_text in (("rows", "Result rows returned."), ("blob_bytes", "Document bytes read."),
+                                     ("attempts", "SQL generation attempts, including repairs.")):
+                lines += [f"# HELP {p}_{field}_total {help_text}", f"# TYPE {p}_{field}_total counter"]
+                lines += [f'{p}_{field}_total{{stage="{name}"}} {value}'
+                          for (name, f), value in sorted(self.numeric.items()) if f == field]
+            lines += [f"# HELP {p}_cache_lookups_total SQL cache lookups by outcome.",
+                      f"# TYPE {p}_cache_lookups_total counter"]
+            lines += [f'{p}_cache_lookups_total{{stage="{name}",outcome="{outcome}"}} {count}'
+                      for (name, outcome), count in sorted(self.cache.items())]
+            lines += [f"# HELP {p}_spans_dropped_total Spans not persisted because the buffer was full.",
+                      f"# TYPE {p}_spans_dropped_total counter", f"{p}_spans_dropped_total {self.dropped}"]
+        return "\n".join(lines) + "\n"
+
+
+_aggregates = Aggregates()
+
+
+# -----------------------------
+# Spans
+# -----------------------------
+class Span:
+    __slots__ = ("name", "trace_id", "parent", "fields", "_started")
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.fields = {}
+        self._started = time.perf_counter()
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def add(self, **fields):
+        for key, value in fields.items():
+            self.fields[key] = self.fields.get(key, 0) + (value or 0)
+
+
+def annotate(**fields):
+    """Sets fields (rows=..., cache="hit", ...) on the innermost active span; no-op outside one."""
+    current = _current.get()
+    if current is not None:
+        current.set(**fields)
+
+
+def record(name, duration_s, parent=None, trace_id=None, error=None, **fields):
+    """Records a finished span; for code (async generators) that can't hold a `with span()` open."""
+    if not ENABLED:
+        return
+    attrs = {key: value for key, value in fields.items() if key not in NUMERIC_FIELDS and value is not None}
+    entry = {
+        "trace_id": trace_id or uuid.uuid4().hex[:16],
+        "name": name,
+        "parent": parent,
+        "started_at": time.time() - duration_s,
+        "duration_ms": round(duration_s * 1000, 3),
+        "status": "error" if error else "ok",
+        "error": str(error)[:500] if error else None,
+        "attrs": attrs or None,
+        **{field: fields.get(field) for field in NUMERIC_FIELDS},
+    }
+    _aggregates.add(entry)
+    with _buffer_lock:
+        if len(_buffer) >= MAX_BUFFERED_SPANS:
+            _aggregates.dropped += 1
+            return
+        _buffer.append(entry)
+        flush_now = len(_buffer) >= FLUSH_BATCH_SIZE
+    _start_flusher()
+    if flush_now:
+        _flush_requested.set()
+
+
+@contextmanager
+def span(name, **fields):
+    """Times the block as a stage; nested spans share a trace_id and record their parent."""
+    if not ENABLED:
+        yield Span(name)
+        return
+    parent = _current.get()
+    current = Span(name, parent)
+    current.set(**fields)
+    token = _current.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        duration = time.perf_counter() - current._started
+        error = error or current.fields.pop("error", None)
+        record(name, duration, parent=parent.name if parent else None, trace_id=current.trace_id,
+               error=error, **current.fields)
+
+
+def traced(name=None):
+    """Decorator form of span(), named after the function unless name is given."""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span_name():
+    current = _current.get()
+    return current.name if current is not None else None
+
+
+def record_llm_usage(usage):
+    """Adds a chat completion's usage (prompt/completion tokens) to the active span."""
+    current = _current.get()
+    if current is None or usage is None:
+        return
+    current.add(prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                completion_tokens=getattr(usage, "completion_tokens", 0) or 0)
+
+
+# -----------------------------
+# Persistence
+# -----------------------------
+def ensure_table(conn):
+    numeric_columns = ", ".join(f"{field} INTEGER" for field in NUMERIC_FIELDS)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SPANS_TABLE} (
+            id INTEGER PRIMARY KEY,
+            trace_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            parent TEXT,
+            started_at REAL NOT NULL,
+            duration_ms REAL NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            {numeric_columns},
+            attrs TEXT
+        )
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{SPANS_TABLE}_started_at ON {SPANS_TABLE}(started_at)")
+
+
+def _ensure_table(db_path):
+    if db_path in _ensured:
+        return
+    with _ensure_lock:
+        if db_path in _ensured:
+            return
+        with db_pool.get_pool(db_path).writer() as conn:
+            ensure_table(conn)
+        _ensured.add(db_path)
+
+
+def flush():
+    """Writes buffered spans to the spans table (and trims old ones). Safe to call from any thread."""
+    global _buffer
+    if _db_path is None:
+        return 0
+    with _buffer_lock:
+        pending, _buffer = _buffer, []
+    if not pending:
+        return 0
+    if not os.path.exists(_db_path):
+        # Spans go next to the asset data; never create a metrics-only asset database
+        logger.debug("Telemetry: %s doesn't exist; %s spans not stored", _db_path, len(pending))
+        return 0
+    columns = ["trace_id", "name", "parent", "started_at", "duration_ms", "status", "error", *NUMERIC_FIELDS, "attrs"]
+    try:
+        _ensure_table(_db_path)
+        with db_pool.get_pool(_db_path).writer() as conn:
+            conn.executemany(
+                f"INSERT INTO {SPANS_TABLE} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                [[json.dumps(entry[col]) if col == "attrs" and entry[col] else entry[col] for col in columns]
+                 for entry in pending])
+            conn.execute(f"DELETE FROM {SPANS_TABLE} WHERE started_at < ?", (time.time() - RETENTION_SECONDS,))
+    except Exception as e:  # metrics must never take the app down
+        logger.warning("Telemetry flush failed (%s spans lost): %s", len(pending), e)
+        return 0
+    return len(pending)
+
+
+def _flush_forever():
+    while True:
+        _flush_requested.wait(FLUSH_INTERVAL_SECONDS)
+        _flush_requested.clear()
+        flush()
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is None:
+        with _buffer_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_forever, name="telemetry-flush", daemon=True)
+                _flusher.start()
+                atexit.register(flush)
+
+
+# -----------------------------
+# Reading
+# -----------------------------
+def prometheus_text():
+    """Metrics of this process since it started, in the Prometheus text format."""
+    return _aggregates.render()
+
+
+def _load_spans(conn, window_s=None):
+    sql = f"SELECT name, parent, duration_ms, status, {', '.join(NUMERIC_FIELDS)}, attrs FROM {SPANS_TABLE}"
+    params = ()
+    if window_s:
+        sql += " WHERE started_at >= ?"
+        params = (time.time() - window_s,)
+    cursor = conn.execute(sql, params)
+    columns = [col[0] for col in cursor.description]
+    for row in cursor:
+        entry = dict(zip(columns, row))
+        entry["attrs"] = json.loads(entry["attrs"]) if entry["attrs"] else None
+        yield entry
+
+
+def stored_prometheus_text(db_path, window_s=None):
+    """Prometheus metrics rebuilt from the spans table, so they cover every process writing to it."""
+    _ensure_table(db_path)
+    aggregates = Aggregates()
+    with db_pool.get_pool(db_path).reader() as conn:
+        for entry in _load_spans(conn, window_s):
+            aggregates.add(entry)
+    return aggregates.render()
+
+
+def stage_summary(db_path, window_s=3600):
+    """Per-stage calls, throughput, latency percentiles, errors and tokens over the last window_s seconds."""
+    _ensure_table(db_path)
+    stages = {}
+    with db_pool.get_pool(db_path).reader() as conn:
+        for entry in _load_spans(conn, window_s):
+            stage = stages.setdefault(entry["name"], {"durations": [], "errors": 0, "tokens": 0, "rows": 0})
+            stage["durations"].append(entry["duration_ms"])
+            stage["errors"] += entry["status"] != "ok"
+            stage["tokens"] += (entry["prompt_tokens"] or 0) + (entry["completion_tokens"] or 0)
+            stage["rows"] += entry["rows"] or 0
+    summary = []
+    for name, stage in sorted(stages.items()):
+        durations = sorted(stage["durations"])
+        summary.append({
+            "stage": name,
+            "calls": len(durations),
+            "per_min": round(len(durations) / (window_s / 60), 2) if window_s else None,
+            "p50_ms": round(durations[len(durations) // 2], 1),
+            "p95_ms": round(durations[min(len(durations) - 1, int(0.95 * len(durations)))], 1),
+            "errors": stage["errors"],
+            "tokens": stage["tokens"],
+            "rows": stage["rows"],
+        })
+    return summary
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def _serve(db_path, port, window_s):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = stored_prometheus_text(db_path, window_s).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    print(f"📈 Serving http://0.0.0.0:{port}/metrics from {db_path}")
+    ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler).serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and export pipeline telemetry.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, help_text in (("summary", "Per-stage latency table"),
+                               ("prometheus", "Print metrics in the Prometheus text format"),
+                               ("serve", "Serve /metrics for a Prometheus scraper")):
+        sub = subparsers.add_parser(command, help=help_text)
+        sub.add_argument("--db", default="app/assets_data.db")
+        sub.add_argument("--window", type=float, default=3600 if command == "summary" else None,
+                         help="Only spans from the last N seconds")
+        if command == "serve":
+            sub.add_argument("--port", type=int, default=9464)
+    args = parser.parse_args(argv)
+
+    if args.command == "summary":
+        for row in stage_summary(args.db, args.window):
+            print(f"{row['stage']:<32} {row['calls']:>6} calls  {row['per_min']:>7}/min  p50 {row['p50_ms']:>8} ms  "
+                  f"p95 {row['p95_ms']:>8} ms  {row['errors']} errors  {row['tokens']} tokens")
+    elif args.command == "prometheus":
+        print(stored_prometheus_text(args.db, args.window), end="")
+    else:
+        _serve(args.db, args.port, args.window)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# test_sql_guard.py (Quoted-identifier checks that EXPLAIN alone lets through)
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sql_guard  # noqa: E402
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / "assets.db")
+    conn.execute('CREATE TABLE filled_asset_data ("Equipment ID" TEXT, "Rack" TEXT)')
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("sql_query, unknown", [
+    ('SELECT "No Such Column" FROM filled_asset_data', ["No Such Column"]),
+    ('SELECT "Equipment Identifier", COUNT(*) FROM filled_asset_data GROUP BY "Equipment Identifier"',
+     ["Equipment Identifier"]),
+    ('SELECT "Equipment ID" FROM filled_asset_data WHERE "Rack" = "Rack A"', ["Rack A"]),
+    ('SELECT "Rack", COUNT(*) AS "n" FROM filled_asset_data GROUP BY "Rack" ORDER BY "n" DESC', []),
+    ('SELECT "Rack", COUNT(*) AS cnt FROM filled_asset_data GROUP BY "Rack" ORDER BY "cnt"', []),
+    ('WITH "r"("rk", "c") AS (SELECT "Rack", COUNT(*) FROM filled_asset_data GROUP BY 1) '
+     'SELECT "rk" FROM "r" WHERE "c" > 1', []),
+    ("SELECT \"Equipment ID\" FROM filled_asset_data WHERE \"Rack\" = 'Rack \"A\"'", []),
+])
+def test_unknown_quoted_identifiers(conn, sql_query, unknown):
+    conn.execute(f"EXPLAIN {sql_query}").fetchall()  # SQLite itself accepts every one of these
+    assert sql_guard.unknown_quoted_identifiers(conn, sql_query) == unknown
+
+
+def test_validate_sql_reports_misspelled_quoted_column(tmp_path, monkeypatch):
+    smatbotest_v = pytest.importorskip("smatbotest_v")
+    db_path = str(tmp_path / "assets.db")
+    with sqlite3.connect(db_path) as setup:
+        setup.execute('CREATE TABLE filled_asset_data ("Equipment ID" TEXT, "Rack" TEXT)')
+    monkeypatch.setattr(smatbotest_v, "DB_PATH", db_path)
+
+    assert "no such column" in smatbotest_v.validate_sql('SELECT "No Such Column" FROM filled_asset_data')
+    assert smatbotest_v.validate_sql('SELECT "Rack" FROM filled_asset_data') is None
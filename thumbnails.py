@@ -0,0 +1,314 @@
+# thumbnails.py (Downscaled previews of stored documents, cached in SQLite with LRU eviction)
+#
+# Images are decoded with OpenCV and re-encoded as small WebP (JPEG if this OpenCV build
+# has no WebP encoder). PDFs get a raster of their first page when PyMuPDF is installed.
+#
+# Usage (generate previews for documents uploaded before this cache existed):
+#   python thumbnails.py backfill --db app/assets_data.db --workers 4
+import argparse
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import db_pool
+import document_store
+
+# OpenCV and PyMuPDF are imported inside the rendering functions: the UI imports this
+# module at startup but only needs them when a preview is actually rendered.
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Config
+# -----------------------------
+THUMBNAIL_TABLE = "document_thumbnails"
+MAX_SIDE = 320                          # longest edge of a thumbnail, in pixels
+WEBP_QUALITY = 80
+JPEG_QUALITY = 80
+MAX_CACHE_BYTES = 64 * 1024 * 1024      # total thumbnail bytes kept before LRU eviction
+BACKFILL_BATCH_SIZE = 50
+# Cache hits update last_used_at in memory; they are written in one transaction per batch,
+# off the request path, so a thumbnail view never waits behind uploads for the writer
+TOUCH_FLUSH_SIZE = 200
+TOUCH_FLUSH_SECONDS = 30.0
+
+_ensured = set()
+_ensure_lock = threading.Lock()
+_touch_lock = threading.Lock()
+_pending_touches = {}                   # db_path -> {sha256: last_used_at}
+_last_touch_flush = {}                  # db_path -> time of the last flush
+_webp_supported = None
+
+
+# -----------------------------
+# Rendering (pure functions, safe to run in worker processes)
+# -----------------------------
+def _encode(image):
+    """Encodes a BGR image as WebP when supported, else JPEG; returns (bytes, mime)."""
+    global _webp_supported
+    import cv2
+
+    if _webp_supported is not False:
+        ok, buffer = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY])
+        _webp_supported = bool(ok)
+        if ok:
+            return buffer.tobytes(), "image/webp"
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise ValueError("OpenCV could not encode the thumbnail")
+    return buffer.tobytes(), "image/jpeg"
+
+
+def _downscale(image, max_side):
+    import cv2
+
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def _decode_image(data, max_side):
+    import cv2
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    # Let libjpeg downscale while decoding when the photo is far larger than the thumbnail
+    # (much faster and lighter on multi-megapixel phone JPEGs). IMREAD_* also applies EXIF rotation.
+    probe = cv2.imdecode(buffer, cv2.IMREAD_REDUCED_COLOR_8)
+    if probe is not None and max(probe.shape[:2]) >= max_side:
+        return probe
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+def _render_pdf_first_page(data, max_side):
+    import cv2
+
+    try:
+        import fitz  # PyMuPDF, optional: only needed for PDF previews
+    except ImportError:
+        return None
+    with fitz.open(stream=data, filetype="pdf") as pdf:
+        if pdf.page_count == 0:
+            return None
+        page = pdf[0]
+        zoom = max_side / max(page.rect.width, page.rect.height)
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        image = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+        return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+
+def render_thumbnail(data, mime, max_side=MAX_SIDE):
+    """
+    Returns (thumbnail bytes, thumbnail mime) for an image or PDF, or None when the
+    document can't be previewed (unknown type, undecodable data, PyMuPDF missing).
+    """
+    mime = (mime or "").lower()
+    if mime == "application/pdf":
+        image = _render_pdf_first_page(data, max_side)
+    elif mime.startswith("image/"):
+        image = _decode_image(data, max_side)
+    else:
+        return None
+    if image is None:
+        return None
+    return _encode(_downscale(image, max_side))
+
+
+# -----------------------------
+# Storage
+# -----------------------------
+def _ensure_table(db_path):
+    if db_path in _ensured:
+        return
+    with _ensure_lock:
+        if db_path in _ensured:
+            return
+        with db_pool.get_pool(db_path).writer() as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {THUMBNAIL_TABLE} (
+                    sha256 TEXT PRIMARY KEY,
+                    mime TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+            """)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{THUMBNAIL_TABLE}_last_used ON {THUMBNAIL_TABLE}(last_used_at)")
+        _ensured.add(db_path)
+
+
+def _evict(conn, max_bytes=MAX_CACHE_BYTES):
+    """Deletes least-recently-used thumbnails until the cache fits max_bytes."""
+    total = conn.execute(f"SELECT COALESCE(SUM(bytes), 0) FROM {THUMBNAIL_TABLE}").fetchone()[0]
+    if total <= max_bytes:
+        return 0
+    evicted = 0
+    for sha256, size in conn.execute(f"SELECT sha256, bytes FROM {THUMBNAIL_TABLE} ORDER BY last_used_at ASC").fetchall():
+        if total <= max_bytes:
+            break
+        conn.execute(f"DELETE FROM {THUMBNAIL_TABLE} WHERE sha256 = ?", (sha256,))
+        total -= size
+        evicted += 1
+    logger.info("Thumbnail cache: evicted %s entries to stay under %s bytes", evicted, max_bytes)
+    return evicted
+
+
+def put_thumbnails(db_path, thumbnails):
+    """Stores [(sha256, thumbnail bytes, mime)] in one transaction, then applies LRU eviction."""
+    _ensure_table(db_path)
+    now = time.time()
+    with db_pool.get_pool(db_path).writer() as conn:
+        conn.executemany(f"""
+            INSERT OR REPLACE INTO {THUMBNAIL_TABLE} (sha256, mime, data, bytes, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(sha256, mime, data, len(data), now, now) for sha256, data, mime in thumbnails])
+        # Pending hits ride along, so the eviction below sees them
+        _write_touches(conn, _take_touches(db_path))
+        _evict(conn)
+
+
+def _touch(db_path, sha256, now):
+    """Records a hit; flushes the pending hits on a background thread once enough have piled up."""
+    with _touch_lock:
+        pending = _pending_touches.setdefault(db_path, {})
+        pending[sha256] = now
+        last_flush = _last_touch_flush.setdefault(db_path, now)
+        due = len(pending) >= TOUCH_FLUSH_SIZE or now - last_flush >= TOUCH_FLUSH_SECONDS
+        if due:
+            _last_touch_flush[db_path] = now
+    if due:
+        threading.Thread(target=flush_touches, args=(db_path,), name="thumbnail-touch", daemon=True).start()
+
+
+def _take_touches(db_path):
+    with _touch_lock:
+        return _pending_touches.pop(db_path, {})
+
+
+def _write_touches(conn, touches):
+    conn.executemany(f"UPDATE {THUMBNAIL_TABLE} SET last_used_at = MAX(last_used_at, ?) WHERE sha256 = ?",
+                     [(last_used_at, sha256) for sha256, last_used_at in touches.items()])
+
+
+def flush_touches(db_path=None):
+    """Writes pending cache hits (for one database or all) in one transaction each."""
+    for path in [db_path] if db_path is not None else list(_pending_touches):
+        touches = _take_touches(path)
+        if not touches:
+            continue
+        try:
+            with db_pool.get_pool(path).writer() as conn:
+                _write_touches(conn, touches)
+        except Exception as e:  # only LRU bookkeeping; never worth failing over
+            logger.warning("Couldn't record %s thumbnail cache hits: %s", len(touches), e)
+
+
+atexit.register(flush_touches)
+
+
+def get_thumbnail(db_path, sha256):
+    """Cached (thumbnail bytes, mime) for a document, or None on a miss."""
+    _ensure_table(db_path)
+    with db_pool.get_pool(db_path).reader() as conn:
+        row = conn.execute(f"SELECT data, mime FROM {THUMBNAIL_TABLE} WHERE sha256 = ?", (sha256,)).fetchone()
+    if row is None:
+        return None
+    _touch(db_path, sha256, time.time())
+    return row[0], row[1]
+
+
+def ensure_thumbnail(db_path, sha256, mime):
+    """
+    Returns the cached thumbnail, rendering and storing it first on a miss (reads the
+    original from the document store). None when the document has no preview.
+    """
+    cached = get_thumbnail(db_path, sha256)
+    if cached is not None:
+        return cached
+    with db_pool.get_pool(db_path).reader() as conn:
+        data = document_store.read_document(conn, sha256)
+    rendered = render_thumbnail(data, mime)
+    if rendered is None:
+        return None
+    put_thumbnails(db_path, [(sha256, rendered[0], rendered[1])])
+    return rendered
+
+
+# -----------------------------
+# Backfill
+# -----------------------------
+def _render_stored_document(db_path, sha256, mime):
+    """Worker: reads one document on its own read-only connection and renders its thumbnail."""
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        data = document_store.read_document(conn, sha256)
+    finally:
+        conn.close()
+    try:
+        return sha256, render_thumbnail(data, mime)
+    except Exception as e:  # one corrupt file shouldn't stop the backfill
+        logger.warning("Thumbnail failed for %s: %s", sha256, e)
+        return sha256, None
+
+
+def backfill_thumbnails(db_path, workers=None):
+    """
+    Renders thumbnails for every stored document that has none, on a process pool;
+    results are written by this process in batches. Returns a summary dict.
+    """
+    _ensure_table(db_path)
+    document_store.ensure_schema_once(db_path)
+    with db_pool.get_pool(db_path).reader() as conn:
+        pending = conn.execute(f"""
+            SELECT d.sha256, d.mime FROM documents d
+            LEFT JOIN {THUMBNAIL_TABLE} t ON t.sha256 = d.sha256
+            WHERE t.sha256 IS NULL
+        """).fetchall()
+
+    summary = {"pending": len(pending), "rendered": 0, "skipped": 0}
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_render_stored_document, db_path, sha256, mime) for sha256, mime in pending]
+        for future in as_completed(futures):
+            sha256, rendered = future.result()
+            if rendered is None:
+                summary["skipped"] += 1
+                continue
+            batch.append((sha256, rendered[0], rendered[1]))
+            summary["rendered"] += 1
+            if len(batch) >= BACKFILL_BATCH_SIZE:
+                put_thumbnails(db_path, batch)
+                batch = []
+    if batch:
+        put_thumbnails(db_path, batch)
+    return summary
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the document thumbnail cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill = subparsers.add_parser("backfill", help="Render thumbnails for documents that have none")
+    backfill.add_argument("--db", default="app/assets_data.db")
+    backfill.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    summary = backfill_thumbnails(args.db, args.workers)
+    print(f"🖼️ Rendered {summary['rendered']} of {summary['pending']} missing thumbnails "
+          f"({summary['skipped']} without a preview) in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()